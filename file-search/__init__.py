@@ -18,6 +18,15 @@
 #
 # FileSearchPlugin is the main plugin class.
 #
+# Without gedit (when running the command line search in __main__.py), only
+# the search modules are available.
+#
+
+try:
+    from gi.repository import Gedit
+except ImportError:
+    Gedit = None
 
-from .plugin import FileSearchAppHelper, FileSearchWindowHelper
+if Gedit is not None:
+    from .plugin import FileSearchAppHelper, FileSearchWindowHelper
 
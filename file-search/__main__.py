@@ -0,0 +1,186 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Command line search, without gedit (eg. for profiling, or for reproducing
+# slow searches). Run it from the directory which contains the plugin:
+#
+#   python3 -m file-search [options] TEXT [DIRECTORY]
+#
+# The search uses the same backends and settings as the plugin (options given
+# on the command line override the settings), and prints the results to stdout.
+#
+# Helper classes:
+# - CommandLineHandler (result handler which prints the results)
+#
+
+
+import os
+import sys
+import json
+import argparse
+from gi.repository import GLib
+
+from .search_query import SearchQuery, SchemaDefaults, loadSettings
+from .backends import BACKEND_NAMES, createSearchProcess
+
+
+# switches for the boolean settings: (option name, SearchQuery attribute, help text)
+SWITCHES = [
+    ("case-sensitive", "caseSensitive", "match upper/lower case exactly"),
+    ("whole-word", "wholeWord", "only match whole words"),
+    ("reg-exp", "isRegExp", "TEXT is a basic regular expression, like for grep (with Python syntax for the python backend)"),
+    ("include-subfolders", "includeSubfolders", "also search in subfolders"),
+    ("exclude-hidden", "excludeHidden", "skip hidden files and folders"),
+    ("exclude-backup", "excludeBackup", "skip backup files"),
+    ("exclude-vcs", "excludeVCS", "skip version control folders"),
+    ("exclude-ignored", "excludeIgnored", "skip files listed in ignore files (like .gitignore)"),
+    ("stream-file-list", "streamFileList", "start searching while the folder tree is still being read"),
+]
+
+
+class CommandLineHandler:
+    """
+    Result handler which prints each result as a line of text ("file:lineno:text")
+    or of JSON, and stops the main loop when the search is finished.
+    """
+    def __init__ (self, loop, out, useJSON):
+        self.loop = loop
+        self.out = out # (binary stream, as file names don't have a known encoding)
+        self.useJSON = useJSON
+        self.process = None
+        self.numResults = 0
+        self.outputClosed = False
+
+    def handleResults (self, results):
+        if self.outputClosed:
+            return
+        self.process.stats.addResults(len(results))
+        self.numResults += len(results)
+        lines = []
+        for (filename, lineno, linetext) in results:
+            if self.useJSON:
+                entry = {"file": os.fsdecode(filename), "line": lineno, "text": linetext}
+                lines.append(json.dumps(entry).encode("utf-8") + b"\n")
+            else:
+                lines.append(b"%s:%d:%s\n" % (filename, lineno, linetext.encode("utf-8", "replace")))
+        try:
+            self.out.write(b"".join(lines))
+            self.out.flush()
+        except BrokenPipeError:
+            # (eg. when piping into `head`)
+            self.outputClosed = True
+            self.process.cancel()
+            self.handleFinished()
+
+    def handleFinished (self):
+        self.process.stats.finish(self.outputClosed)
+        self.loop.quit()
+
+
+def buildQuery (args):
+    "returns a SearchQuery with the plugin settings, changed by the command line options"
+    settings = None
+    if not(args.defaults):
+        settings = loadSettings()
+    if settings is None:
+        settings = SchemaDefaults()
+    query = SearchQuery(settings)
+    query.text = args.text
+    query.directory = os.path.abspath(args.directory)
+
+    for (option, name, helpText) in SWITCHES:
+        value = getattr(args, name)
+        if value is not None:
+            setattr(query, name, value)
+    if args.fileTypes is not None:
+        query.selectFileTypes = True
+        query.fileTypeString = args.fileTypes
+    if args.backend is not None:
+        query.searchBackend = args.backend
+    if args.grepProcesses is not None:
+        query.grepProcesses = args.grepProcesses
+    if args.walkThreads is not None:
+        query.walkThreads = args.walkThreads
+    if args.nice is not None:
+        query.processNice = args.nice
+    if args.ioPriority is not None:
+        query.ioPriority = args.ioPriority
+
+    # an index would only be loaded in the background, too late for a single search:
+    query.indexDirs = []
+    query.watchIndexDirs = False
+    return query
+
+def parseArguments ():
+    parser = argparse.ArgumentParser(prog="python3 -m file-search",
+        description="Searches for TEXT in the files in DIRECTORY, like the gedit file search plugin. "
+            "Unless --defaults is given, the plugin settings are used; options override them.")
+    parser.add_argument("text", metavar="TEXT", help="text to search for")
+    parser.add_argument("directory", metavar="DIRECTORY", nargs="?", default=".",
+        help="folder to search in (default: the current folder)")
+    for (option, name, helpText) in SWITCHES:
+        parser.add_argument("--" + option, dest=name, action="store_const", const=True, default=None, help=helpText)
+        parser.add_argument("--no-" + option, dest=name, action="store_const", const=False, help=argparse.SUPPRESS)
+    parser.add_argument("-i", dest="caseSensitive", action="store_const", const=False,
+        help="same as --no-case-sensitive")
+    parser.add_argument("-w", dest="wholeWord", action="store_const", const=True,
+        help="same as --whole-word")
+    parser.add_argument("-t", "--file-types", dest="fileTypes", metavar="PATTERNS",
+        help="only search files matching these (space-separated) patterns, eg. \"*.c *.h\"")
+    parser.add_argument("--backend", choices=["auto"] + BACKEND_NAMES, help="search backend")
+    parser.add_argument("--grep-processes", dest="grepProcesses", type=int, metavar="N",
+        help="number of grep processes (or threads) running at the same time")
+    parser.add_argument("--walk-threads", dest="walkThreads", type=int, metavar="N",
+        help="number of threads for reading folders")
+    parser.add_argument("--nice", type=int, metavar="N",
+        help="lower the CPU priority of the search processes and threads by N (0: don't change it)")
+    parser.add_argument("--io-priority", dest="ioPriority", choices=["normal", "low", "idle"],
+        help="IO priority of the search processes")
+    parser.add_argument("--defaults", action="store_true",
+        help="use the default settings instead of the plugin settings")
+    parser.add_argument("--json", action="store_true",
+        help="print each result as a JSON object (with file, line and text), one per line")
+    parser.add_argument("--stats", action="store_true",
+        help="print the search statistics (as JSON) to stderr when the search is finished")
+    parser.epilog = "Boolean options can be negated with --no-..., eg. --no-exclude-hidden."
+    return parser.parse_args()
+
+def main ():
+    args = parseArguments()
+    query = buildQuery(args)
+
+    loop = GLib.MainLoop()
+    handler = CommandLineHandler(loop, sys.stdout.buffer, args.json)
+    handler.process = createSearchProcess(query, handler)
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        handler.process.cancel()
+        return 130
+
+    if args.stats:
+        sys.stderr.write(json.dumps(handler.process.stats.toDict(), indent=2, sort_keys=True) + "\n")
+    if handler.outputClosed:
+        # avoid another error when Python flushes stdout at exit:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+    return 0 if handler.numResults > 0 else 1 # (like grep)
+
+if __name__ == "__main__":
+    sys.exit(main())
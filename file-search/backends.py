@@ -0,0 +1,284 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Search backends. Each backend class runs a complete search for a SearchQuery
+# (finding files and searching in them). It is created with the query and a
+# result handler, and passes lists of (filename, lineno, linetext) tuples to
+# resultHandler.handleResults(), and then calls resultHandler.handleFinished().
+# It has cancel() and destroy() methods, and a stats attribute (a SearchStats
+# with its performance counters).
+#
+# Available backends:
+# - "grep": SearchProcess (runs find, and then grep on the found files)
+# - "python": SearchProcess (runs find, and then searches the found files without grep)
+# - "git-grep": GitGrepProcess (runs `git grep`)
+# - "ripgrep": RipgrepProcess (runs `rg`)
+#
+# createSearchProcess() selects the backend (and starts the search).
+#
+# The trigram index and the result cache are only used by the grep and python
+# backends. git-grep and ripgrep list the files sorted by path, while the grep
+# and python backends list the files of a folder before those of its subfolders.
+# Regular expressions are basic regular expressions (like with grep) for all
+# backends except "python", which uses Python syntax.
+#
+
+
+import os
+import shutil
+import subprocess
+
+from gi.repository import GLib
+
+from .searcher import RunCommand, SearchProcess, ProcessLimiter, translateBasicRegExp
+from .trigram_index import findIndexRoot
+from .search_stats import SearchStats
+
+
+BACKEND_NAMES = ["grep", "python", "git-grep", "ripgrep"]
+
+# directories to ignore for the "exclude VCS folders" option:
+VCS_DIRS = ["CVS", ".svn", ".git", "RCS", ".bzr"]
+
+
+def isInsideGitWorkTree (directory):
+    "returns True if the given directory is inside a Git work tree (and git is installed)"
+    try:
+        output = subprocess.check_output(["git", "rev-parse", "--is-inside-work-tree"],
+            cwd=directory, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return output.strip() == b"true"
+
+def isBackendAvailable (name, query):
+    if name == "git-grep":
+        return isInsideGitWorkTree(query.directory)
+    elif name == "ripgrep":
+        if query.isRegExp and translateBasicRegExp(query.text) is None:
+            return False # can't be converted into the syntax of ripgrep
+        return shutil.which("rg") is not None
+    else:
+        return name in BACKEND_NAMES
+
+def selectBackend (query):
+    "returns the name of the backend to use for the given query"
+    if query.files is not None:
+        # only SearchProcess can search a given list of files
+        return "python" if query.searchBackend == "python" else "grep"
+    if query.searchBackend in BACKEND_NAMES:
+        if isBackendAvailable(query.searchBackend, query):
+            return query.searchBackend
+        print("search backend '%s' is not available; using automatic selection" % query.searchBackend)
+
+    # automatic selection: use the fastest available backend (except for
+    # indexed directories, where the grep backend uses the index):
+    if findIndexRoot(query) is not None:
+        return "grep"
+    for name in ["git-grep", "ripgrep"]:
+        if isBackendAvailable(name, query):
+            return name
+    return "grep"
+
+def createSearchProcess (query, resultHandler, resultCache=None, processLimiter=None):
+    """
+    Starts a search for the given query, using the configured (or best available)
+    backend. resultCache (an LRUCache) is only used by the grep and python backends.
+    processLimiter (a ProcessLimiter) limits the number of processes which run
+    at the same time, together with other searches using the same limiter.
+    """
+    backend = selectBackend(query)
+    if backend == "git-grep":
+        return GitGrepProcess(query, resultHandler, processLimiter)
+    elif backend == "ripgrep":
+        return RipgrepProcess(query, resultHandler, processLimiter)
+    else:
+        return SearchProcess(query, resultHandler, usePythonGrep=(backend == "python"), resultCache=resultCache,
+            processLimiter=processLimiter)
+
+
+class CommandSearchProcess:
+    """
+    Base class for backends which run a single command that finds files and
+    searches in them. Subclasses implement buildCommand() and parseLine(), and
+    set backendName.
+    """
+    backendName = None
+
+    def __init__ (self, query, resultHandler, processLimiter=None):
+        self.query = query
+        self.resultHandler = resultHandler
+        self.cancelled = False
+        self.queryText = query.text.encode("utf-8")
+        self.directory = os.path.normpath(query.directory).encode("utf-8")
+        self.stats = SearchStats(self.backendName)
+        if processLimiter is None:
+            processLimiter = ProcessLimiter()
+        self.processLimiter = processLimiter
+        self.cmdRunner = None
+        self.start()
+
+    def start (self):
+        "Runs the command, or waits until the process limiter permits it"
+        if self.cancelled:
+            return
+        if not(self.processLimiter.tryAcquire(self.query.maxProcessesPerWindow)):
+            self.processLimiter.wait(self.start)
+            return
+        self.stats.grepProcesses = 1
+        self.cmdRunner = RunCommand(self.buildCommand(), self, cwd=self.directory, stats=self.stats,
+            nice=self.query.processNice, ioPriority=self.query.ioPriority)
+
+    def cancel (self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self.cmdRunner:
+            self.cmdRunner.cancel()
+            self.cmdRunner = None
+        elif self.stats.grepProcesses == 0:
+            # the command wasn't started yet:
+            self.processLimiter.cancelWait(self.start)
+            GLib.idle_add(self._finishWaiting)
+
+    def _finishWaiting (self):
+        self.resultHandler.handleFinished()
+        return False
+
+    def destroy (self):
+        self.cancel()
+
+    def handleLines (self, lines):
+        results = []
+        for line in lines:
+            parsed = self.parseLine(line)
+            if parsed is None:
+                continue # ignore invalid lines
+            (filename, lineno, linetext) = parsed
+
+            # Assume that the output is in UTF8 encoding (see GrepProcess)
+            linetext = linetext.decode("utf8", "replace").rstrip("\n\r")
+            results.append( (filename, int(lineno), linetext) )
+        if results and not(self.cancelled):
+            self.resultHandler.handleResults(results)
+
+    def handleFinished (self):
+        self.cmdRunner = None
+        self.processLimiter.release()
+        self.resultHandler.handleFinished()
+
+
+class GitGrepProcess(CommandSearchProcess):
+    "Searches with `git grep` (in tracked and untracked files)"
+    backendName = "git-grep"
+
+    def buildCommand (self):
+        query = self.query
+        cmd = ["git", "grep", "-z", "-n", "-I", "--no-color", "--untracked"]
+        if not(query.excludeIgnored):
+            cmd += ["--no-exclude-standard"] # also search files ignored by Git
+        if not(query.caseSensitive):
+            cmd += ["-i"]
+        if query.wholeWord:
+            cmd += ["-w"]
+        if query.isRegExp:
+            cmd += ["-G"] # same (basic) regular expressions as grep
+        else:
+            cmd += ["-F"]
+        cmd += ["-e", self.queryText, "--"]
+
+        # map the query options to pathspecs (relative to the search directory):
+        if query.includeSubfolders:
+            prefix = "**/"
+        else:
+            prefix = "" # in glob pathspecs, "*" doesn't match slashes
+        fileTypes = []
+        if query.selectFileTypes:
+            fileTypes = query.parseFileTypeString()
+        if not(fileTypes):
+            fileTypes = ["*"]
+        for t in fileTypes:
+            cmd += [":(glob)" + prefix + t]
+
+        if query.excludeHidden:
+            cmd += [":(exclude,glob)**/.*", ":(exclude,glob)**/.*/**"]
+        if query.excludeBackup:
+            cmd += [":(exclude,glob)**/*~", ":(exclude,glob)**/.#*.*"]
+        if query.excludeVCS:
+            for d in VCS_DIRS:
+                cmd += [":(exclude,glob)**/%s/**" % d]
+        return cmd
+
+    def parseLine (self, line):
+        # output format: file name, line number and line text, separated by null bytes
+        parts = line.split(b"\0", 2)
+        if len(parts) != 3:
+            return None
+        filename = os.path.join(self.directory, parts[0])
+        return (filename, parts[1], parts[2])
+
+
+class RipgrepProcess(CommandSearchProcess):
+    "Searches with ripgrep (`rg`)"
+    backendName = "ripgrep"
+
+    def buildCommand (self):
+        query = self.query
+        cmd = ["rg", "--no-config", "--null", "--line-number", "--with-filename",
+            "--no-heading", "--color", "never", "--no-messages",
+            "--sort", "path"] # (the same order for every run; but this makes rg search with a single thread)
+        if not(query.excludeIgnored):
+            cmd += ["--no-ignore"] # don't use .gitignore etc.
+        if query.caseSensitive:
+            cmd += ["--case-sensitive"]
+        else:
+            cmd += ["--ignore-case"]
+        if query.wholeWord:
+            cmd += ["--word-regexp"]
+        pattern = self.queryText
+        if query.isRegExp:
+            # (rg uses the extended syntax of Rust regular expressions; see isBackendAvailable())
+            pattern = translateBasicRegExp(query.text).encode("utf-8")
+        else:
+            cmd += ["--fixed-strings"]
+        if not(query.includeSubfolders):
+            cmd += ["--max-depth", "1"]
+        if not(query.excludeHidden):
+            cmd += ["--hidden"]
+
+        if query.selectFileTypes:
+            for t in query.parseFileTypeString():
+                cmd += ["--glob", t]
+        if query.excludeBackup:
+            cmd += ["--glob", "!*~", "--glob", "!.#*.*"]
+        if query.excludeVCS:
+            for d in VCS_DIRS:
+                cmd += ["--glob", "!%s/" % d]
+
+        cmd += ["-e", pattern, "--", self.directory]
+        return cmd
+
+    def parseLine (self, line):
+        # output format: file name, null byte, line number, colon, line text
+        (filename, sep, end) = line.partition(b"\0")
+        if not(sep):
+            return None
+        (lineno, sep, linetext) = end.partition(b":")
+        if not(sep):
+            return None
+        return (filename, lineno, linetext)
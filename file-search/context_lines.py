@@ -0,0 +1,184 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Reading the lines around search results (for displaying context lines):
+# - FileLines (the start offset of every line of a file)
+# - ContextProvider (returns lines of files, keeping the FileLines of recently used files)
+#
+# Finding the line starts of a big file takes a while, so this is done in a
+# background thread; the lines can be requested again when it's finished.
+#
+
+
+import os
+import re
+import mmap
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from gi.repository import GLib
+
+from .plugin_common import LRUCache
+
+
+# maximum memory used by the line tables of cached files:
+CONTEXT_CACHE_SIZE = 16 * 1024 * 1024
+# estimated memory usage of each FileLines (plus its line table):
+FILE_LINES_OVERHEAD = 200
+# bigger files are read in a background thread:
+MAX_SYNC_FILE_SIZE = 1024 * 1024
+
+NEWLINE_RE = re.compile(b"\n")
+
+
+class FileLines:
+    """
+    Finds the start of every line of a file (using a memory-mapped file);
+    after that, any line can be read without searching through the file.
+    The file is only kept open while reading it, so cached FileLines don't
+    use up file descriptors.
+    """
+    def __init__ (self, path):
+        self.path = path
+        self.lineStarts = array("q", [0])
+        self.dataSize = 0
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.signature = (st.st_mtime_ns, st.st_size)
+            if st.st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    self.lineStarts.extend(m.end() for m in NEWLINE_RE.finditer(data))
+                    self.dataSize = len(data)
+
+        if self.lineStarts[-1] == self.dataSize:
+            self.lineStarts.pop() # a newline at the end doesn't start another line
+        self.size = FILE_LINES_OVERHEAD + len(self.lineStarts) * self.lineStarts.itemsize
+
+    def numLines (self):
+        return len(self.lineStarts) if self.dataSize > 0 else 0
+
+    def _lineEnd (self, lineno):
+        "returns the end offset of the given line (including its newline)"
+        if lineno < len(self.lineStarts):
+            return self.lineStarts[lineno]
+        return self.dataSize
+
+    def getLines (self, first, last):
+        """
+        returns a list of (lineno, linetext) tuples for the lines first...last (counting from 1);
+        raises IOError/OSError if the file can't be read anymore
+        """
+        first = max(first, 1)
+        last = min(last, self.numLines())
+        if first > last:
+            return []
+        offset = self.lineStarts[first - 1]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(self._lineEnd(last) - offset)
+
+        lines = []
+        for lineno in range(first, last + 1):
+            start = self.lineStarts[lineno - 1] - offset
+            end = self._lineEnd(lineno) - offset
+            text = data[start:end].decode("utf-8", "replace").rstrip("\r\n")
+            lines.append( (lineno, text) )
+        return lines
+
+
+class ContextProvider:
+    """
+    Returns the lines around a line of a file. The FileLines of recently used
+    files are kept in an LRUCache, and are only read again if the file changes.
+    """
+    def __init__ (self):
+        self.cache = LRUCache()
+        self.lastLoaded = (None, None) # (file name, FileLines) of the last file read in the background
+        self.executor = None
+        self.pending = {} # file name -> list of callbacks, for files which are being read
+
+    def getLines (self, filename, lineno, numContextLines, loadedCb=None):
+        """
+        Returns a list of (lineno, linetext) tuples for the given line and up to
+        numContextLines lines before and after it (or an empty list if the file
+        can't be read). Returns None if the file is being read in the background;
+        then loadedCb is called (from the main loop) when it has been read.
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return []
+
+        fileLines = self.cache.get(filename)
+        if fileLines is None and self.lastLoaded[0] == filename:
+            fileLines = self.lastLoaded[1] # (might be too big for the cache)
+            if fileLines is None:
+                # the file couldn't be read (it is tried again with the next request):
+                self.lastLoaded = (None, None)
+                return []
+        if fileLines is None or fileLines.signature != (st.st_mtime_ns, st.st_size):
+            if st.st_size > MAX_SYNC_FILE_SIZE:
+                self._loadInBackground(filename, loadedCb)
+                return None
+            fileLines = self._load(filename)
+            if fileLines is None:
+                return []
+            self.cache.put(filename, fileLines, CONTEXT_CACHE_SIZE)
+        try:
+            return fileLines.getLines(lineno - numContextLines, lineno + numContextLines)
+        except (IOError, OSError):
+            return []
+
+    def _load (self, filename):
+        try:
+            return FileLines(filename)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _loadInBackground (self, filename, loadedCb):
+        callbacks = self.pending.get(filename)
+        if callbacks is None:
+            callbacks = []
+            self.pending[filename] = callbacks
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(1)
+            self.executor.submit(self._backgroundLoad, filename)
+        if loadedCb and loadedCb not in callbacks:
+            callbacks.append(loadedCb)
+
+    def _backgroundLoad (self, filename):
+        # runs in a separate thread
+        fileLines = self._load(filename)
+        GLib.idle_add(self._handleLoaded, filename, fileLines)
+
+    def _handleLoaded (self, filename, fileLines):
+        if fileLines is not None:
+            self.cache.put(filename, fileLines, CONTEXT_CACHE_SIZE)
+        self.lastLoaded = (filename, fileLines)
+        for cb in self.pending.pop(filename, []):
+            cb()
+        return False
+
+
+_contextProvider = None
+
+def getContextProvider ():
+    global _contextProvider
+    if _contextProvider is None:
+        _contextProvider = ContextProvider()
+    return _contextProvider
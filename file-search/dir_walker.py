@@ -0,0 +1,214 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Classes for finding the files to search:
+# - FileFilter (decides which files and directories are searched, according to the SearchQuery options)
+# - DirectoryWalker (lists all files in a directory tree, without descending into excluded directories)
+#
+# Each directory is stored as (mtime, files, subdirs, ignoreRules); ignoreRules
+# is None unless files from ignore files are excluded (see ignore_files.py).
+#
+
+
+import os
+import re
+import time
+import heapq
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+from .ignore_files import IGNORE_FILE_NAMES, getDirectoryIgnoreRules, getRootIgnoreRules
+
+
+# directories modified less than this time (in ns) before they were read are
+# read again next time, as changes within the timestamp granularity of the
+# file system would not be noticed:
+RECENT_MTIME_NS = 2 * 1000 * 1000 * 1000
+
+VCS_DIRS = [b"CVS", b".svn", b".git", b"RCS", b".bzr"]
+
+
+def normalizeDir (path):
+    "removes trailing slashes from a directory path"
+    return path.rstrip(b"/") or b"/"
+
+def compileGlobs (globs):
+    "returns a compiled regular expression (for byte strings) which matches any of the given file globs"
+    pattern = "|".join("(?:%s)" % fnmatch.translate(g) for g in globs)
+    return re.compile(pattern.encode("utf-8"))
+
+
+class FileFilter:
+    "Decides which files and directories are included in a search"
+    def __init__ (self, query):
+        self.includeSubfolders = query.includeSubfolders
+        self.excludeHidden = query.excludeHidden
+        self.excludeBackup = query.excludeBackup
+        self.excludeVCS = query.excludeVCS
+        self.excludeIgnored = query.excludeIgnored
+        self.backupRE = compileGlobs(["*~", ".#*.*"])
+        self.fileTypesRE = None
+        if query.selectFileTypes:
+            fileTypes = query.parseFileTypeString()
+            if fileTypes:
+                self.fileTypesRE = compileGlobs(fileTypes)
+
+    def isFileIncluded (self, name):
+        if self.excludeHidden and name.startswith(b"."):
+            return False
+        if self.excludeBackup and self.backupRE.match(name):
+            return False
+        if self.fileTypesRE and not(self.fileTypesRE.match(name)):
+            return False
+        return True
+
+    def isDirIncluded (self, name):
+        if not(self.includeSubfolders):
+            return False
+        if self.excludeHidden and name.startswith(b"."):
+            return False
+        if self.excludeVCS and name in VCS_DIRS:
+            return False
+        return True
+
+
+def readDirectory (path, fileFilter, startTime, parentRules=None):
+    """
+    Returns (mtime, files, subdirs, ignoreRules) for the given directory, with
+    the sorted paths of the included files and subdirectories; or None if the
+    directory cannot be read. mtime is -1 if the directory was modified shortly
+    before startTime. Entries are checked against ignore files if parentRules
+    (the IgnoreRules of the parent directory) is given.
+    """
+    files = []
+    subdirs = []
+    ignoreNames = []
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if fileFilter.isDirIncluded(entry.name):
+                            subdirs.append(entry)
+                    elif entry.is_file():
+                        if fileFilter.isFileIncluded(entry.name):
+                            files.append(entry)
+                        if entry.name in IGNORE_FILE_NAMES:
+                            ignoreNames.append(entry.name)
+                except OSError:
+                    pass # entry was removed in the meantime
+    except OSError:
+        return None
+    if mtime > startTime - RECENT_MTIME_NS:
+        mtime = -1
+
+    rules = None
+    if parentRules is not None:
+        ignoreNames.sort(key=IGNORE_FILE_NAMES.index)
+        rules = getDirectoryIgnoreRules(parentRules, path, ignoreNames)
+        files = [e for e in files if not(rules.isIgnored(e.path, e.name, False))]
+        subdirs = [e for e in subdirs if not(rules.isIgnored(e.path, e.name, True))]
+
+    files = sorted(e.path for e in files)
+    subdirs = sorted(e.path for e in subdirs)
+    return (mtime, files, subdirs, rules)
+
+
+class DirectoryWalker:
+    """
+    Lists the files in a directory tree. Like `find` with the SearchQuery
+    options, but excluded directories are skipped without reading them.
+
+    walk() yields (directory, (mtime, files, subdirs, ignoreRules)) for each directory,
+    ordered by directory path; so the files come in the same order as when
+    sorting all files with os.path.split.
+
+    Directories from cachedDirs (see FileList) are only read again if their
+    modification time has changed. With numThreads > 1, directories are read
+    ahead in parallel (which is faster on SSDs, but not on rotating disks);
+    threadInit is called at the start of each of these threads.
+    """
+    def __init__ (self, root, fileFilter, cachedDirs=None, numThreads=1, threadInit=None):
+        self.root = root
+        self.fileFilter = fileFilter
+        self.cachedDirs = cachedDirs or {}
+        self.numThreads = numThreads
+        self.threadInit = threadInit
+        self.startTime = time.time_ns()
+        self.cancelled = False
+
+    def cancel (self):
+        self.cancelled = True
+
+    def _getDirectory (self, path, parentRules):
+        cached = self.cachedDirs.get(path)
+        if cached is not None and cached[0] >= 0:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                return None # directory was removed
+            if mtime == cached[0]:
+                if parentRules is None:
+                    return cached
+                # the directory is unchanged, but ignore files might have changed:
+                rules = cached[3].reloaded(parentRules)
+                if rules.key == cached[3].key:
+                    return (cached[0], cached[1], cached[2], rules)
+        if self.cancelled:
+            return None
+        return readDirectory(path, self.fileFilter, self.startTime, parentRules)
+
+    def walk (self):
+        executor = None
+        futures = {} # directory path -> Future, for directories which are read ahead
+        if self.numThreads > 1:
+            executor = ThreadPoolExecutor(self.numThreads, initializer=self.threadInit)
+
+        rootRules = None
+        if self.fileFilter.excludeIgnored:
+            rootRules = getRootIgnoreRules(self.root)
+        parentRules = {} # directory path -> IgnoreRules of its parent directory
+
+        # Every directory path is greater than the path of its parent, so
+        # always continuing with the smallest known path walks the tree in
+        # sorted order:
+        pending = [self.root]
+        try:
+            while pending and not(self.cancelled):
+                d = heapq.heappop(pending)
+                if d in futures:
+                    entry = futures.pop(d).result()
+                else:
+                    entry = self._getDirectory(d, parentRules.pop(d, rootRules))
+                if entry is None:
+                    continue
+
+                for s in entry[2]:
+                    heapq.heappush(pending, s)
+                    if executor:
+                        futures[s] = executor.submit(self._getDirectory, s, entry[3])
+                    else:
+                        parentRules[s] = entry[3]
+                yield (d, entry)
+        finally:
+            if executor:
+                for f in futures.values():
+                    f.cancel()
+                executor.shutdown(wait=False)
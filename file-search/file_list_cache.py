@@ -0,0 +1,67 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Caching of the lists of files to search:
+# - FileList (all files to search below a root directory, with the modification time of each directory)
+# - getFileListCache() (returns the LRUCache which holds the most recently used FileLists)
+#
+# A directory's modification time changes whenever an entry is added, removed
+# or renamed in it. So a cached FileList is brought up to date by comparing the
+# modification time of each directory, and re-reading only the changed ones
+# (see DirectoryWalker).
+#
+
+
+from .plugin_common import LRUCache
+
+
+# estimated memory usage for each file or directory in a FileList (plus the path length):
+ENTRY_OVERHEAD = 100
+
+
+def fileListKey (query):
+    "returns the cache key for the files searched by the given query"
+    fileTypes = ()
+    if query.selectFileTypes:
+        fileTypes = tuple(query.parseFileTypeString())
+    return (query.directory, query.includeSubfolders, query.excludeHidden,
+        query.excludeBackup, query.excludeVCS, query.excludeIgnored, fileTypes)
+
+
+class FileList:
+    """
+    Holds all files to search below a root directory. dirs maps each directory
+    path to (mtime, files, subdirs, ignoreRules). The directories of a FileList are not
+    modified after creation, so it can be used from several threads.
+    """
+    def __init__ (self, root, dirs):
+        self.root = root
+        self.dirs = dirs
+
+        self.size = 0
+        for (d, entry) in dirs.items():
+            self.size += ENTRY_OVERHEAD + len(d)
+            for f in entry[1]:
+                self.size += ENTRY_OVERHEAD + len(f)
+
+
+_cache = LRUCache()
+
+def getFileListCache ():
+    return _cache
@@ -0,0 +1,229 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Support for ignore files (.gitignore, .ignore and .git/info/exclude):
+# - IgnoreFile (the compiled patterns of a single ignore file)
+# - IgnoreRules (all ignore files which apply to the entries of one directory)
+#
+# Patterns use the .gitignore syntax. Like with Git, patterns from ignore files
+# in deeper directories take precedence, and the last matching pattern decides.
+# Parsed ignore files are cached, and are only read again when they change.
+#
+
+
+import os
+import re
+import threading
+
+
+# ignore files which are read in every directory (later ones take precedence):
+IGNORE_FILE_NAMES = [b".gitignore", b".ignore"]
+
+# the cache of parsed ignore files is cleared when it gets bigger than this:
+MAX_CACHED_IGNORE_FILES = 10000
+
+
+def translatePattern (pattern):
+    "returns a regular expression (as bytes) for the given .gitignore glob pattern"
+    res = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i:i+1]
+        if c == b"*":
+            atComponentStart = (i == 0 or pattern[i-1:i] == b"/")
+            if pattern[i:i+2] == b"**" and atComponentStart and pattern[i+2:i+3] == b"/":
+                res.append(b"(?:.*/)?") # "**/": any number of directories
+                i += 3
+                continue
+            if pattern[i:i+2] == b"**" and atComponentStart and i + 2 == n:
+                res.append(b".*") # trailing "/**": everything inside
+                i += 2
+                continue
+            res.append(b"[^/]*")
+            while pattern[i:i+1] == b"*":
+                i += 1
+            continue
+        elif c == b"?":
+            res.append(b"[^/]")
+        elif c == b"[":
+            j = i + 1
+            if pattern[j:j+1] in (b"!", b"^"):
+                j += 1
+            if pattern[j:j+1] == b"]":
+                j += 1 # "]" right at the start is part of the set
+            j = pattern.find(b"]", j)
+            if j < 0:
+                res.append(re.escape(c))
+            else:
+                chars = pattern[i+1:j].replace(b"\\", b"\\\\").replace(b"[", b"\\[")
+                if chars[:1] == b"!":
+                    chars = b"^" + chars[1:]
+                res.append(b"[" + chars + b"]")
+                i = j
+        elif c == b"\\" and i + 1 < n:
+            res.append(re.escape(pattern[i+1:i+2]))
+            i += 1
+        else:
+            res.append(re.escape(c))
+        i += 1
+    return b"".join(res)
+
+
+def parsePatternLine (line):
+    "returns (regex, negated, dirOnly, anchored) for a line from an ignore file, or None"
+    line = line.rstrip(b"\r")
+    if not(line) or line.startswith(b"#"):
+        return None
+
+    # trailing spaces are ignored, unless escaped with a backslash:
+    stripped = line.rstrip(b" ")
+    if stripped.endswith(b"\\") and len(stripped) < len(line):
+        stripped += b" "
+    line = stripped
+
+    negated = line.startswith(b"!")
+    if negated:
+        line = line[1:]
+    dirOnly = line.endswith(b"/")
+    line = line.rstrip(b"/")
+    if not(line):
+        return None
+
+    # patterns with a slash are relative to the directory of the ignore file;
+    # others match the file name in any directory below it:
+    anchored = b"/" in line
+    line = line.lstrip(b"/")
+    regex = re.compile(translatePattern(line) + b"\\Z", re.DOTALL)
+    return (regex, negated, dirOnly, anchored)
+
+
+class IgnoreFile:
+    "The patterns from one ignore file, which apply below baseDir"
+    def __init__ (self, path, baseDir, signature, patterns):
+        self.path = path
+        self.baseDir = baseDir
+        self.signature = signature # (mtime, size) of the file
+        self.patterns = patterns
+        self.prefixLen = len(baseDir.rstrip(b"/")) + 1
+
+    def match (self, path, name, isDir):
+        "returns True if the path is ignored, False if it is explicitly not ignored, or None if no pattern matches"
+        relPath = None
+        for (regex, negated, dirOnly, anchored) in reversed(self.patterns):
+            if dirOnly and not(isDir):
+                continue
+            if anchored:
+                if relPath is None:
+                    relPath = path[self.prefixLen:]
+                m = regex.match(relPath)
+            else:
+                m = regex.match(name)
+            if m:
+                return not(negated)
+        return None
+
+
+_ignoreFiles = {} # path -> IgnoreFile
+_ignoreFilesLock = threading.Lock()
+
+def loadIgnoreFile (path, baseDir):
+    "returns the (cached) IgnoreFile for the given path, or None if it doesn't exist"
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    signature = (st.st_mtime_ns, st.st_size)
+    with _ignoreFilesLock:
+        ignoreFile = _ignoreFiles.get(path)
+    if ignoreFile is not None and ignoreFile.signature == signature and ignoreFile.baseDir == baseDir:
+        return ignoreFile
+
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
+    patterns = []
+    for line in data.split(b"\n"):
+        try:
+            p = parsePatternLine(line)
+        except re.error:
+            p = None # ignore invalid patterns, like Git does
+        if p:
+            patterns.append(p)
+
+    ignoreFile = IgnoreFile(path, baseDir, signature, patterns)
+    with _ignoreFilesLock:
+        if len(_ignoreFiles) >= MAX_CACHED_IGNORE_FILES:
+            _ignoreFiles.clear()
+        _ignoreFiles[path] = ignoreFile
+    return ignoreFile
+
+
+class IgnoreRules:
+    """
+    The ignore files which apply to the entries of one directory: those of
+    the parent rules, plus the directory's own ignore files. Two IgnoreRules
+    with the same key ignore the same entries.
+    """
+    def __init__ (self, parent, ownFiles):
+        self.ownFiles = [f for f in ownFiles if f is not None]
+        self.ignoreFiles = self.ownFiles
+        if parent:
+            self.ignoreFiles = parent.ignoreFiles + self.ownFiles
+        self.key = tuple((f.path, f.signature) for f in self.ignoreFiles)
+
+    def reloaded (self, parent):
+        "returns up-to-date rules for the same directory, with the given parent rules"
+        return IgnoreRules(parent, [loadIgnoreFile(f.path, f.baseDir) for f in self.ownFiles])
+
+    def isIgnored (self, path, name, isDir):
+        for f in reversed(self.ignoreFiles):
+            ignored = f.match(path, name, isDir)
+            if ignored is not None:
+                return ignored
+        return False
+
+
+def getDirectoryIgnoreRules (parent, directory, names):
+    "returns the IgnoreRules for the entries of directory, which contains the given ignore files"
+    return IgnoreRules(parent, [loadIgnoreFile(os.path.join(directory, n), directory) for n in names])
+
+def getRootIgnoreRules (root):
+    """
+    Returns the IgnoreRules which apply to the root directory itself: if root
+    is inside a Git work tree, .git/info/exclude and the ignore files of the
+    parent directories up to the top of the work tree.
+    """
+    top = root
+    while not(os.path.exists(os.path.join(top, b".git"))):
+        parent = os.path.dirname(top)
+        if parent == top:
+            return IgnoreRules(None, []) # not inside a Git work tree
+        top = parent
+
+    rules = IgnoreRules(None, [loadIgnoreFile(os.path.join(top, b".git", b"info", b"exclude"), top)])
+    directory = top
+    for name in root[len(top):].strip(b"/").split(b"/"):
+        if not(name):
+            break # root is the top directory
+        rules = getDirectoryIgnoreRules(rules, directory, IGNORE_FILE_NAMES)
+        directory = os.path.join(directory, name)
+    return rules
@@ -28,8 +28,10 @@
 import os
 from gi.repository import Gedit, GLib, GObject, Gtk, Gio
 
-from .plugin_common import _, ngettext, gtkToUnicode
+from .plugin_common import _, ngettext, gtkToUnicode, LRUCache
 from .search_dialog import SearchDialog
+from .trigram_index import closeIndexes
+from .searcher import ProcessLimiter
 
 
 ui_str = """<ui>
@@ -59,6 +61,8 @@ class FileSearchWindowHelper(GObject.Object, Gedit.WindowActivatable):
         self._filebrowserMenuExt = None
         self._filebrowserItemId = None
         self.searchers = [] # list of existing SearchProcess instances
+        self.resultCache = LRUCache() # results of recent searches in this window (see SearchResults)
+        self.processLimiter = ProcessLimiter() # shared by all searches in this window
 
         self._lastClickIter = None # TextIter at position of last right-click or last popup menu
 
@@ -280,4 +284,5 @@ class FileSearchAppHelper(GObject.Object, Gedit.AppActivatable):
         if hasattr(self, "extend_menu"):
             self.app.remove_accelerator("win.gedit-file-search-plugin", None)
             self.menu_ext = None
+        closeIndexes()
 
@@ -19,6 +19,7 @@
 import sys, os
 from gettext import gettext, translation
 import locale
+import collections
 
 resourceDir = os.path.dirname(__file__)
 gladeFile = os.path.join(resourceDir, "file-search.ui")
@@ -38,6 +39,34 @@ def gtkToUnicode(s):
         return s
 
 
+class LRUCache:
+    "Keeps the most recently used objects (which have a size attribute), up to a maximum total size"
+    def __init__ (self):
+        self.objects = collections.OrderedDict() # key -> object (least recently used first)
+        self.size = 0
+
+    def get (self, key):
+        obj = self.objects.get(key)
+        if obj is not None:
+            self.objects.move_to_end(key)
+        return obj
+
+    def put (self, key, obj, maxSize):
+        self.remove(key)
+        if obj.size > maxSize:
+            return
+        self.objects[key] = obj
+        self.size += obj.size
+        while self.size > maxSize:
+            (oldKey, oldObj) = self.objects.popitem(last=False)
+            self.size -= oldObj.size
+
+    def remove (self, key):
+        obj = self.objects.pop(key, None)
+        if obj is not None:
+            self.size -= obj.size
+
+
 # translation
 APP_NAME = 'file-search'
 LOCALE_PATH = os.path.join(resourceDir, 'locale')
@@ -0,0 +1,132 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Caching of search results:
+# - SearchResults (the matches of a search, and the mtime and size of every searched file)
+#
+# Every window has an LRUCache of SearchResults (see FileSearchWindowHelper).
+# When a search is repeated, SearchProcess passes the cached matches of
+# unchanged files on (in file order, between the grep results of the other
+# files), and only greps the files which changed.
+#
+
+
+import os
+import time
+
+from .dir_walker import RECENT_MTIME_NS
+
+
+# estimated memory usage for each file and each match (plus the length of file name and line):
+FILE_OVERHEAD = 100
+MATCH_OVERHEAD = 100
+
+
+def resultCacheKey (query):
+    "returns the cache key for the results of the given query"
+    fileTypes = ()
+    if query.selectFileTypes:
+        fileTypes = tuple(query.parseFileTypeString())
+    return (query.text, query.directory, query.caseSensitive, query.wholeWord, query.isRegExp,
+        query.includeSubfolders, query.excludeHidden, query.excludeBackup, query.excludeVCS,
+        query.excludeIgnored, fileTypes)
+
+
+class SearchResults:
+    """
+    Holds the results of a search. signatures maps the name of every searched
+    file to its (mtime, size), or to None if the file was modified so recently
+    that changes might not be noticed. matches maps file names to lists of
+    (file name, line number, line text) results.
+
+    signatures is filled in the directory walker thread (with checkFiles()),
+    and matches in the main thread (with addMatches()).
+
+    If the results get bigger than maxSize (ie. too big for the cache), they
+    are discarded and overflowed is set; nothing is collected after that.
+    """
+    def __init__ (self, maxSize=None):
+        self.signatures = {}
+        self.matches = {}
+        self.filesSize = 0
+        self.matchesSize = 0
+        self.maxSize = maxSize
+        self.overflowed = False
+
+    @property
+    def size (self):
+        return self.filesSize + self.matchesSize
+
+    def _checkSize (self):
+        if self.maxSize is not None and self.size > self.maxSize:
+            self.overflowed = True
+            self.signatures = {}
+            self.matches = {}
+            self.filesSize = 0
+            self.matchesSize = 0
+
+    def checkFiles (self, files, cachedResults):
+        """
+        Stores the signatures of the given files; returns a list of
+        (results, changedFiles) tuples in the order of the files: the cached
+        results of unchanged files, followed by the files (after them) which
+        have to be searched.
+        """
+        startTime = time.time_ns()
+        parts = []
+        results = []
+        changedFiles = []
+        for f in files:
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue # file was removed
+            signature = (st.st_mtime_ns, st.st_size)
+            if st.st_mtime_ns > startTime - RECENT_MTIME_NS:
+                signature = None
+            if not(self.overflowed):
+                self.signatures[f] = signature
+                self.filesSize += FILE_OVERHEAD + len(f)
+
+            if signature is not None and cachedResults and cachedResults.signatures.get(f) == signature:
+                fileMatches = cachedResults.matches.get(f)
+                if fileMatches:
+                    if changedFiles:
+                        # (these results must be passed on after the results of the changed files)
+                        parts.append( (results, changedFiles) )
+                        results = []
+                        changedFiles = []
+                    results += fileMatches
+            else:
+                changedFiles.append(f)
+        if results or changedFiles:
+            parts.append( (results, changedFiles) )
+        self._checkSize()
+        return parts
+
+    def addMatches (self, results):
+        if self.overflowed:
+            return
+        for r in results:
+            fileMatches = self.matches.get(r[0])
+            if fileMatches is None:
+                fileMatches = self.matches[r[0]] = []
+            fileMatches.append(r)
+            self.matchesSize += MATCH_OVERHEAD + len(r[2])
+        self._checkSize()
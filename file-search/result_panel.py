@@ -20,9 +20,17 @@
 # Main classes:
 # - ResultPanel (is instantiated by FileSearchWindowHelper for every search, and holds the result tab)
 #
+# Helper classes:
+# - ResultForwarder (passes the results of one search to its ResultPanel)
+# - Highlighter (creates markup for result lines, with highlighted matches)
+#
 
 
 import os
+import re
+import copy
+import time
+import bisect
 try:
     from urllib.parse import quote
 except:
@@ -30,8 +38,22 @@ except:
 from gi.repository import Gedit, GLib, Gtk, Gdk, Gio, Pango, GtkSource
 
 from .plugin_common import _, ngettext, APP_NAME, gladeFile, isUnicode
-from .searcher import SearchProcess, buildQueryRE
+from .searcher import buildQueryRE, translateBasicRegExp, ResultFilterProcess
+from .backends import createSearchProcess
+from .result_store import ResultStore, ResultSpillFile, ResultTextIndex
+from .context_lines import getContextProvider
+from .search_stats import writeStatsLog
+
 
+# interval (in milliseconds) for adding new results to the result list; about once per frame:
+FLUSH_INTERVAL = 16
+# detach the tree view while adding at least this many rows at once:
+DETACH_MIN_ROWS = 1000
+# context lines in tooltips are truncated to this many characters:
+MAX_CONTEXT_LINE_LENGTH = 200
+
+HIGHLIGHT_START = "<span background=\"#FFFF00\">"
+HIGHLIGHT_END = "</span>"
 
 
 class ResultPanel:
@@ -39,38 +61,139 @@ class ResultPanel:
     Gets a search query (and related info) and then handles everything related
     to that single file search:
     - creating a result window
-    - starting grep (through SearchProcess)
+    - starting the search (through one of the search backends)
     - displaying matches
     A ResultPanel object lives until its result panel is closed.
+
+    If parentPanel is given, the search is a refinement of the results of
+    parentPanel: with filterLines, only its result lines are searched (in
+    memory); otherwise only the files which contain its results are searched.
+
+    At most query.maxResultsInMemory results are kept in memory and displayed
+    (as one page). When there are more results, all of them are written to a
+    ResultSpillFile, and the other pages are loaded from there on demand.
     """
-    def __init__ (self, window, pluginHelper, query):
+    def __init__ (self, window, pluginHelper, query, parentPanel=None, filterLines=False):
         self._window = window
         self.pluginHelper = pluginHelper
         self.pluginHelper.registerSearcher(self)
         self.query = query
-        self.files = {}
+        self._clearResults()
+        self.spillFile = None # holds all results, if there are too many to keep in memory
+        self.pageStart = 0 # index of the first displayed result
+        self._finishedLine = None
         self.numMatches = 0
         self.numLines = 0
         self.wasCancelled = False
         self.searchProcess = None
+        self.stats = None # SearchStats of the current search
+        self._resultForwarder = None
         self._collapseAll = False # if true, new nodes will be displayed collapsed
+        self._pendingResults = [] # results which are not yet displayed
+        self._flushSourceId = None
 
         self._createResultPanel()
+        self._startSearch(parentPanel, filterLines)
+
+    def _clearResults (self):
+        "Removes the displayed results (but not the spill file)"
+        self.results = ResultStore() # the displayed results
+        self.fileRows = [] # TreeIter of the file row, by file ID
+        self._infoLines = [] # markup of the rows which are not files or results
+        self._infoActions = {} # info line index -> function to call when the row is activated
+        self._moreRow = None # TreeIter of the row for loading the next page
+        self._textIndex = ResultTextIndex(self.results, self._getFileRowText) # for find-as-you-type
+        self._lastSearchKey = None # last text entered for find-as-you-type
+
+    def getAllResults (self):
+        "returns all results (also those which are not displayed), as a ResultStore or ResultSpillFile"
+        return self.spillFile or self.results
+
+    def _startSearch (self, parentPanel=None, filterLines=False):
+        query = self.query
+        self.maxResults = query.maxResultsInMemory
         self._updateSummary()
 
-        searchSummary = "<span size=\"smaller\">" + \
-            _("searching for <i>%(keywords)s</i> in <i>%(folder)s</i>") % \
+        if parentPanel:
+            searchSummary = _("searching for <i>%(keywords)s</i> in results of <i>%(parent)s</i>") % \
+                {
+                    'keywords': escapeMarkup(query.text),
+                    'parent': escapeMarkup(parentPanel.query.text)
+                }
+        else:
+            searchSummary = _("searching for <i>%(keywords)s</i> in <i>%(folder)s</i>") % \
                 {
                     'keywords': escapeMarkup(query.text),
                     'folder': escapeMarkup(GLib.filename_display_name(query.directory))
-                } + \
-            "</span>"
-        it = self.treeStore.append(None, None)
-        self.treeStore.set(it, 0, searchSummary, 1, "", 2, 0)
+                }
+        self._searchSummary = "<span size=\"smaller\">" + searchSummary + "</span>"
+        self._addInfoLine(self._searchSummary)
 
-        self.searchProcess = SearchProcess(query, self)
+        self._resultForwarder = ResultForwarder(self)
+        if parentPanel and filterLines:
+            self.searchProcess = ResultFilterProcess(query, self._resultForwarder, parentPanel.getAllResults())
+        else:
+            if parentPanel:
+                query.files = parentPanel.getAllResults().getFileNames()
+            self.searchProcess = createSearchProcess(query, self._resultForwarder, self.pluginHelper.resultCache,
+                self.pluginHelper.processLimiter)
+        self.stats = self.searchProcess.stats
+        # (only the python backend and in-memory refines use Python syntax for regular expressions)
+        self._highlighter = Highlighter(query, basicRegExp=(self.stats.backend not in ("python", "filter")))
         self._updateSummary()
 
+    def restart (self, query):
+        """
+        Cancels the current search, and starts a search for the given query
+        in the same result tab (eg. when searching as you type).
+        """
+        self._stopSearch()
+        self.query = query
+        self._clearResults()
+        self._closeSpillFile()
+        self.pageStart = 0
+        self._finishedLine = None
+        self.numMatches = 0
+        self.numLines = 0
+        self.wasCancelled = False
+        self.stats = None
+        self.treeStore.clear()
+
+        resultContainer = self.builder.get_object('hbxFileSearchResult')
+        panel = self._window.get_bottom_panel()
+        if hasattr(panel, "add_titled"):
+            panel.child_set_property(resultContainer, "title", self._getTabTitle())
+
+        editBtn = self.builder.get_object("btnModifyFileSearch")
+        editBtn.set_label("gtk-stop")
+        editBtn.show()
+
+        self._startSearch()
+
+    def _closeSpillFile (self):
+        if self.spillFile:
+            self.spillFile.close()
+            self.spillFile = None
+
+    def _stopSearch (self):
+        "Stops the current search, and drops all of its results which are not yet handled"
+        if self.searchProcess:
+            self.searchProcess.destroy()
+            self.searchProcess = None
+        if self._resultForwarder:
+            self._resultForwarder.resultPanel = None
+            self._resultForwarder = None
+        if self._flushSourceId is not None:
+            GLib.source_remove(self._flushSourceId)
+            self._flushSourceId = None
+        self._pendingResults = []
+
+    def _getTabTitle (self):
+        tabTitle = self.query.text
+        if len(tabTitle) > 30:
+            tabTitle = tabTitle[:30] + u"\u2026" # ellipsis character 
+        return tabTitle
+
     def _createResultPanel (self):
         self.builder = Gtk.Builder()
         self.builder.set_translation_domain(APP_NAME)
@@ -80,9 +203,7 @@ class ResultPanel:
 
         resultContainer.resultpanel = self # keep a reference to avoid destruction of panel
 
-        tabTitle = self.query.text
-        if len(tabTitle) > 30:
-            tabTitle = tabTitle[:30] + u"\u2026" # ellipsis character 
+        tabTitle = self._getTabTitle()
         panel = self._window.get_bottom_panel()
         if hasattr(panel, "add_titled"):
             panel.add_titled(resultContainer, str(self), tabTitle)
@@ -97,19 +218,28 @@ class ResultPanel:
         panel.set_property("visible", True)
 
 
-        self.treeStore = Gtk.TreeStore(str, object, int) # markup, file name, line number
+        # The rows only hold indexes; their markup is created when they are
+        # displayed (with fixed height mode, only visible rows are rendered).
+        # File rows: (file ID, -1); result rows: (file ID, result index);
+        # other rows: (-1, info line index).
+        self.treeStore = Gtk.TreeStore(int, int)
         self.treeView = self.builder.get_object('tvFileSearchResult')
         self.treeView.set_model(self.treeStore)
 
-        self.treeView.set_search_equal_func(resultSearchCb, None)
+        self.treeView.set_search_equal_func(resultSearchCb, self)
 
-        tc = Gtk.TreeViewColumn("File", Gtk.CellRendererText(), markup=0)
+        renderer = Gtk.CellRendererText()
+        renderer.set_property("ellipsize", Pango.EllipsizeMode.END)
+        renderer.set_fixed_height_from_font(1) # rows must all have the same height in fixed height mode
+        tc = Gtk.TreeViewColumn("File", renderer)
+        tc.set_cell_data_func(renderer, self._setCellMarkup)
+        tc.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
         self.treeView.append_column(tc)
+        self.treeView.set_fixed_height_mode(True)
 
     def destroy (self):
-        if self.searchProcess:
-            self.searchProcess.destroy()
-            self.searchProcess = None
+        self._stopSearch()
+        self._closeSpillFile()
 
         panel = self._window.get_bottom_panel()
         resultContainer = self.builder.get_object('hbxFileSearchResult')
@@ -122,7 +252,7 @@ class ResultPanel:
         self.treeStore = None
         self.treeView = None
         self._window = None
-        self.files = {}
+        self._clearResults()
         self.builder = None
         self.pluginHelper.unregisterSearcher(self)
 
@@ -139,22 +269,137 @@ class ResultPanel:
             self.wasCancelled = True
 
 
-    def handleResult (self, file, lineno, linetext):
-        assert not(isUnicode(file)) # for opening files, raw file names are needed
-        assert isUnicode(linetext)
-        expandRow = False
-        if not(file in self.files):
-            it = self._addResultFile(file)
-            self.files[file] = it
-            expandRow = True
+    def handleResults (self, results):
+        """
+        Gets a list of (file, lineno, linetext) tuples. The results are not
+        displayed right away but are collected, and then added to the result
+        list at most once per frame.
+        """
+        self.stats.addResults(len(results))
+        self._pendingResults += results
+        if self._flushSourceId is None:
+            self._flushSourceId = GLib.timeout_add(FLUSH_INTERVAL, self._flushResults)
+
+    def _flushResults (self):
+        "Adds all pending results to the result list"
+        self._flushSourceId = None
+        results = self._pendingResults
+        self._pendingResults = []
+        if not(results) or not(self.builder):
+            return False
+
+        for (file, lineno, linetext) in results:
+            assert not(isUnicode(file)) # for opening files, raw file names are needed
+            assert isUnicode(linetext)
+        self.numMatches += self._highlighter.countMatches([r[2] for r in results])
+        self.numLines += len(results)
+
+        if self.maxResults > 0:
+            results = self._spillResults(results)
+        if results:
+            self._addResultRows(results)
+        self._updateMoreRow()
+        self._updateSummary()
+        return False
+
+    def _spillResults (self, results):
+        """
+        Writes the results to the spill file, once there are more results than
+        can be kept in memory. Returns those results which belong to the
+        displayed page.
+        """
+        if self.spillFile is None:
+            if len(self.results) + len(results) <= self.maxResults:
+                return results
+            self.spillFile = ResultSpillFile()
+            self.spillFile.add(self.results.iterResults())
+        start = len(self.spillFile)
+        self.spillFile.add(results)
+        pageEnd = self.pageStart + self.maxResults
+        return results[max(self.pageStart - start, 0):max(pageEnd - start, 0)]
+
+    def _addResultRows (self, results):
+        "Displays the given results"
+
+        # Adding many rows is much faster while the tree view is detached from
+        # the model; but then the expanded state and scroll position of the
+        # existing rows have to be restored afterwards.
+        startTime = time.monotonic()
+        detachModel = (len(results) >= DETACH_MIN_ROWS)
+        if detachModel:
+            expandedFiles = [it for it in self.fileRows
+                if self.treeView.row_expanded(self.treeStore.get_path(it))]
+            (cursorPath, cursorColumn) = self.treeView.get_cursor()
+            vadj = self.treeView.get_vadjustment()
+            scrollPos = vadj.get_value()
+            self.treeView.set_model(None)
+
+        newFiles = []
+        store = self.results
+        fileRows = self.fileRows
+        textIndex = self._textIndex
+        firstIndex = len(store)
+        store.add(results)
+        for index in range(firstIndex, len(store)):
+            fileId = store.getFileId(index)
+            if fileId == len(fileRows):
+                # (file IDs are assigned in order)
+                it = self.treeStore.append(None, (fileId, -1))
+                fileRows.append(it)
+                newFiles.append(it)
+                textIndex.addFile(fileId)
+            self.treeStore.append(fileRows[fileId], (fileId, index))
+            textIndex.addResult(fileId, index)
+
+        if detachModel:
+            self.treeView.set_model(self.treeStore)
+            for it in expandedFiles:
+                self.treeView.expand_row(self.treeStore.get_path(it), False)
+            if cursorPath is not None:
+                self.treeView.set_cursor(cursorPath, cursorColumn, False)
+            vadj.set_value(scrollPos)
+
+        if not(self._collapseAll):
+            for it in newFiles:
+                self.treeView.expand_row(self.treeStore.get_path(it), False)
+
+        if self.stats:
+            self.stats.addRows(len(results) + len(newFiles), startTime)
+
+    def _updateMoreRow (self):
+        "Adds or updates the row for loading the next page of results"
+        if not(self.spillFile):
+            return
+        numMore = len(self.spillFile) - (self.pageStart + self.maxResults)
+        if numMore <= 0:
+            return
+        line = "<i>" + ngettext("%d more result \u2014 load next page", "%d more results \u2014 load next page", numMore) % numMore + "</i>"
+        if self._moreRow is None:
+            self._moreRow = self._addInfoLine(line, self._showNextPage)
         else:
-            it = self.files[file]
-        if self._collapseAll:
-            expandRow = False
-        self._addResultLine(it, lineno, linetext)
-        if expandRow:
-            path = self.treeStore.get_path(it)
-            self.treeView.expand_row(path, False)
+            self._infoLines[self.treeStore.get_value(self._moreRow, 1)] = line
+            self.treeStore.row_changed(self.treeStore.get_path(self._moreRow), self._moreRow)
+
+    def _showNextPage (self):
+        self._showPage(self.pageStart + self.maxResults)
+
+    def _showPreviousPage (self):
+        self._showPage(max(self.pageStart - self.maxResults, 0))
+
+    def _showPage (self, pageStart):
+        "Displays the page of results (from the spill file) which starts at the given index"
+        self.pageStart = pageStart
+        self._clearResults()
+        self.treeStore.clear()
+        self._addInfoLine(self._searchSummary)
+        if pageStart > 0:
+            self._addInfoLine("<i>" + _("load previous page") + "</i>", self._showPreviousPage)
+        results = self.spillFile.readResults(pageStart, self.maxResults)
+        if results:
+            self._addResultRows(results)
+        self._updateMoreRow()
+        if self._finishedLine:
+            self._addInfoLine(self._finishedLine)
         self._updateSummary()
 
     def handleFinished (self):
@@ -162,32 +407,98 @@ class ResultPanel:
         if not(self.builder):
             return
 
+        if self._flushSourceId is not None:
+            GLib.source_remove(self._flushSourceId)
+        self._flushResults()
+
         self.searchProcess = None
+        self._resultForwarder = None
         editBtn = self.builder.get_object("btnModifyFileSearch")
         editBtn.hide()
         editBtn.set_label("gtk-edit")
 
+        self.stats.finish(self.wasCancelled)
+        if self.query.statsLogFile:
+            writeStatsLog(self.query.statsLogFile, self.stats, self.query)
+
         self._updateSummary()
 
         if self.wasCancelled:
             line = "<i><span foreground=\"red\">" + _("(search was cancelled)") + "</span></i>"
-        elif self.numMatches == 0:
+        elif self.numLines == 0:
             line = "<i>" + _("(no matching files found)") + "</i>"
         else:
             line = "<i>" + ngettext("found %d match", "found %d matches", self.numMatches) % self.numMatches
             line += ngettext(" (%d line)", " (%d lines)", self.numLines) % self.numLines
-            line += ngettext(" in %d file", " in %d files", len(self.files)) % len(self.files) + "</i>"
-        it = self.treeStore.append(None, None)
-        self.treeStore.set(it, 0, line, 1, "", 2, 0)
+            numFiles = self.getAllResults().numFiles()
+            line += ngettext(" in %d file", " in %d files", numFiles) % numFiles + "</i>"
+        self._finishedLine = line
+        self._addInfoLine(line)
 
     def _updateSummary (self):
         summary = ngettext("<b>%d</b> match", "<b>%d</b> matches", self.numMatches) % self.numMatches
-        summary += "\n" + ngettext("in %d file", "in %d files", len(self.files)) % len(self.files)
+        numFiles = self.getAllResults().numFiles()
+        summary += "\n" + ngettext("in %d file", "in %d files", numFiles) % numFiles
         if self.searchProcess:
             summary += u"\u2026" # ellipsis character
-        self.builder.get_object("lblNumMatches").set_label(summary)
+        label = self.builder.get_object("lblNumMatches")
+        label.set_label(summary)
+        if self.stats:
+            label.set_tooltip_markup(self._formatStats())
+
+    def _formatStats (self):
+        "Returns markup with the performance counters of the current search"
+        stats = self.stats.toDict()
+        lines = ["<b>" + _("Search statistics") + "</b> (%s)" % escapeMarkup(str(stats["backend"]))]
+        if stats["timeToFirstResult"] is not None:
+            lines.append(_("First result after: %.3f s") % stats["timeToFirstResult"])
+        if stats["totalTime"] is not None:
+            lines.append(_("Total time: %.3f s") % stats["totalTime"])
+        if stats["walkTime"] is not None:
+            lines.append(_("Directory walk: %(time).3f s (%(files)d files in %(dirs)d folders)") %
+                {"time": stats["walkTime"], "files": stats["filesFound"], "dirs": stats["dirsRead"]})
+        if stats["filesSearched"]:
+            lines.append(_("Files searched: %d") % stats["filesSearched"])
+        if stats["grepProcesses"]:
+            lines.append(_("Grep processes: %d") % stats["grepProcesses"])
+        if stats["pipeReads"]:
+            lines.append(_("Read from pipes: %(size)s in %(reads)d reads") %
+                {"size": GLib.format_size(stats["bytesRead"]), "reads": stats["pipeReads"]})
+        if stats["linesParsed"]:
+            lines.append(_("Lines parsed: %d") % stats["linesParsed"])
+        lines.append(_("Main loop callbacks: %(num)d, %(time).3f s (longest: %(max).3f s)") %
+            {"num": stats["numCallbacks"], "time": stats["callbackTime"], "max": stats["maxCallbackTime"]})
+        lines.append(_("Rows added: %(rows)d in %(time).3f s") %
+            {"rows": stats["rowsAdded"], "time": stats["displayTime"]})
+        return "\n".join(lines)
+
+    def _addInfoLine (self, markup, action=None):
+        "Adds a row with the given markup; if it's activated, action is called"
+        if action:
+            self._infoActions[len(self._infoLines)] = action
+        it = self.treeStore.append(None, (-1, len(self._infoLines)))
+        self._infoLines.append(markup)
+        return it
+
+    def _setCellMarkup (self, column, cell, model, it, data):
+        cell.set_property("markup", self.getRowMarkup(it))
+
+    def getRowMarkup (self, it):
+        "Returns the markup for displaying the given row"
+        (fileId, index) = self.treeStore.get(it, 0, 1)
+        if fileId < 0:
+            return self._infoLines[index]
+        elif index < 0:
+            return self._formatResultFile(self.results.getFileName(fileId))
+        else:
+            return self._formatResultLine(self.results.getLineno(index), self.results.getText(index))
 
-    def _addResultFile (self, filename):
+    def _formatResultFile (self, filename):
+        (directory, file) = self._splitDisplayName(filename)
+        return "%s<b>%s</b>" % (escapeMarkup(directory), escapeMarkup(file))
+
+    def _splitDisplayName (self, filename):
+        "returns (directory, name) of the file, for display; directory is relative to the search directory"
         dispFilename = filename
 
         # remove leading search directory part if present:
@@ -200,12 +511,9 @@ class ResultPanel:
         if directory:
             directory = os.path.normpath(directory) + "/"
 
-        line = "%s<b>%s</b>" % (escapeMarkup(directory), escapeMarkup(file))
-        it = self.treeStore.append(None, None)
-        self.treeStore.set(it, 0, line, 1, filename, 2, 0)
-        return it
+        return (directory, file)
 
-    def _addResultLine (self, it, lineno, linetext):
+    def _formatResultLine (self, lineno, linetext):
         addTruncationMarker = False
         if len(linetext) > 1000:
             linetext = linetext[:1000]
@@ -214,32 +522,25 @@ class ResultPanel:
         assert(isUnicode(linetext))
         linetext = linetext.replace('\0', u'\uFFFD') # Pango can't handle NULL bytes in markup
 
-        if not(self.query.isRegExp):
-            (linetext, numLineMatches) = escapeAndHighlight(linetext, self.query.text, self.query.caseSensitive, self.query.wholeWord)
-            self.numMatches += numLineMatches
-        else:
-            linetext = escapeMarkup(linetext)
-            self.numMatches += 1
-        self.numLines += 1
+        linetext = self._highlighter.highlight(linetext)
 
         if addTruncationMarker:
             linetext += "</span><span size=\"smaller\"><i> [...]</i>"
-        line = "<b>%d:</b> <span foreground=\"blue\">%s</span>" % (lineno, linetext)
-        newIt = self.treeStore.append(it, None)
-        self.treeStore.set(newIt, 0, line, 2, lineno)
+        return "<b>%d:</b> <span foreground=\"blue\">%s</span>" % (lineno, linetext)
 
     def on_row_activated (self, widget, path, col):
         selectedIter = self.treeStore.get_iter(path)
-        parentIter = self.treeStore.iter_parent(selectedIter)
-        lineno = 0
-        if parentIter == None:
-            file = self.treeStore.get_value(selectedIter, 1)
-        else:
-            file = self.treeStore.get_value(parentIter, 1)
-            lineno = self.treeStore.get_value(selectedIter, 2)
-
-        if not(file):
+        (fileId, index) = self.treeStore.get(selectedIter, 0, 1)
+        if fileId < 0:
+            action = self._infoActions.get(index)
+            if action:
+                # (the rows are replaced, so don't do this within the signal handler)
+                GLib.idle_add(action)
             return
+        file = self.results.getFileName(fileId)
+        lineno = 0
+        if index >= 0:
+            lineno = self.results.getLineno(index)
 
         uri="file://%s" % quote(file)
         location=Gio.file_new_for_uri(uri)
@@ -306,14 +607,111 @@ class ResultPanel:
             mi.show()
             menu.append(mi)
 
+            mi = Gtk.SeparatorMenuItem.new()
+            mi.show()
+            menu.append(mi)
+
+            mi = Gtk.MenuItem(label=_("Refine Search..."))
+            mi.connect_object("activate", ResultPanel.onRefineActivate, self)
+            mi.set_sensitive(len(self.results) > 0)
+            mi.show()
+            menu.append(mi)
+
             menu.popup(None, None, None, None, event.button, event.time)
             return True
         else:
             return False
 
+    def on_tvFileSearchResult_key_press_event (self, treeview, event):
+        "F3 or Ctrl+G jump to the next row containing the last find-as-you-type text; with Shift, to the previous one"
+        keyName = Gdk.keyval_name(event.keyval)
+        if keyName == "F3" or (keyName in ("g", "G") and (event.state & Gdk.ModifierType.CONTROL_MASK)):
+            self.jumpToNextMatch(bool(event.state & Gdk.ModifierType.SHIFT_MASK))
+            return True
+        return False
+
+    def on_tvFileSearchResult_query_tooltip (self, treeview, x, y, keyboardMode, tooltip):
+        """
+        Shows the lines around a result, and its file name, as tooltip of the
+        result row; the rows with the search summary show the search statistics.
+        """
+        (isRow, x, y, model, path, it) = treeview.get_tooltip_context(x, y, keyboardMode)
+        if not(isRow):
+            return False
+        (fileId, index) = self.treeStore.get(it, 0, 1)
+        if fileId < 0:
+            line = self._infoLines[index]
+            if not(self.stats) or not(line is self._searchSummary or line is self._finishedLine):
+                return False
+            tooltip.set_markup(self._formatStats())
+            treeview.set_tooltip_row(tooltip, path)
+            return True
+        if index < 0 or self.query.contextLines <= 0:
+            return False
+
+        file = self.results.getFileName(fileId)
+        lineno = self.results.getLineno(index)
+        lines = getContextProvider().getLines(file, lineno, self.query.contextLines, self._onContextLoaded)
+        if not(lines):
+            return False # (the file is still being read, or can't be read)
+
+        markup = ["<b>%s</b>" % escapeMarkup(file.decode("utf-8", "replace"))]
+        for (n, text) in lines:
+            text = text[:MAX_CONTEXT_LINE_LENGTH].replace('\0', u'\uFFFD')
+            if n == lineno:
+                markup.append("<tt><b>%d:</b> %s</tt>" % (n, self._highlighter.highlight(text)))
+            else:
+                markup.append("<tt>%d: %s</tt>" % (n, escapeMarkup(text)))
+        tooltip.set_markup("\n".join(markup))
+        treeview.set_tooltip_row(tooltip, path)
+        return True
+
+    def _onContextLoaded (self):
+        if self.treeView:
+            self.treeView.trigger_tooltip_query()
+
+    def _getFileRowText (self, fileId):
+        "returns the text of a file row, for find-as-you-type"
+        (directory, name) = self._splitDisplayName(self.results.getFileName(fileId))
+        return "/" + (directory + name).lstrip("/")
+
+    def isSearchMatch (self, it, key):
+        "returns True if the given row contains the find-as-you-type text"
+        self._lastSearchKey = key
+        (fileId, index) = self.treeStore.get(it, 0, 1)
+        if fileId < 0:
+            return False
+        rowNum = self._textIndex.getRowNum(fileId, index)
+        rowNums = self._textIndex.findRows(key)
+        i = bisect.bisect_left(rowNums, rowNum)
+        return i < len(rowNums) and rowNums[i] == rowNum
+
+    def jumpToNextMatch (self, backwards=False):
+        "moves the cursor to the next (or previous) row which contains the last find-as-you-type text"
+        if not(self._lastSearchKey):
+            return
+        rowNum = -1
+        (path, column) = self.treeView.get_cursor()
+        if path is not None:
+            (fileId, index) = self.treeStore.get(self.treeStore.get_iter(path), 0, 1)
+            if fileId >= 0:
+                rowNum = self._textIndex.getRowNum(fileId, index)
+
+        rowNum = self._textIndex.findNextRow(self._lastSearchKey, rowNum, backwards)
+        if rowNum is None:
+            return
+        (fileId, index) = self._textIndex.getRow(rowNum)
+        it = self.fileRows[fileId]
+        if index >= 0:
+            it = self.treeStore.iter_nth_child(it, self._textIndex.childNums[index])
+        path = self.treeStore.get_path(it)
+        self.treeView.expand_to_path(path)
+        self.treeView.set_cursor(path, None, False)
+        self.treeView.scroll_to_cell(path, None, True, 0.5, 0.0)
+
     def onCopyActivate (self, treeview, path):
         it = treeview.get_model().get_iter(path)
-        markupText = treeview.get_model().get_value(it, 0)
+        markupText = self.getRowMarkup(it)
         plainText = Pango.parse_markup(markupText, -1, u'\x00')[2]
 
         clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
@@ -328,27 +726,125 @@ class ResultPanel:
         self._collapseAll = True
         treeview.collapse_all()
 
+    def onRefineActivate (self):
+        "Asks for a new search text, and searches for it within the current results"
+        dialog = Gtk.Dialog(title=_("Refine Search"), transient_for=self._window, modal=True)
+        dialog.add_button("gtk-cancel", Gtk.ResponseType.CANCEL)
+        dialog.add_button("gtk-find", Gtk.ResponseType.OK)
+        dialog.set_default_response(Gtk.ResponseType.OK)
+        dialog.set_response_sensitive(Gtk.ResponseType.OK, False)
+
+        box = dialog.get_content_area()
+        box.set_spacing(6)
+        box.set_border_width(6)
+
+        entry = Gtk.Entry(activates_default=True)
+        entry.connect("changed", lambda e: dialog.set_response_sensitive(Gtk.ResponseType.OK, e.get_text() != ""))
+        box.pack_start(entry, False, False, 0)
+
+        cbCaseSensitive = Gtk.CheckButton(label=_("Case sensitive"))
+        cbCaseSensitive.set_active(self.query.caseSensitive)
+        box.pack_start(cbCaseSensitive, False, False, 0)
+        cbRegExp = Gtk.CheckButton(label=_("Regular expression"))
+        cbRegExp.set_active(self.query.isRegExp)
+        box.pack_start(cbRegExp, False, False, 0)
+        cbWholeWord = Gtk.CheckButton(label=_("Whole word"))
+        cbWholeWord.set_active(self.query.wholeWord)
+        box.pack_start(cbWholeWord, False, False, 0)
+
+        rbFilterLines = Gtk.RadioButton.new_with_label_from_widget(None, _("Search in the found lines"))
+        box.pack_start(rbFilterLines, False, False, 0)
+        rbSearchFiles = Gtk.RadioButton.new_with_label_from_widget(rbFilterLines, _("Search in the files with matches"))
+        box.pack_start(rbSearchFiles, False, False, 0)
+
+        dialog.show_all()
+        response = dialog.run()
+
+        query = copy.copy(self.query)
+        query.text = entry.get_text()
+        query.caseSensitive = cbCaseSensitive.get_active()
+        query.isRegExp = cbRegExp.get_active()
+        query.wholeWord = cbWholeWord.get_active()
+        filterLines = rbFilterLines.get_active()
+        dialog.destroy()
+
+        if response != Gtk.ResponseType.OK or query.text == "":
+            return
+        ResultPanel(self._window, self.pluginHelper, query, self, filterLines)
+
 
-def resultSearchCb (model, column, key, it, userdata):
-    """Callback function for searching in result list"""
-    lineText = model.get_value(it, column)
-    plainText = Pango.parse_markup(lineText, -1, u'\x00')[2] # remove Pango markup
+class ResultForwarder:
+    """
+    Is the result handler of a single search process; passes its results on
+    to the ResultPanel until the panel starts another search (so results of
+    a cancelled search can't get mixed up with the new ones).
+    """
+    def __init__ (self, resultPanel):
+        self.resultPanel = resultPanel
 
-    # for file names, add a leading slash before matching:
-    parentIter = model.iter_parent(it)
-    if parentIter == None and not(plainText.startswith("/")):
-        plainText = "/" + plainText
+    def handleResults (self, results):
+        if self.resultPanel:
+            self.resultPanel.handleResults(results)
 
-    # if search text contains only lower-case characters, do case-insensitive matching:
-    if key.islower():
-        plainText = plainText.lower()
+    def handleFinished (self):
+        if self.resultPanel:
+            self.resultPanel.handleFinished()
 
-    # if the line contains the search text, it matches:
-    if plainText.find(key) >= 0:
-        return False
 
-    # line doesn't match:
-    return True
+class Highlighter:
+    """
+    Creates markup for the result lines of a query, with all matches
+    highlighted. The query pattern is only compiled once. Regular expressions
+    are matched with Python syntax (like in buildQueryRE()), or as basic
+    regular expressions (like grep) if basicRegExp is set; if they can't be
+    compiled (or translated), lines are only escaped.
+    """
+    def __init__ (self, query, basicRegExp=False):
+        self.pattern = None
+        text = query.text
+        if query.isRegExp and basicRegExp:
+            text = translateBasicRegExp(text)
+            if text is None:
+                return
+        try:
+            self.pattern = buildQueryRE(text, query.caseSensitive, query.wholeWord, query.isRegExp)
+        except re.error:
+            pass
+
+    def highlight (self, text):
+        "returns the markup for a single line"
+        if self.pattern is None:
+            return escapeMarkup(text)
+        parts = []
+        pos = 0
+        for m in self.pattern.finditer(text):
+            (start, end) = m.span()
+            if start == end:
+                continue # don't highlight empty matches (eg. of "x*")
+            parts.append(escapeMarkup(text[pos:start]))
+            parts.append(HIGHLIGHT_START)
+            parts.append(escapeMarkup(text[start:end]))
+            parts.append(HIGHLIGHT_END)
+            pos = end
+        parts.append(escapeMarkup(text[pos:]))
+        return "".join(parts)
+
+    def countMatches (self, texts):
+        """
+        returns the total number of (non-empty) matches in the given lines; every
+        line counts as at least one match (eg. if only an empty match was found
+        in it, like for "^$")
+        """
+        if self.pattern is None:
+            return len(texts)
+        finditer = self.pattern.finditer
+        return sum(max(1, sum(1 for m in finditer(t) if m.end() > m.start())) for t in texts)
+
+
+def resultSearchCb (model, column, key, it, userdata):
+    """Callback function for searching in result list; userdata is the ResultPanel"""
+    # (returns False if the row matches)
+    return not(userdata.isSearchMatch(it, key))
 
 
 def escapeMarkup (origText):
@@ -358,50 +854,3 @@ def escapeMarkup (origText):
     text = text.replace('<', '&lt;')
     text = text.replace('>', '&gt;')
     return text
-
-def escapeAndHighlight (origText, searchText, caseSensitive, wholeWord):
-    """
-    Replaces Pango markup special characters, and adds highlighting markup
-    around text fragments that match searchText.
-    """
-
-    # split origText by searchText; the resulting list will contain normal text
-    # and matching text interleaved (if two matches are adjacent in origText,
-    # they will be separated by an empty string in the resulting list).
-    matchLen = len(searchText)
-    fragments = []
-    startPos = 0
-    text = origText[:]
-    pattern = buildQueryRE(searchText, caseSensitive, wholeWord)
-    while True:
-        m = pattern.search(text, startPos)
-        if m is None:
-            break
-        pos = m.start()
-
-        preStr = origText[startPos:pos]
-        matchStr = origText[pos:pos+matchLen]
-        fragments.append(preStr)
-        fragments.append(matchStr)
-        startPos = pos+matchLen
-    fragments.append(text[startPos:])
-
-    numMatches = (len(fragments) - 1) / 2
-
-    if len(fragments) < 3:
-        print("too few fragments (got only %d)" % len(fragments))
-        print("text: '%s'" % origText.encode("utf8", "replace"))
-        numMatches += 1
-    #assert(len(fragments) > 2)
-
-    # join fragments again, adding markup around matches:
-    retText = ""
-    highLight = False
-    for f in fragments:
-        f = escapeMarkup(f)
-        if highLight:
-            retText += "<span background=\"#FFFF00\">%s</span>" % f
-        else:
-            retText += f
-        highLight = not(highLight)
-    return (retText, numMatches)
@@ -0,0 +1,356 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Compact storage for the results of a search:
+# - ResultStore (holds the (filename, lineno, linetext) results of a ResultPanel in memory)
+# - ResultSpillFile (holds results in a temporary file, when there are too many to keep in memory)
+# - ResultTextIndex (searches the plain text of the displayed rows, for find-as-you-type in the result list)
+#
+# Instead of a tuple per result (with a str and two other objects), results
+# are kept in parallel arrays: the file ID (an index into the table of file
+# names, which holds each name only once), the line number, and the end
+# offset of the line text. All line texts are stored together, in UTF-8,
+# in a single buffer.
+#
+
+
+import struct
+import bisect
+import tempfile
+from array import array
+
+
+# each result in a ResultSpillFile starts with file ID, line number and text length:
+SPILL_RECORD_HEADER = struct.Struct("<IiI")
+# a ResultSpillFile remembers the file offset of every n-th result:
+SPILL_INDEX_INTERVAL = 1024
+
+
+class ResultStore:
+    """
+    Holds search results in the order they were added. Results are numbered
+    by their index; files are numbered by their file ID, in the order of their
+    first result. Results can only be added, not modified or removed.
+
+    store[i] and store[i:j] return results as (filename, lineno, linetext)
+    tuples, like they are passed to handleResults().
+    """
+    def __init__ (self):
+        self.fileNames = [] # file ID -> file name
+        self.fileIds = {} # file name -> file ID
+        self.resultFileIds = array("i")
+        self.linenos = array("i")
+        self.textEnds = array("q") # end offset of each line text in textBuffer
+        self.textBuffer = bytearray()
+
+    def __len__ (self):
+        return len(self.linenos)
+
+    def __getitem__ (self, index):
+        if isinstance(index, slice):
+            return [self.getResult(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return self.getResult(index)
+
+    def add (self, results):
+        "Adds a list of (filename, lineno, linetext) tuples"
+        fileNames = self.fileNames
+        fileIds = self.fileIds
+        resultFileIds = self.resultFileIds
+        linenos = self.linenos
+        textEnds = self.textEnds
+        textBuffer = self.textBuffer
+        lastFile = None
+        for (file, lineno, linetext) in results:
+            if file is not lastFile:
+                fileId = fileIds.get(file)
+                if fileId is None:
+                    fileId = len(fileNames)
+                    fileIds[file] = fileId
+                    fileNames.append(file)
+                lastFile = file
+            resultFileIds.append(fileId)
+            linenos.append(lineno)
+            textBuffer += linetext.encode("utf-8", "surrogatepass")
+            textEnds.append(len(textBuffer))
+
+    def numFiles (self):
+        return len(self.fileNames)
+
+    def getFileNames (self):
+        "returns a list of all files with results, ordered by file ID"
+        return list(self.fileNames)
+
+    def getFileName (self, fileId):
+        return self.fileNames[fileId]
+
+    def getFileId (self, index):
+        "returns the file ID of the given result"
+        return self.resultFileIds[index]
+
+    def getLineno (self, index):
+        return self.linenos[index]
+
+    def getText (self, index):
+        start = self.textEnds[index - 1] if index > 0 else 0
+        return self.textBuffer[start:self.textEnds[index]].decode("utf-8", "surrogatepass")
+
+    def getResult (self, index):
+        "returns the given result as (filename, lineno, linetext) tuple"
+        return (self.fileNames[self.resultFileIds[index]], self.linenos[index], self.getText(index))
+
+    def iterResults (self, start=0):
+        "yields all results from the given index on, as (filename, lineno, linetext) tuples"
+        for i in range(start, len(self)):
+            yield self.getResult(i)
+
+
+class ResultSpillFile:
+    """
+    Stores results in an anonymous temporary file (which is removed when it's
+    closed), so their number is only limited by disk space. Has the same
+    interface for reading results as ResultStore.
+
+    Each result is stored as SPILL_RECORD_HEADER followed by the UTF-8 line
+    text. Only the table of file names and the offset of every
+    SPILL_INDEX_INTERVAL-th result are kept in memory.
+
+    Other users of the results (like a ResultFilterProcess) call acquire();
+    the file is only closed when close() was called once by its creator and
+    once for each acquire().
+    """
+    def __init__ (self):
+        self.file = tempfile.TemporaryFile(prefix="gedit-file-search-")
+        self.numUsers = 1
+        self.fileNames = [] # file ID -> file name
+        self.fileIds = {} # file name -> file ID
+        self.numResults = 0
+        self.size = 0
+        self.indexOffsets = array("q") # file offset of every SPILL_INDEX_INTERVAL-th result
+        self.cursor = (0, 0) # (index, offset) of the result after the last one read
+
+    def acquire (self):
+        self.numUsers += 1
+
+    def close (self):
+        self.numUsers -= 1
+        if self.numUsers <= 0 and self.file:
+            self.file.close()
+            self.file = None
+
+    def __len__ (self):
+        return self.numResults
+
+    def __getitem__ (self, index):
+        if isinstance(index, slice):
+            (start, stop, step) = index.indices(len(self))
+            assert step == 1
+            return self.readResults(start, stop - start)
+        if index < 0:
+            index += len(self)
+        return self.readResults(index, 1)[0]
+
+    def add (self, results):
+        "Appends (filename, lineno, linetext) tuples to the file"
+        data = bytearray()
+        pack = SPILL_RECORD_HEADER.pack
+        for (file, lineno, linetext) in results:
+            fileId = self.fileIds.get(file)
+            if fileId is None:
+                fileId = len(self.fileNames)
+                self.fileIds[file] = fileId
+                self.fileNames.append(file)
+            if self.numResults % SPILL_INDEX_INTERVAL == 0:
+                self.indexOffsets.append(self.size + len(data))
+            text = linetext.encode("utf-8", "surrogatepass")
+            data += pack(fileId, lineno, len(text))
+            data += text
+            self.numResults += 1
+        self.file.seek(self.size)
+        self.file.write(data)
+        self.size += len(data)
+
+    def numFiles (self):
+        return len(self.fileNames)
+
+    def getFileNames (self):
+        "returns a list of all files with results, ordered by file ID"
+        return list(self.fileNames)
+
+    def readResults (self, start, count):
+        "returns a list of up to count results, starting at the given index"
+        end = min(start + count, self.numResults)
+        if start >= end:
+            return []
+
+        # continue reading at the last position, or at the nearest indexed result:
+        (index, offset) = self.cursor
+        if index > start or index + SPILL_INDEX_INTERVAL < start:
+            index = start - start % SPILL_INDEX_INTERVAL
+            offset = self.indexOffsets[index // SPILL_INDEX_INTERVAL]
+
+        self.file.flush()
+        self.file.seek(offset)
+        read = self.file.read
+        unpack = SPILL_RECORD_HEADER.unpack
+        headerSize = SPILL_RECORD_HEADER.size
+        results = []
+        while index < end:
+            (fileId, lineno, textLen) = unpack(read(headerSize))
+            text = read(textLen)
+            if index >= start:
+                results.append( (self.fileNames[fileId], lineno, text.decode("utf-8", "surrogatepass")) )
+            index += 1
+            offset += headerSize + textLen
+        self.cursor = (index, offset)
+        return results
+
+    def iterResults (self, start=0):
+        "yields all results from the given index on, as (filename, lineno, linetext) tuples"
+        while start < self.numResults:
+            results = self.readResults(start, SPILL_INDEX_INTERVAL)
+            start += len(results)
+            for r in results:
+                yield r
+
+
+class ResultTextIndex:
+    """
+    Searches the plain text of the file and result rows of a result list:
+    "/" and the relative path for file rows (as returned by fileText(fileId)),
+    and "lineno: text" for the result rows (read from store, a ResultStore).
+    Searching joins all texts, so that rows are found with str.find instead
+    of checking each row; the joined text is only kept until rows are added.
+
+    Rows are numbered in the order of the tree: each file row is followed by
+    the rows of its results (even if results of other files were added in
+    between). File rows are identified by their file ID, and result rows by
+    their result index.
+    """
+    def __init__ (self, store, fileText):
+        self.store = store
+        self.fileText = fileText
+        self.fileResults = [] # file ID -> array of its result indexes
+        self.childNums = array("i") # result index -> position among the results of its file
+        self._rows = None # (row file IDs, row result indexes, file row numbers, result row numbers)
+        self._joined = {} # (caseSensitive) -> (joined text, start offset of each row)
+        self._matches = (None, None) # (key, list of matching row numbers) of the last search
+
+    def addFile (self, fileId):
+        "adds a file row (file IDs must be added in order)"
+        self.fileResults.append(array("i"))
+        self._changed()
+
+    def addResult (self, fileId, index):
+        "adds a result row (result indexes must be added in order)"
+        fileResults = self.fileResults[fileId]
+        self.childNums.append(len(fileResults))
+        fileResults.append(index)
+        self._changed()
+
+    def _changed (self):
+        self._rows = None
+        self._joined = {}
+        self._matches = (None, None)
+
+    def _getRows (self):
+        "numbers the rows in tree order (once after rows were added)"
+        if self._rows is None:
+            rowFileIds = array("i") # row number -> file ID
+            rowIndexes = array("i") # row number -> result index (-1 for file rows)
+            fileRowNums = array("i") # file ID -> row number
+            resultRowNums = array("i", bytes(len(self.childNums) * rowIndexes.itemsize)) # result index -> row number
+            for (fileId, indexes) in enumerate(self.fileResults):
+                fileRowNums.append(len(rowFileIds))
+                rowFileIds.append(fileId)
+                rowIndexes.append(-1)
+                for index in indexes:
+                    resultRowNums[index] = len(rowFileIds)
+                    rowFileIds.append(fileId)
+                    rowIndexes.append(index)
+            self._rows = (rowFileIds, rowIndexes, fileRowNums, resultRowNums)
+        return self._rows
+
+    def getRow (self, rowNum):
+        "returns (fileId, index) of the given row"
+        (rowFileIds, rowIndexes, fileRowNums, resultRowNums) = self._getRows()
+        return (rowFileIds[rowNum], rowIndexes[rowNum])
+
+    def _getTexts (self):
+        "yields the text of each row"
+        store = self.store
+        (rowFileIds, rowIndexes, fileRowNums, resultRowNums) = self._getRows()
+        for (fileId, index) in zip(rowFileIds, rowIndexes):
+            if index < 0:
+                yield self.fileText(fileId)
+            else:
+                yield "%d: %s" % (store.getLineno(index), store.getText(index))
+
+    def getRowNum (self, fileId, index):
+        (rowFileIds, rowIndexes, fileRowNums, resultRowNums) = self._getRows()
+        if index < 0:
+            return fileRowNums[fileId]
+        return resultRowNums[index]
+
+    def findRows (self, key):
+        """
+        Returns the sorted numbers of all rows whose text contains key; like
+        the default tree view search, matching is case-insensitive if key
+        contains no upper-case characters.
+        """
+        if self._matches[0] == key:
+            return self._matches[1]
+
+        caseSensitive = not(key.islower())
+        joined = self._joined.get(caseSensitive)
+        if joined is None:
+            texts = list(self._getTexts())
+            if not(caseSensitive):
+                texts = [t.lower() for t in texts] # (might change the length of texts)
+            starts = array("q")
+            pos = 0
+            for t in texts:
+                starts.append(pos)
+                pos += len(t) + 1
+            joined = ("\n".join(texts), starts)
+            self._joined[caseSensitive] = joined
+        (text, starts) = joined
+
+        rowNums = []
+        pos = text.find(key)
+        while pos >= 0:
+            rowNum = bisect.bisect_right(starts, pos) - 1
+            rowNums.append(rowNum)
+            if rowNum + 1 >= len(starts):
+                break
+            pos = text.find(key, starts[rowNum + 1])
+        self._matches = (key, rowNums)
+        return rowNums
+
+    def findNextRow (self, key, rowNum, backwards=False):
+        "returns the number of the next (or previous) row after rowNum which contains key, or None"
+        rowNums = self.findRows(key)
+        if not(rowNums):
+            return None
+        if backwards:
+            i = bisect.bisect_left(rowNums, rowNum) - 1
+        else:
+            i = bisect.bisect_right(rowNums, rowNum)
+        return rowNums[i % len(rowNums)] # (continue at the other end of the list)
@@ -22,7 +22,6 @@
 #
 # Helper classes:
 # - RecentList (holds list of recently-selected search directories, for search dialog)
-# - SearchQuery (holds all parameters for a search; also, can read and write these from/to GSettings)
 #
 
 import os
@@ -30,13 +29,18 @@ try:
     from urllib.parse import quote, unquote
 except:
     from urllib import quote, unquote
-from gi.repository import Gtk, Gdk, Gio, Pango
+from gi.repository import Gtk, Gdk, Gio, GLib, Pango
 
-from .plugin_common import _, ngettext, APP_NAME, resourceDir, gladeFile, isUnicode, gtkToUnicode
+from .plugin_common import _, ngettext, APP_NAME, gladeFile, isUnicode, gtkToUnicode
 from .result_panel import ResultPanel
+from .file_list_cache import fileListKey
+from .result_cache import resultCacheKey
+from .search_query import SearchQuery, loadSettings
 
-
-GSETTINGS_SCHEMA_NAME = "io.github.oliver.gedit-file-search"
+# when searching as you type, the search starts this long (in milliseconds) after the last change of the search text:
+LIVE_SEARCH_DELAY = 300
+# minimum length of the search text for searching as you type:
+LIVE_SEARCH_MIN_CHARS = 2
 
 
 class RecentList:
@@ -114,36 +118,21 @@ class RecentList:
             return self.store[0][0]
 
 
-class SearchQuery:
+def isNarrowedQuery (query, prevQuery):
     """
-    Contains all parameters for a single search action.
+    Returns True if all lines matching query also match prevQuery, ie. if both
+    search the same files and query only extends the literal search text of prevQuery.
     """
-    def __init__ (self, gclient):
-        self.text = ''
-        self.directory = ''
-        self.fileTypeString = ''
-        self.caseSensitive     = gclient.get_boolean("case-sensitive")
-        self.wholeWord         = gclient.get_boolean("whole-word")
-        self.isRegExp          = gclient.get_boolean("is-reg-exp")
-        self.includeSubfolders = gclient.get_boolean("include-subfolders")
-        self.excludeHidden     = gclient.get_boolean("exclude-hidden")
-        self.excludeBackup     = gclient.get_boolean("exclude-backup")
-        self.excludeVCS        = gclient.get_boolean("exclude-vcs")
-        self.selectFileTypes   = gclient.get_boolean("select-file-types")
-
-    def storeDefaults (self, gclient):
-        gclient.set_boolean("case-sensitive", self.caseSensitive)
-        gclient.set_boolean("whole-word", self.wholeWord)
-        gclient.set_boolean("is-reg-exp", self.isRegExp)
-        gclient.set_boolean("include-subfolders", self.includeSubfolders)
-        gclient.set_boolean("exclude-hidden", self.excludeHidden)
-        gclient.set_boolean("exclude-backup", self.excludeBackup)
-        gclient.set_boolean("exclude-vcs", self.excludeVCS)
-        gclient.set_boolean("select-file-types", self.selectFileTypes)
-
-    def parseFileTypeString (self):
-        "Returns a list with the separate file globs from fileTypeString"
-        return self.fileTypeString.split()
+    if query.isRegExp or prevQuery.isRegExp or query.wholeWord or prevQuery.wholeWord:
+        return False
+    if query.caseSensitive != prevQuery.caseSensitive or fileListKey(query) != fileListKey(prevQuery):
+        return False
+    text = query.text
+    prevText = prevQuery.text
+    if not(query.caseSensitive):
+        text = text.lower()
+        prevText = prevText.lower()
+    return prevText in text
 
 
 class SearchDialog:
@@ -166,12 +155,11 @@ class SearchDialog:
 
         self._lastDir = None
         self._autoCompleteList = None
+        self._livePanel = None # result panel for searching as you type
+        self._liveSearchSourceId = None
 
     def initGSettings(self):
-        schemaSource = Gio.SettingsSchemaSource.new_from_directory(
-            resourceDir, Gio.SettingsSchemaSource.get_default(), False)
-        schema = schemaSource.lookup(GSETTINGS_SCHEMA_NAME, False)
-        return Gio.Settings.new_full(schema, None, None)
+        return loadSettings()
 
     def show(self, searchText=None, searchDirectory=None):
         "Displays the search dialog"
@@ -268,8 +256,11 @@ class SearchDialog:
         self.builder.get_object('cbExcludeHidden').set_active(query.excludeHidden)
         self.builder.get_object('cbExcludeBackups').set_active(query.excludeBackup)
         self.builder.get_object('cbExcludeVCS').set_active(query.excludeVCS)
+        self.builder.get_object('cbExcludeIgnored').set_active(query.excludeIgnored)
         self.builder.get_object('cbSelectFileTypes').set_active(query.selectFileTypes)
         self.builder.get_object('cboFileTypeList').set_sensitive( query.selectFileTypes )
+        self._livePanel = None
+        self.builder.get_object('cbSearchAsYouType').set_active(self.gclient.get_boolean("search-as-you-type"))
 
         #
         # actually display search dialog
@@ -280,19 +271,18 @@ class SearchDialog:
             # display and run the search dialog (in a loop until all fields are correctly entered)
             result = self._dialog.run()
             if result != 1:
+                self._cancelLiveSearch()
+                if self._livePanel and self._livePanel.builder:
+                    self._livePanel.destroy()
+                self._livePanel = None
                 self._dialog.destroy()
                 return
 
-            searchText = gtkToUnicode(self.builder.get_object('cboSearchTextEntry').get_text())
-            searchDir = gtkToUnicode(self.builder.get_object('cboSearchDirectoryEntry').get_text())
-            typeListString = gtkToUnicode(self.builder.get_object('cboFileTypeEntry').get_text())
-
-            searchDir = os.path.expanduser(searchDir)
-            searchDir = os.path.normpath(searchDir) + "/"
+            query = self._getDialogQuery()
 
-            if searchText == "":
+            if query.text == "":
                 print("internal error: search text is empty!")
-            elif not(os.path.exists(searchDir)):
+            elif not(os.path.exists(query.directory)):
                 msgDialog = Gtk.MessageDialog(self._dialog, Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
                     Gtk.MessageType.ERROR, Gtk.ButtonsType.OK, _("Directory does not exist"))
                 msgDialog.format_secondary_text(_("The specified directory does not exist."))
@@ -305,8 +295,35 @@ class SearchDialog:
         # handle dialog input
         #
 
-        query.text = searchText
-        query.directory = searchDir
+        self._cancelLiveSearch()
+        self.gclient.set_boolean("search-as-you-type", self.builder.get_object('cbSearchAsYouType').get_active())
+        self._dialog.destroy()
+
+        #print "searching for '%s' in '%s'" % (query.text, query.directory)
+
+        self._lastSearchTerms.add(query.text)
+        self._lastDirs.add(query.directory)
+        self._lastTypes.add(query.fileTypeString)
+        query.storeDefaults(self.gclient)
+        self._lastDir = query.directory
+
+        livePanel = self._livePanel
+        self._livePanel = None
+        if livePanel and livePanel.builder:
+            # keep the results of searching as you type, if they are for the same query:
+            if livePanel.wasCancelled or resultCacheKey(livePanel.query) != resultCacheKey(query):
+                livePanel.restart(query)
+        else:
+            # the ResultPanel object will also start the actual search:
+            ResultPanel(self._window, self._pluginHelper, query)
+
+    def _getDialogQuery (self):
+        "Returns a SearchQuery with the values entered in the search dialog"
+        query = SearchQuery(self.gclient)
+        query.text = gtkToUnicode(self.builder.get_object('cboSearchTextEntry').get_text())
+        searchDir = gtkToUnicode(self.builder.get_object('cboSearchDirectoryEntry').get_text())
+        searchDir = os.path.expanduser(searchDir)
+        query.directory = os.path.normpath(searchDir) + "/"
         query.caseSensitive = self.builder.get_object('cbCaseSensitive').get_active()
         query.isRegExp = self.builder.get_object('cbRegExp').get_active()
         query.wholeWord = self.builder.get_object('cbWholeWord').get_active()
@@ -314,21 +331,39 @@ class SearchDialog:
         query.excludeHidden = self.builder.get_object('cbExcludeHidden').get_active()
         query.excludeBackup = self.builder.get_object('cbExcludeBackups').get_active()
         query.excludeVCS = self.builder.get_object('cbExcludeVCS').get_active()
+        query.excludeIgnored = self.builder.get_object('cbExcludeIgnored').get_active()
         query.selectFileTypes = self.builder.get_object('cbSelectFileTypes').get_active()
-        query.fileTypeString = typeListString
-
-        self._dialog.destroy()
-
-        #print "searching for '%s' in '%s'" % (searchText, searchDir)
-
-        self._lastSearchTerms.add(searchText)
-        self._lastDirs.add(searchDir)
-        self._lastTypes.add(typeListString)
-        query.storeDefaults(self.gclient)
-        self._lastDir = searchDir
-
-        # the ResultPanel object will also start the actual search:
-        ResultPanel(self._window, self._pluginHelper, query)
+        query.fileTypeString = gtkToUnicode(self.builder.get_object('cboFileTypeEntry').get_text())
+        return query
+
+    def _scheduleLiveSearch (self):
+        "(Re)starts the delay for searching as you type, if enabled"
+        self._cancelLiveSearch()
+        if self.builder.get_object('cbSearchAsYouType').get_active():
+            self._liveSearchSourceId = GLib.timeout_add(LIVE_SEARCH_DELAY, self._startLiveSearch)
+
+    def _cancelLiveSearch (self):
+        if self._liveSearchSourceId is not None:
+            GLib.source_remove(self._liveSearchSourceId)
+            self._liveSearchSourceId = None
+
+    def _startLiveSearch (self):
+        "Searches for the text entered so far, replacing the previous search as you type"
+        self._liveSearchSourceId = None
+        query = self._getDialogQuery()
+        if len(query.text) < LIVE_SEARCH_MIN_CHARS or not(os.path.isdir(query.directory)):
+            return False
+
+        panel = self._livePanel
+        if panel is None or not(panel.builder):
+            # (the result panel might have been closed in the meantime)
+            self._livePanel = ResultPanel(self._window, self._pluginHelper, query)
+        elif resultCacheKey(query) != resultCacheKey(panel.query):
+            if panel.searchProcess is None and not(panel.wasCancelled) and isNarrowedQuery(query, panel.query):
+                # all matches must be in files which matched the previous search text:
+                query.files = panel.getAllResults().getFileNames()
+            panel.restart(query)
+        return False
 
     def on_cboSearchTextEntry_changed (self, textEntry):
         """
@@ -339,11 +374,21 @@ class SearchDialog:
             self.builder.get_object('btnSearch').set_sensitive(False)
         else:
             self.builder.get_object('btnSearch').set_sensitive(True)
+        self._scheduleLiveSearch()
+
+    def on_cbSearchAsYouType_toggled (self, checkbox):
+        self._scheduleLiveSearch()
+
+    def on_searchOption_changed (self, widget):
+        "Is called when a search option or the file type filter is modified"
+        self._scheduleLiveSearch()
 
     def on_cbSelectFileTypes_toggled (self, checkbox):
         self.builder.get_object('cboFileTypeList').set_sensitive( checkbox.get_active() )
+        self._scheduleLiveSearch()
 
     def on_cboSearchDirectoryEntry_changed (self, entry):
+        self._scheduleLiveSearch()
         text = entry.get_text()
         if text and self._autoCompleteList != None:
             path = os.path.dirname(text)
@@ -0,0 +1,128 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Parameters of a search:
+# - SearchQuery (holds all parameters for a search; also, can read and write these from/to GSettings)
+# - SchemaDefaults (returns the default settings from the schema file, if GSettings can't be used)
+#
+# loadSettings() returns the GSettings of the plugin.
+#
+
+
+import os
+import ast
+from xml.etree import ElementTree
+from gi.repository import Gio, GLib
+
+from .plugin_common import resourceDir
+
+
+GSETTINGS_SCHEMA_NAME = "io.github.oliver.gedit-file-search"
+GSETTINGS_SCHEMA_FILE = os.path.join(resourceDir, GSETTINGS_SCHEMA_NAME + ".gschema.xml")
+
+
+def loadSettings ():
+    """
+    Returns the Gio.Settings of the plugin (using the schema compiled in the
+    plugin directory), or None if the compiled schema isn't available.
+    """
+    try:
+        schemaSource = Gio.SettingsSchemaSource.new_from_directory(
+            resourceDir, Gio.SettingsSchemaSource.get_default(), False)
+    except GLib.Error:
+        return None
+    schema = schemaSource.lookup(GSETTINGS_SCHEMA_NAME, False)
+    if schema is None:
+        return None
+    return Gio.Settings.new_full(schema, None, None)
+
+
+class SchemaDefaults:
+    """
+    Has the same get_*() methods as Gio.Settings, but always returns the
+    default values from the schema file (eg. when running from the source
+    tree, where the schema isn't compiled).
+    """
+    def __init__ (self, schemaFile=GSETTINGS_SCHEMA_FILE):
+        self.defaults = {} # key name -> default value (in GVariant text format)
+        for key in ElementTree.parse(schemaFile).iter("key"):
+            self.defaults[key.get("name")] = key.findtext("default").strip()
+
+    def get_boolean (self, name):
+        return self.defaults[name] == "true"
+
+    def get_int (self, name):
+        return int(self.defaults[name])
+
+    def get_string (self, name):
+        return ast.literal_eval(self.defaults[name])
+
+    def get_strv (self, name):
+        return list(ast.literal_eval(self.defaults[name]))
+
+
+class SearchQuery:
+    """
+    Contains all parameters for a single search action.
+    """
+    def __init__ (self, gclient):
+        self.text = ''
+        self.directory = ''
+        self.fileTypeString = ''
+        self.files = None # if set, only these files are searched (instead of the directory)
+        self.caseSensitive     = gclient.get_boolean("case-sensitive")
+        self.wholeWord         = gclient.get_boolean("whole-word")
+        self.isRegExp          = gclient.get_boolean("is-reg-exp")
+        self.includeSubfolders = gclient.get_boolean("include-subfolders")
+        self.excludeHidden     = gclient.get_boolean("exclude-hidden")
+        self.excludeBackup     = gclient.get_boolean("exclude-backup")
+        self.excludeVCS        = gclient.get_boolean("exclude-vcs")
+        self.excludeIgnored    = gclient.get_boolean("exclude-ignored")
+        self.selectFileTypes   = gclient.get_boolean("select-file-types")
+
+        # search engine settings (not shown in search dialog):
+        self.streamFileList    = gclient.get_boolean("stream-file-list")
+        self.searchBackend     = gclient.get_string("search-backend")
+        self.grepProcesses     = gclient.get_int("grep-processes")
+        self.indexDirs         = gclient.get_strv("index-dirs")
+        self.watchIndexDirs    = gclient.get_boolean("watch-index-dirs")
+        self.fileListCacheSize = gclient.get_int("file-list-cache-size")
+        self.walkThreads       = gclient.get_int("walk-threads")
+        self.resultCacheSize   = gclient.get_int("result-cache-size")
+        self.maxResultsInMemory = gclient.get_int("max-results-in-memory")
+        self.contextLines      = gclient.get_int("context-lines") # lines before and after a result in its tooltip
+        self.statsLogFile      = gclient.get_string("stats-log-file") # if set, the statistics of each search are appended to this file
+        self.processNice       = gclient.get_int("process-nice") # nice increment for search processes and threads
+        self.ioPriority        = gclient.get_string("io-priority") # "normal", "low" or "idle" (for search processes)
+        self.maxProcessesPerWindow = gclient.get_int("max-processes-per-window") # 0: no limit
+
+    def storeDefaults (self, gclient):
+        gclient.set_boolean("case-sensitive", self.caseSensitive)
+        gclient.set_boolean("whole-word", self.wholeWord)
+        gclient.set_boolean("is-reg-exp", self.isRegExp)
+        gclient.set_boolean("include-subfolders", self.includeSubfolders)
+        gclient.set_boolean("exclude-hidden", self.excludeHidden)
+        gclient.set_boolean("exclude-backup", self.excludeBackup)
+        gclient.set_boolean("exclude-vcs", self.excludeVCS)
+        gclient.set_boolean("exclude-ignored", self.excludeIgnored)
+        gclient.set_boolean("select-file-types", self.selectFileTypes)
+
+    def parseFileTypeString (self):
+        "Returns a list with the separate file globs from fileTypeString"
+        return self.fileTypeString.split()
@@ -0,0 +1,138 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Performance counters of a single search:
+# - SearchStats (is created by the search backend, and filled in by the backend and the ResultPanel)
+# - writeStatsLog() (appends the counters of a finished search to a log file, as JSON)
+#
+
+
+import os
+import json
+import time
+
+
+class SearchStats:
+    """
+    Counts what a search did, and where its time was spent. All times are
+    from time.monotonic(); counters which don't apply to a backend stay 0.
+    Only the directory walk counters are changed from another thread (the
+    walker thread); everything else is only changed from the main loop.
+    """
+    def __init__ (self, backend):
+        self.backend = backend
+        self.startTime = time.monotonic()
+        self.firstResultTime = None # when the ResultPanel got the first result
+        self.firstRowTime = None # when the first result was displayed
+        self.finishTime = None
+        self.cancelled = False
+
+        # directory walk:
+        self.walkTime = None
+        self.dirsRead = 0
+        self.filesFound = 0
+
+        # searching in files:
+        self.filesSearched = 0
+        self.grepProcesses = 0
+        self.pipeReads = 0
+        self.bytesRead = 0
+        self.linesParsed = 0
+        self.results = 0
+
+        # main loop callbacks of the backend:
+        self.numCallbacks = 0
+        self.callbackTime = 0.0
+        self.maxCallbackTime = 0.0
+
+        # result list:
+        self.rowsAdded = 0
+        self.displayTime = 0.0
+
+    def addCallback (self, startTime):
+        "records a main loop callback of the backend, which started at startTime"
+        duration = time.monotonic() - startTime
+        self.numCallbacks += 1
+        self.callbackTime += duration
+        self.maxCallbackTime = max(self.maxCallbackTime, duration)
+
+    def addResults (self, numResults):
+        if self.firstResultTime is None:
+            self.firstResultTime = time.monotonic()
+        self.results += numResults
+
+    def addRows (self, numRows, startTime):
+        "records that numRows rows were added to the result list, starting at startTime"
+        now = time.monotonic()
+        if self.firstRowTime is None and numRows > 0:
+            self.firstRowTime = now
+        self.rowsAdded += numRows
+        self.displayTime += now - startTime
+
+    def finish (self, cancelled=False):
+        if self.finishTime is None:
+            self.finishTime = time.monotonic()
+            self.cancelled = cancelled
+
+    def _sinceStart (self, t):
+        if t is None:
+            return None
+        return t - self.startTime
+
+    def toDict (self):
+        "returns the counters as a dict (times are in seconds, from the start of the search)"
+        return {
+            "backend": self.backend,
+            "cancelled": self.cancelled,
+            "timeToFirstResult": self._sinceStart(self.firstResultTime),
+            "timeToFirstRow": self._sinceStart(self.firstRowTime),
+            "totalTime": self._sinceStart(self.finishTime),
+            "walkTime": self.walkTime,
+            "dirsRead": self.dirsRead,
+            "filesFound": self.filesFound,
+            "filesSearched": self.filesSearched,
+            "grepProcesses": self.grepProcesses,
+            "pipeReads": self.pipeReads,
+            "bytesRead": self.bytesRead,
+            "linesParsed": self.linesParsed,
+            "results": self.results,
+            "numCallbacks": self.numCallbacks,
+            "callbackTime": self.callbackTime,
+            "maxCallbackTime": self.maxCallbackTime,
+            "rowsAdded": self.rowsAdded,
+            "displayTime": self.displayTime,
+        }
+
+
+def writeStatsLog (path, stats, query):
+    "appends the counters of a search, together with its query, as a line of JSON to the given file"
+    entry = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "text": query.text,
+        "directory": query.directory,
+        "caseSensitive": query.caseSensitive,
+        "wholeWord": query.wholeWord,
+        "isRegExp": query.isRegExp,
+        "stats": stats.toDict(),
+    }
+    try:
+        with open(os.path.expanduser(path), "a") as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+    except (IOError, OSError) as e:
+        print("error writing search statistics to '%s': %s" % (path, e))
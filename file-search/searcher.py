@@ -18,29 +18,46 @@
 
 #
 # Search functionality classes:
-# - LineSplitter (accumulates incoming strings and splits them into lines)
+# - LineSplitter (accumulates incoming strings and splits them into batches of lines)
 # - RunCommand (runs a shell command and passes the output to LineSplitter)
+# - ProcessLimiter (limits the number of search processes running at the same time)
 # - GrepProcess (uses RunCommand to run Grep, parses its output, and passes that to the result window)
-# - SearchProcess (uses RunCommand to run Find, parses its output, and starts GrepProcess)
+# - PythonGrepProcess (alternative to GrepProcess; searches files in worker threads, without running Grep)
+# - SearchProcess (finds files with a DirectoryWalker, and passes them to GrepProcess)
+# - ResultFilterProcess (searches the result lines of a previous search, instead of files)
 #
 
 
 import os
+import sys
 import fcntl
+import signal
+import shutil
 import subprocess
 import re
 import errno
+import time
+import mmap
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, Future
 from gi.repository import GLib, GObject
 
 from .plugin_common import isUnicode
+from .trigram_index import getIndexFilter
+from .file_list_cache import FileList, getFileListCache, fileListKey
+from .dir_walker import DirectoryWalker, FileFilter, normalizeDir
+from .result_cache import SearchResults, resultCacheKey
+from .search_stats import SearchStats
 
 
 class LineSplitter:
-    "Split incoming text into lines which are passed to the resultHandler object"
-    def __init__ (self, resultHandler):
-        self.buf = b""
+    "Split incoming text into lines which are passed (in batches) to the resultHandler object"
+    def __init__ (self, resultHandler, stats):
+        self.buf = bytearray() # incomplete last line of the previous fragments
         self.cancelled = False
         self.resultHandler = resultHandler
+        self.stats = stats
 
     def cancel (self):
         self.cancelled = True
@@ -49,111 +66,436 @@ class LineSplitter:
         if self.cancelled:
             return
 
-        self.buf = self.buf + text
+        end = text.rfind(b"\n")
+        if end < 0:
+            self.buf += text
+            return
+
+        # split all complete lines in one go:
+        if self.buf:
+            self.buf += memoryview(text)[:end]
+            lines = bytes(self.buf).split(b"\n")
+            self.buf = bytearray()
+        else:
+            lines = text[:end].split(b"\n")
+        self.buf += memoryview(text)[end + 1:]
 
-        while b"\n" in self.buf:
-            pos = self.buf.index(b"\n")
-            line = self.buf[:pos]
-            self.buf = self.buf[pos + 1:]
-            self.resultHandler.handleLine(line)
+        self.stats.linesParsed += len(lines)
+        self.resultHandler.handleLines(lines)
 
     def finish (self):
-        self.parseFragment(b"")
-        if self.buf:
-            self.resultHandler.handleLine(self.buf)
+        if self.buf and not(self.cancelled):
+            self.stats.linesParsed += 1
+            self.resultHandler.handleLines([bytes(self.buf)])
+        self.buf = bytearray()
         self.resultHandler.handleFinished()
 
 
+# Reading from pipes starts with small reads (to display first results quickly)
+# and switches to bigger reads as long as the pipe delivers full buffers:
+MIN_READ_SIZE = 512
+MAX_READ_SIZE = 1024 * 1024
+# maximum time (in seconds) to spend reading a pipe in a single main loop callback:
+MAX_READ_TIME = 0.01
+
+
+# ionice arguments for the "io-priority" setting:
+IO_PRIORITY_ARGS = {
+    "normal": None,
+    "low": ["-c", "2", "-n", "7"], # lowest "best effort" priority
+    "idle": ["-c", "3"], # only gets disk time when no other process needs it
+}
+
+_commandPaths = {}
+
+def _findCommand (name):
+    "returns the path of the given command, or None if it's not installed (the result is cached)"
+    if name not in _commandPaths:
+        _commandPaths[name] = shutil.which(name)
+    return _commandPaths[name]
+
+def getPriorityPrefix (nice, ioPriority):
+    """
+    Returns the command line prefix (using nice and ionice) which runs a
+    command with lower CPU and IO priority; nice and ionice are skipped if
+    they are not installed (and ionice runs the command anyway if the IO
+    priority can't be set).
+    """
+    prefix = []
+    ioArgs = IO_PRIORITY_ARGS.get(ioPriority)
+    if ioArgs and _findCommand("ionice"):
+        prefix += [_findCommand("ionice"), "-t"] + ioArgs
+    if nice > 0 and _findCommand("nice"):
+        prefix += [_findCommand("nice"), "-n", str(nice)]
+    return prefix
+
+def lowerThreadPriority (nice):
+    """
+    Sets the CPU priority of the calling thread to nice below the priority of
+    the editor (ie. of its main thread), so calling it again for the same
+    thread changes nothing. This only works on Linux, where each thread has
+    its own nice value (elsewhere it would lower the priority of the whole
+    editor, so nothing is done).
+    """
+    if nice <= 0 or not(sys.platform.startswith("linux")) or not(hasattr(threading, "get_native_id")):
+        return
+    try:
+        # (on Linux, the process ID is the thread ID of the main thread)
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), os.getpriority(os.PRIO_PROCESS, os.getpid()) + nice)
+    except OSError as e:
+        print("error changing thread priority: %s" % e)
+
+
 class RunCommand:
-    "Run a command in background, passing all of its stdout output to a LineSplitter"
-    def __init__ (self, cmd, resultHandler, prio=GObject.PRIORITY_LOW):
-        self.lineSplitter = LineSplitter(resultHandler)
+    """
+    Run a command in background, passing all of its stdout output to a LineSplitter.
+    Pipe reads, parsed lines and callback times are counted in stats (a SearchStats).
+
+    The command runs in its own process group (so cancel() also kills any
+    processes it started), with the CPU and IO priority lowered by nice and
+    ioPriority (see getPriorityPrefix()).
+    """
+    def __init__ (self, cmd, resultHandler, prio=GObject.PRIORITY_LOW, cwd=None, stats=None,
+        nice=0, ioPriority="normal"):
+        if stats is None:
+            stats = SearchStats(None)
+        self.stats = stats
+        self.lineSplitter = LineSplitter(resultHandler, stats)
+        self.readSize = MIN_READ_SIZE
 
+        cmd = getPriorityPrefix(nice, ioPriority) + cmd
         #print("executing command: %s" % cmd)
-        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, close_fds=True)
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, close_fds=True, cwd=cwd,
+            start_new_session=True)
         self.pipe = self.proc.stdout
 
         # make pipe non-blocking:
         fl = fcntl.fcntl(self.pipe, fcntl.F_GETFL)
         fcntl.fcntl(self.pipe, fcntl.F_SETFL, fl | os.O_NONBLOCK)
 
+        # a bigger pipe buffer allows bigger reads (ie. fewer wakeups) with fast output:
+        if hasattr(fcntl, "F_SETPIPE_SZ"):
+            try:
+                fcntl.fcntl(self.pipe, fcntl.F_SETPIPE_SZ, MAX_READ_SIZE)
+            except OSError:
+                pass # size is limited by /proc/sys/fs/pipe-max-size
+
         #print "(add watch)"
         if GObject.pygobject_version < (3,7,2):
-            GObject.io_add_watch(self.pipe, GObject.IO_IN | GObject.IO_ERR | GObject.IO_HUP,
+            self.watchId = GObject.io_add_watch(self.pipe, GObject.IO_IN | GObject.IO_ERR | GObject.IO_HUP,
                 self.onPipeReadable, priority=prio)
         else:
             # avoid deprecation warning in newer versions of PyGObject:
-            GLib.io_add_watch(self.pipe, prio, GLib.IO_IN | GLib.IO_ERR | GLib.IO_HUP,
+            self.watchId = GLib.io_add_watch(self.pipe, prio, GLib.IO_IN | GLib.IO_ERR | GLib.IO_HUP,
                 self.onPipeReadable)
 
     def onPipeReadable (self, fd, cond):
         #print "condition: %s" % cond
-        if (cond & GObject.IO_IN):
-            readText = self.pipe.read(4000)
-            #print "(read %d bytes)" % len(readText)
-            self.lineSplitter.parseFragment(readText)
-            return True
-        else:
-            # read all remaining data from pipe
+        startTime = time.monotonic()
+        try:
+            # Drain the pipe until it's empty or until the time budget for this
+            # callback is used up (so the UI stays responsive with fast output):
             while True:
-                readText = self.pipe.read(4000)
-                #print "(read %d bytes before finish)" % len(readText)
+                readStartTime = time.monotonic()
+                try:
+                    readText = os.read(self.pipe.fileno(), self.readSize)
+                except OSError as e:
+                    if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        return True # no more data available for now
+                    print("error reading from pipe: %s" % e)
+                    readText = b""
+
                 if not(readText):
-                    break
+                    # end of file: the command has exited
+                    #print "(closing pipe)"
+                    self.watchId = None
+                    self.pipe.close()
+                    self.proc.wait()
+                    self.lineSplitter.finish()
+                    self.lineSplitter = None
+                    return False
+
+                #print "(read %d bytes)" % len(readText)
+                self.stats.pipeReads += 1
+                self.stats.bytesRead += len(readText)
                 self.lineSplitter.parseFragment(readText)
+                if self.watchId is None:
+                    return False # cancelled by the result handler
 
-            #print "(closing pipe)"
-            self.pipe.close()
-            self.proc.wait()
-            self.lineSplitter.finish()
-            self.lineSplitter = None
-            return False
+                # adapt read size, so that a single read (including parsing)
+                # takes only a fraction of the time budget:
+                now = time.monotonic()
+                if now - readStartTime > MAX_READ_TIME / 2:
+                    self.readSize = max(self.readSize // 2, MIN_READ_SIZE)
+                elif len(readText) == self.readSize and self.readSize < MAX_READ_SIZE:
+                    self.readSize *= 2
+
+                if now - startTime > MAX_READ_TIME:
+                    return True
+        finally:
+            self.stats.addCallback(startTime)
 
     def cancel (self):
+        """
+        Kills the command (and all other processes in its process group).
+        Its remaining output is not read anymore; the process is reaped in
+        the background, and the LineSplitter is finished from the main loop.
+        """
         #print "(cancelling command)"
+        if self.watchId is None:
+            return # already finished or cancelled
         pid = self.proc.pid
         #print "pid: %d" % pid
+        # (the process isn't reaped yet, so its process group ID can't be reused)
         try:
-            os.kill(pid, 15)
+            os.killpg(pid, signal.SIGKILL)
         except OSError as e:
             if e.errno != errno.ESRCH:
-                print("error killing PID %d: %s" % (pid, e))
+                print("error killing process group %d: %s" % (pid, e))
         self.lineSplitter.cancel()
 
+        GLib.source_remove(self.watchId)
+        self.watchId = None
+        self.pipe.close()
+        GLib.child_watch_add(GLib.PRIORITY_DEFAULT, pid, self._onChildExited)
+        GLib.idle_add(self._finishCancelled)
 
-def buildQueryRE (queryText, caseSensitive, wholeWord):
-    "returns a RegEx pattern for searching for the given queryText"
+    def _onChildExited (self, pid, status):
+        # the process has already been reaped by GLib; only update the Popen object:
+        self.proc.returncode = status
+
+    def _finishCancelled (self):
+        self.lineSplitter.finish()
+        self.lineSplitter = None
+        return False
+
+
+# limits for the files passed to a single grep call:
+MAX_GREP_FILES = 5000
+MAX_GREP_LINE = 3800
+
+
+# escape sequences of basic regular expressions (as used by grep), and the
+# same in the extended syntax of Python and ripgrep (\\< and \\> are only
+# approximated, as Python has no separate start/end of word assertions):
+BASIC_RE_ESCAPES = {
+    "(": "(", ")": ")", "{": "{", "}": "}", "|": "|", "+": "+", "?": "?",
+    "<": "\\b", ">": "\\b", "b": "\\b", "B": "\\B",
+    "w": "\\w", "W": "\\W", "s": "\\s", "S": "\\S",
+}
+# characters which must be escaped in the extended syntax to match themselves:
+EXTENDED_RE_SPECIAL_CHARS = ".^$*+?{}[]\\|()"
+
+
+def _escapeExtended (c):
+    if c in EXTENDED_RE_SPECIAL_CHARS:
+        return "\\" + c
+    return c
+
+def translateBasicRegExp (pattern):
+    """
+    Translates a basic regular expression (as used by grep) into the extended
+    syntax used by Python and ripgrep. Returns None if the expression uses
+    something which can't be translated (like back-references, or character
+    classes like [:alpha:]).
+    """
+    result = []
+    atStart = True # at the start of the expression, a group or an alternative (where '*' is literal)
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            e = pattern[i+1:i+2]
+            i += 2
+            if e in BASIC_RE_ESCAPES:
+                result.append(BASIC_RE_ESCAPES[e])
+                atStart = e in "(|"
+            elif not(e) or e.isalnum():
+                return None # trailing backslash, back-reference, or GNU extension
+            else:
+                result.append(_escapeExtended(e))
+                atStart = False
+        elif c == "[":
+            # bracket expression (a ']' directly after '[' or '[^' is part of the expression)
+            end = i + 1
+            if pattern[end:end+1] == "^":
+                end += 1
+            if pattern[end:end+1] == "]":
+                end += 1
+            end = pattern.find("]", end)
+            if end < 0 or "[" in pattern[i+1:end]:
+                return None
+            # (backslashes are literal in basic bracket expressions; '&' and '~' are special in ripgrep)
+            content = pattern[i+1:end].replace("\\", "\\\\").replace("&", "\\&").replace("~", "\\~")
+            result.append("[" + content + "]")
+            i = end + 1
+            atStart = False
+        else:
+            if c == "^" and atStart:
+                result.append("^") # ('*' after it is still literal)
+            elif c == "$" and (i + 1 == len(pattern) or pattern[i+1:i+3] in ("\\)", "\\|")):
+                result.append("$")
+            elif c == "." or (c == "*" and not(atStart)):
+                result.append(c)
+            else:
+                result.append(_escapeExtended(c))
+            atStart = atStart and c == "^"
+            i += 1
+    return "".join(result)
+
+
+def buildQueryRE (queryText, caseSensitive, wholeWord, isRegExp=False, multiLine=False):
+    """
+    returns a RegEx pattern for searching for the given queryText (regular expressions use Python syntax);
+    with multiLine, '^' and '$' match at the start and end of each line of a longer text
+    """
 
     # word detection etc. cannot be done on an encoding-less string:
     assert(isUnicode(queryText))
 
-    pattern = re.escape(queryText)
-    if wholeWord:
-        if re.search('^\w', queryText, re.UNICODE):
-            pattern = '\\b' + pattern
-        if re.search('\w$', queryText, re.UNICODE):
-            pattern = pattern + '\\b'
+    if isRegExp:
+        pattern = queryText
+        if wholeWord:
+            pattern = '\\b(?:' + pattern + ')\\b'
+    else:
+        pattern = re.escape(queryText)
+        if wholeWord:
+            if re.search('^\w', queryText, re.UNICODE):
+                pattern = '\\b' + pattern
+            if re.search('\w$', queryText, re.UNICODE):
+                pattern = pattern + '\\b'
 
     flags = re.UNICODE
+    if not(caseSensitive):
+        flags |= re.IGNORECASE
+    if multiLine:
+        flags |= re.MULTILINE
+    return re.compile(pattern, flags)
+
+
+def buildQueryBytesRE (queryText, caseSensitive, wholeWord, isRegExp):
+    """
+    returns a RegEx pattern for searching for the given queryText in (UTF-8 encoded)
+    file contents; uses the same rules as buildQueryRE(), but additionally handles
+    regular expressions (with Python syntax)
+    """
+    assert(isUnicode(queryText))
+
+    # In byte patterns, \w only matches ASCII characters; so for whole-word
+    # search, all bytes of multi-byte UTF-8 characters are treated as word
+    # characters, too.
+    if isRegExp:
+        pattern = queryText.encode("utf-8")
+        if wholeWord:
+            pattern = b'(?<![\\w\x80-\xff])(?:' + pattern + b')(?![\\w\x80-\xff])'
+    else:
+        pattern = re.escape(queryText.encode("utf-8"))
+        if wholeWord:
+            if re.search('^\w', queryText, re.UNICODE):
+                pattern = b'(?<![\\w\x80-\xff])' + pattern
+            if re.search('\w$', queryText, re.UNICODE):
+                pattern = pattern + b'(?![\\w\x80-\xff])'
+
+    flags = re.MULTILINE
     if not(caseSensitive):
         flags |= re.IGNORECASE
     return re.compile(pattern, flags)
 
 
+class ProcessLimiter:
+    """
+    Limits the number of search processes which run at the same time (for
+    all searches of a window). Searches which can't start a process call
+    wait() with a callback; waiting callbacks are called (from the main loop)
+    when a process has finished, and can then try again.
+    """
+    def __init__ (self):
+        self.numRunning = 0
+        self.waiting = collections.deque() # callbacks, in the order they started waiting
+        self.wakeUpScheduled = False
+
+    def tryAcquire (self, maxProcesses):
+        "returns True (and counts a running process) if another process may be started; maxProcesses <= 0 means no limit"
+        if maxProcesses > 0 and self.numRunning >= maxProcesses:
+            return False
+        self.numRunning += 1
+        return True
+
+    def release (self):
+        "Called when a process started after tryAcquire() has finished"
+        self.numRunning -= 1
+        if self.waiting and not(self.wakeUpScheduled):
+            self.wakeUpScheduled = True
+            GLib.idle_add(self._wakeUp)
+
+    def wait (self, callback):
+        if callback not in self.waiting:
+            self.waiting.append(callback)
+
+    def cancelWait (self, callback):
+        if callback in self.waiting:
+            self.waiting.remove(callback)
+
+    def _wakeUp (self):
+        self.wakeUpScheduled = False
+        waiting = list(self.waiting)
+        self.waiting.clear()
+        for callback in waiting:
+            callback() # (calls wait() again if there is still no free process)
+        return False
+
+
+class GrepBatch:
+    "Receives the grep output for a single batch of files"
+    def __init__ (self, grepProcess, seq):
+        self.grepProcess = grepProcess
+        self.seq = seq # batches are numbered in the order their files were found
+        self.results = [] # results received while an earlier batch is still running
+        self.finished = False
+        self.cmdRunner = None
+
+    def handleLines (self, lines):
+        self.grepProcess.handleBatchLines(self, lines)
+
+    def handleFinished (self):
+        self.grepProcess.handleBatchFinished(self)
+
+
 class GrepProcess:
-    def __init__ (self, query, resultCb, finishedCb):
+    """
+    Runs grep on all files passed to addFilenames(). Several grep processes
+    may run at the same time (each one on a separate batch of files); their
+    results are still passed to resultCb in the order of the input files.
+    resultCb is called with lists of (filename, lineno, linetext) tuples.
+    Results which are known already (eg. cached results of unchanged files)
+    can be passed to addResults(), and are passed on in the same order.
+    With a processLimiter, only grep processes permitted by it are started.
+    """
+    def __init__ (self, query, resultCb, finishedCb, stats, processLimiter=None):
         self.query = query
         self.resultCb = resultCb
         self.finishedCb = finishedCb
+        self.stats = stats
+        if processLimiter is None:
+            processLimiter = ProcessLimiter()
+        self.processLimiter = processLimiter
 
         # Assume all file contents are in UTF-8 encoding (AFAIK grep will just search for byte sequences, it doesn't care about encodings):
         self.queryText = query.text.encode("utf-8")
 
-        self.fileNames = []
-        self.cmdRunner = None
+        self.fileNames = [] # file names, and lists of results from addResults()
         self.cancelled = False
         self.numGreps = 0
         self.inputFinished = False
+        self.finished = False
+
+        self.maxRunners = query.grepProcesses
+        if self.maxRunners <= 0:
+            self.maxRunners = os.cpu_count() or 1
+        self.batches = {} # running or not-yet-reported batches, by sequence number
+        self.numBatches = 0
+        self.numRunning = 0
+        self.nextSeq = 0 # sequence number of the batch whose results are passed on next
 
         self.postSearchPattern = None
         if query.wholeWord:
@@ -161,41 +503,91 @@ class GrepProcess:
 
     def cancel (self):
         self.cancelled = True
-        if self.cmdRunner:
-            self.cmdRunner.cancel()
-            self.cmdRunner = None
+        self.processLimiter.cancelWait(self.runGrep)
+        for batch in self.batches.values():
+            if batch.cmdRunner:
+                batch.cmdRunner.cancel()
+                batch.cmdRunner = None
+        if not(self.batches):
+            # (eg. while waiting for the process limiter)
+            GLib.idle_add(self._checkFinished)
 
     def addFilenames (self, filenames):
         self.fileNames += filenames
         self.runGrep()
 
+    def addResults (self, results):
+        "passes on the given results after the results of all files added before"
+        self.fileNames.append(results)
+        self.runGrep()
+
     def handleInputFinished (self):
         "Called when there will be no more input files added"
         self.inputFinished = True
-        if not(self.cmdRunner):
-            # this can happen if no files at all are found
-            self.finishedCb()
+        self.runGrep()
+        self._checkFinished() # (if no files at all are found)
 
     def runGrep (self):
-        if self.cmdRunner or not(self.fileNames) or self.cancelled:
-            return
+        "Starts grep processes for the pending files, as long as there are free runners"
+        while self.fileNames and not(self.cancelled):
+            if isinstance(self.fileNames[0], list):
+                self._addResultsBatch(self.fileNames.pop(0))
+                continue
+            if self.numRunning >= self.maxRunners:
+                break
+            # The first runner starts right away (to get first results quickly).
+            # Additional runners only start for full batches, to avoid running
+            # lots of greps on few files each while find is still running:
+            if self.numRunning > 0 and not(self.inputFinished) and not(self._haveFullBatch()):
+                break
+            if not(self.processLimiter.tryAcquire(self.query.maxProcessesPerWindow)):
+                self.processLimiter.wait(self.runGrep)
+                break
+            self._startBatch()
+
+    def _checkFinished (self):
+        if self.inputFinished and not(self.batches) and (self.cancelled or not(self.fileNames)):
+            if not(self.finished):
+                #print "ran %d greps" % self.numGreps
+                self.finished = True
+                self.processLimiter.cancelWait(self.runGrep)
+                self.finishedCb()
+        return False
 
+    def _haveFullBatch (self):
+        numChars = 0
+        for i, f in enumerate(self.fileNames):
+            if isinstance(f, list):
+                return True # (a batch ends before the next results anyway)
+            numChars += len(f)
+            if i >= MAX_GREP_FILES or numChars > MAX_GREP_LINE:
+                return True
+        return False
+
+    def _startBatch (self):
         # run Grep on many files at once:
-        maxGrepFiles = 5000
-        maxGrepLine = 3800
         fileNameList = []
 
         i = 0
         numChars = 0
         for f in self.fileNames:
+            if isinstance(f, list):
+                break
             fileNameList += [f]
             i+=1
             numChars += len(f)
-            if i > maxGrepFiles or numChars > maxGrepLine:
+            if i > MAX_GREP_FILES or numChars > MAX_GREP_LINE:
                 break
         self.fileNames = self.fileNames[i:]
 
+        batch = GrepBatch(self, self.numBatches)
+        self.numBatches += 1
+        self.batches[batch.seq] = batch
+        self.numRunning += 1
+
         self.numGreps += 1
+        self.stats.grepProcesses += 1
+        self.stats.filesSearched += len(fileNameList)
         #if self.numGreps % 100 == 0:
             #print "ran %d greps so far" % self.numGreps
 
@@ -208,19 +600,21 @@ class GrepProcess:
         grepCmd += ["-e", self.queryText]
         grepCmd += fileNameList
 
-        self.cmdRunner = RunCommand(grepCmd, self)
+        batch.cmdRunner = RunCommand(grepCmd, batch, stats=self.stats,
+            nice=self.query.processNice, ioPriority=self.query.ioPriority)
 
-    def handleLine (self, line):
-        filename = None
-        lineno = None
-        linetext = b""
-        if b"\0" in line:
-            (filename, end) = line.split(b"\0", 1)
-            if b":" in end:
-                (lineno, linetext) = end.split(b":", 1)
-                lineno = int(lineno)
+    def handleBatchLines (self, batch, lines):
+        results = []
+        postSearchPattern = self.postSearchPattern
+        for line in lines:
+            (filename, sep, end) = line.partition(b"\0")
+            if not(sep):
+                continue # ignore invalid lines
+            (lineno, sep, linetext) = end.partition(b":")
+            if not(sep):
+                continue
+            lineno = int(lineno)
 
-        if lineno is not None: # ignore invalid lines
             # Assume that grep output is in UTF8 encoding, and convert it to
             # a Unicode string. Also, sanitize non-UTF8 characters.
             # TODO: what's the actual encoding of grep's output?
@@ -229,91 +623,469 @@ class GrepProcess:
             linetext = linetext.rstrip("\n\r")
 
             # do some manual grep'ing on each line (for whole-word search):
-            if self.postSearchPattern is not None and \
-                self.postSearchPattern.search(linetext) is None:
-                return
+            if postSearchPattern is not None and \
+                postSearchPattern.search(linetext) is None:
+                continue
 
-            self.resultCb(filename, lineno, linetext)
+            results.append( (filename, lineno, linetext) )
 
-    def handleFinished (self):
+        if batch.seq == self.nextSeq:
+            if results:
+                self.resultCb(results)
+        else:
+            # an earlier batch is still running; keep results until it's finished
+            batch.results += results
+
+    def handleBatchFinished (self, batch):
         #print "grep finished"
-        self.cmdRunner = None
-        if len(self.fileNames) > 0 and not(self.cancelled):
+        batch.cmdRunner = None
+        batch.finished = True
+        self.numRunning -= 1
+        self.processLimiter.release()
+
+        self._passOnResults()
+        if self.fileNames and not(self.cancelled):
             self.runGrep()
-        else:
-            if self.inputFinished:
-                #print "ran %d greps" % self.numGreps
+        self._checkFinished()
+
+    def _addResultsBatch (self, results):
+        "adds a batch which is finished already, with the given results"
+        batch = GrepBatch(self, self.numBatches)
+        self.numBatches += 1
+        self.batches[batch.seq] = batch
+        batch.results = results
+        batch.finished = True
+        self._passOnResults()
+
+    def _passOnResults (self):
+        "passes on the kept results of all batches up to the first running one, in order"
+        while self.nextSeq in self.batches:
+            batch = self.batches[self.nextSeq]
+            if batch.results and not(self.cancelled):
+                self.resultCb(batch.results)
+            batch.results = []
+            if not(batch.finished):
+                break # (its next results are passed on right away)
+            del self.batches[self.nextSeq]
+            self.nextSeq += 1
+
+
+# number of files being searched (or waiting to be searched) at the same time by PythonGrepProcess, per thread:
+PYTHON_GREP_QUEUE_PER_THREAD = 16
+# files are treated as binary (and are skipped, like with grep -I) if this many bytes at the start contain a null byte:
+BINARY_CHECK_SIZE = 32 * 1024
+
+
+def buildSearchFilePattern (query):
+    "returns the pattern for searching files for the given query with searchFile()"
+    if not(query.caseSensitive) and not(query.text.isascii()):
+        # In byte patterns, IGNORECASE only handles ASCII letters (so "ä"
+        # wouldn't match "Ä"); so the files are searched as decoded text:
+        return buildQueryRE(query.text, query.caseSensitive, query.wholeWord, query.isRegExp, multiLine=True)
+    return buildQueryBytesRE(query.text, query.caseSensitive, query.wholeWord, query.isRegExp)
+
+def searchFile (filename, pattern):
+    """
+    returns a list of (lineno, linetext) tuples for all lines in the file that match the given pattern;
+    for a str pattern, the file contents are decoded (as UTF-8) before searching
+    """
+    results = []
+    try:
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return results
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return results # like grep -s: ignore unreadable files
+
+    try:
+        if data.find(b"\0", 0, BINARY_CHECK_SIZE) >= 0:
+            return results
+
+        text = data
+        newline = b"\n"
+        if isinstance(pattern.pattern, str):
+            text = data[:].decode("utf-8", "replace")
+            newline = "\n"
+
+        size = len(text)
+        pos = 0
+        lineno = 1
+        countPos = 0 # line numbers have been counted up to this position
+        while pos <= size:
+            m = pattern.search(text, pos)
+            if m is None:
+                break
+            lineStart = text.rfind(newline, 0, m.start()) + 1
+            lineEnd = text.find(newline, m.start())
+            if lineEnd < 0:
+                lineEnd = size
+            lineno += text[countPos:lineStart].count(newline)
+            countPos = lineStart
+            line = text[lineStart:lineEnd]
+            if text is not data:
+                line = line.encode("utf-8")
+            results.append( (lineno, line) )
+            pos = lineEnd + 1 # report each line only once (like grep)
+    finally:
+        data.close()
+    return results
+
+
+class PythonGrepProcess:
+    """
+    Searches all files passed to addFilenames() with a Python regular expression,
+    using a pool of worker threads (which mmap each file). This avoids starting
+    grep processes, and parsing their output.
+    Has the same interface as GrepProcess (including addResults()).
+    """
+    def __init__ (self, query, resultCb, finishedCb, stats):
+        self.query = query
+        self.resultCb = resultCb
+        self.finishedCb = finishedCb
+        self.stats = stats
+
+        self.fileNames = collections.deque() # file names, and lists of results from addResults()
+        self.cancelled = False
+        self.inputFinished = False
+        self.finished = False
+        self.pattern = None
+        try:
+            self.pattern = buildSearchFilePattern(query)
+        except re.error as e:
+            print("invalid regular expression '%s': %s" % (query.text, e))
+            self.cancelled = True
+
+        numThreads = query.grepProcesses
+        if numThreads <= 0:
+            numThreads = os.cpu_count() or 1
+        self.maxQueued = numThreads * PYTHON_GREP_QUEUE_PER_THREAD
+        self.executor = ThreadPoolExecutor(numThreads,
+            initializer=lowerThreadPriority, initargs=(query.processNice,))
+        self.pending = collections.deque() # (filename, future) in order of the input files (filename is None for addResults())
+
+        # worker threads notify the main thread about finished files, through an idle callback:
+        self.lock = threading.Lock()
+        self.collectScheduled = False
+
+    def cancel (self):
+        self.cancelled = True
+        self.fileNames.clear()
+        for (filename, future) in self.pending:
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+    def addFilenames (self, filenames):
+        self.fileNames.extend(filenames)
+        self._submitFiles()
+
+    def addResults (self, results):
+        "passes on the given results after the results of all files added before"
+        self.fileNames.append(results)
+        self._submitFiles()
+
+    def handleInputFinished (self):
+        "Called when there will be no more input files added"
+        self.inputFinished = True
+        self._checkFinished()
+
+    def _submitFiles (self):
+        while self.fileNames and not(self.cancelled) and len(self.pending) < self.maxQueued:
+            filename = self.fileNames.popleft()
+            if isinstance(filename, list):
+                future = Future()
+                future.set_result(filename)
+                self.pending.append( (None, future) )
+                self._onFileDone(future)
+                continue
+            future = self.executor.submit(self._searchFile, filename)
+            future.add_done_callback(self._onFileDone)
+            self.pending.append( (filename, future) )
+
+    def _searchFile (self, filename):
+        # runs in a worker thread
+        if self.cancelled:
+            return []
+        return searchFile(filename, self.pattern)
+
+    def _onFileDone (self, future):
+        # runs in a worker thread (or in the main thread, for cancelled futures)
+        with self.lock:
+            if self.collectScheduled:
+                return
+            self.collectScheduled = True
+        GLib.idle_add(self._collectResults, priority=GLib.PRIORITY_LOW)
+
+    def _collectResults (self):
+        "Passes the results of all finished files to resultCb, in order of the input files"
+        startTime = time.monotonic()
+        with self.lock:
+            self.collectScheduled = False
+
+        results = []
+        while self.pending and self.pending[0][1].done():
+            (filename, future) = self.pending.popleft()
+            if future.cancelled() or self.cancelled:
+                continue
+            if filename is None:
+                results += future.result()
+                continue
+            self.stats.filesSearched += 1
+            for (lineno, linetext) in future.result():
+                linetext = linetext.decode("utf8", "replace").rstrip("\r")
+                results.append( (filename, lineno, linetext) )
+        if results:
+            self.resultCb(results)
+
+        self._submitFiles()
+        self._checkFinished()
+        self.stats.addCallback(startTime)
+        return False
+
+    def _checkFinished (self):
+        if self.inputFinished and not(self.pending) and (self.cancelled or not(self.fileNames)):
+            if not(self.finished):
+                self.finished = True
+                self.executor.shutdown(wait=False)
                 self.finishedCb()
 
 
+# minimum time (in seconds) between passing found files from the directory walker thread to grep:
+WALK_PASS_INTERVAL = 0.02
+
+
 class SearchProcess:
-    def __init__ (self, query, resultHandler):
+    def __init__ (self, query, resultHandler, usePythonGrep=False, resultCache=None, processLimiter=None):
         self.resultHandler = resultHandler
+        self.nice = query.processNice
         self.cancelled = False
-        self.files = []
-
-        self.grepProcess = GrepProcess(query, self.handleGrepResult, self.handleGrepFinished)
-
-        findCmd = ["find", query.directory]
-        if not(query.includeSubfolders):
-            findCmd += ["-maxdepth", "1"]
-        if query.excludeHidden:
-            findCmd += ["(", "!", "-path", "%s*/.*" % query.directory, ")"]
-            findCmd += ["(", "!", "-path", "%s.*" % query.directory, ")"]
-        if query.excludeBackup:
-            findCmd += ["(", "!", "-name", "*~", "!", "-name", ".#*.*", ")"]
-        if query.excludeVCS:
-            findCmd += ["(", "!", "-path", "*/CVS/*", "!", "-path", "*/.svn/*", "!", "-path", "*/.git/*", "!", "-path", "*/RCS/*", "!", "-path", "*/.bzr/*", ")"]
-        if query.selectFileTypes:
-            fileTypeList = query.parseFileTypeString()
-            if fileTypeList:
-                findCmd += ["("]
-                for t in fileTypeList:
-                    findCmd += ["-name", t, "-o"]
-                findCmd.pop()
-                findCmd += [")"]
-        findCmd += ["-xtype", "f", "-print"]
-
-        self.cmdRunner = RunCommand(findCmd, self, GObject.PRIORITY_DEFAULT_IDLE)
+        self.parts = [] # (cached results, files to grep) tuples, until the walk is finished (without streaming)
+        self.stats = SearchStats("python" if usePythonGrep else "grep")
+
+        # When streaming, files are passed to grep while the directory tree is still being walked:
+        self.streamFileList = query.streamFileList
+
+        # if an index is available, it is used to skip files which cannot match:
+        self.indexFilter = getIndexFilter(query, pythonSyntax=usePythonGrep)
+
+        if usePythonGrep:
+            self.grepProcess = PythonGrepProcess(query, self.handleGrepResults, self.handleGrepFinished, self.stats)
+        else:
+            self.grepProcess = GrepProcess(query, self.handleGrepResults, self.handleGrepFinished, self.stats,
+                processLimiter)
+
+        # The list of found files is cached, so the next search with the same
+        # directory and file options only has to re-read changed directories:
+        self.fileListKey = fileListKey(query)
+        self.fileListCacheSize = query.fileListCacheSize * 1024 * 1024
+        cachedDirs = None
+        if self.fileListCacheSize > 0:
+            fileList = getFileListCache().get(self.fileListKey)
+            if fileList is not None:
+                cachedDirs = fileList.dirs
+
+        # With a result cache, the results are stored together with the mtime
+        # and size of all searched files; so when the same search is repeated,
+        # only the changed files have to be searched again:
+        self.resultCache = None
+        self.cachedResults = None
+        self.newResults = None
+        if resultCache is not None and query.resultCacheSize > 0 and query.files is None:
+            self.resultCache = resultCache
+            self.resultCacheKey = resultCacheKey(query)
+            self.resultCacheSize = query.resultCacheSize * 1024 * 1024
+            self.cachedResults = resultCache.get(self.resultCacheKey)
+            self.newResults = SearchResults(self.resultCacheSize)
+
+        if query.files is not None:
+            # only search the given files (eg. when refining the results of another search):
+            self.walker = None
+            self.stats.filesFound = len(query.files)
+            t = threading.Thread(target=self._checkGivenFiles, args=(list(query.files),), name="file-checker")
+            t.daemon = True
+            t.start()
+            return
+
+        self.root = normalizeDir(query.directory.encode("utf-8"))
+        self.walker = DirectoryWalker(self.root, FileFilter(query), cachedDirs, query.walkThreads,
+            lambda: lowerThreadPriority(self.nice))
+        t = threading.Thread(target=self._walk, name="directory-walker")
+        t.daemon = True
+        t.start()
 
     def cancel (self):
         self.cancelled = True
-        if self.cmdRunner:
-            self.cmdRunner.cancel()
-            self.cmdRunner = None
+        if self.walker:
+            self.walker.cancel()
         if self.grepProcess:
             self.grepProcess.cancel()
 
     def destroy (self):
         self.cancel()
 
-    def handleLine (self, line):
-        #print "find result line: '%s' (type: %s)" % (line, type(line))
+    def _walk (self):
+        # runs in a separate thread
+        lowerThreadPriority(self.nice)
 
-        # Note: we don't assume anything about the encoding of output from `find`
-        # but just treat it as encoding-less byte sequence.
+        # Note: we don't assume anything about the encoding of file names
+        # but just treat them as encoding-less byte sequences.
+        dirs = {}
+        files = []
+        lastPassTime = 0
+        startTime = time.monotonic()
+        for (d, entry) in self.walker.walk():
+            dirs[d] = entry
+            files += entry[1]
+            self.stats.dirsRead += 1
+            self.stats.filesFound += len(entry[1])
+            if files and time.monotonic() - lastPassTime > WALK_PASS_INTERVAL:
+                GLib.idle_add(self._handleFiles, self._checkFiles(files), priority=GLib.PRIORITY_DEFAULT_IDLE)
+                files = []
+                lastPassTime = time.monotonic()
 
-        self.files.append(line)
+        self.stats.walkTime = time.monotonic() - startTime
+        fileList = None
+        if not(self.walker.cancelled):
+            fileList = FileList(self.root, dirs)
+        GLib.idle_add(self._handleWalkFinished, self._checkFiles(files), fileList, priority=GLib.PRIORITY_DEFAULT_IDLE)
 
-    def handleFinished (self):
-        #print "find finished (%d files found)" % len(self.files)
-        self.cmdRunner = None
+    def _checkGivenFiles (self, files):
+        # runs in a separate thread
+        lowerThreadPriority(self.nice)
+        GLib.idle_add(self._handleWalkFinished, self._checkFiles(files), None, priority=GLib.PRIORITY_DEFAULT_IDLE)
+
+    def _checkFiles (self, files):
+        """
+        returns a list of (cached results of unchanged files, files to grep) tuples,
+        in file order; runs in the walker thread, as the result cache and the index
+        may have to stat every file
+        """
+        if self.newResults is not None:
+            parts = self.newResults.checkFiles(files, self.cachedResults)
+        else:
+            parts = [([], files)]
+        indexFilter = self.indexFilter # (is reset in the main thread when the search is finished)
+        if indexFilter is not None:
+            parts = [(results, indexFilter.filter(files) if files else files) for (results, files) in parts]
+        return parts
 
+    def _handleFiles (self, parts):
+        #print "found files: %d" % len(files)
         if self.cancelled:
-            self.resultHandler.handleFinished()
-            self.files = []
-            return
+            return False
+        startTime = time.monotonic()
+        if self.streamFileList:
+            self._grepFiles(parts)
+        else:
+            self.parts += parts
+        self.stats.addCallback(startTime)
+        return False
+
+    def _handleWalkFinished (self, parts, fileList):
+        #print "directory walk finished"
+        self.walker = None
+        if fileList and self.fileListCacheSize > 0:
+            getFileListCache().put(self.fileListKey, fileList, self.fileListCacheSize)
 
-        self.files.sort(key=os.path.split) # sort files before directories, then alphabetically
+        if self.cancelled:
+            self.resultHandler.handleFinished()
+            self.parts = []
+            return False
 
-        self.grepProcess.addFilenames(self.files)
-        self.files = []
+        self._handleFiles(parts)
+        if not(self.streamFileList):
+            self._grepFiles(self.parts)
+            self.parts = []
         self.grepProcess.handleInputFinished()
+        return False
+
+    def _grepFiles (self, parts):
+        # cached results are passed through the grep process, so they stay in file order:
+        for (results, files) in parts:
+            if results:
+                self.grepProcess.addResults(results)
+            if files:
+                self.grepProcess.addFilenames(files)
 
-    def handleGrepResult (self, filename, lineno, linetext):
+    def handleGrepResults (self, results):
         if not(self.cancelled):
-            self.resultHandler.handleResult(filename, lineno, linetext)
+            if self.newResults is not None:
+                self.newResults.addMatches(results)
+            self.resultHandler.handleResults(results)
 
     def handleGrepFinished (self):
+        if self.indexFilter and not(self.cancelled):
+            self.indexFilter.finish()
+        self.indexFilter = None
+        if self.newResults is not None and not(self.cancelled):
+            if self.newResults.overflowed:
+                self.resultCache.remove(self.resultCacheKey) # (the old results are outdated now)
+            else:
+                self.resultCache.put(self.resultCacheKey, self.newResults, self.resultCacheSize)
+        self.cachedResults = None
+        self.newResults = None
         self.resultHandler.handleFinished()
         self.grepProcess = None
+
+
+# number of result lines searched in a single main loop callback:
+FILTER_CHUNK_SIZE = 5000
+
+
+class ResultFilterProcess:
+    """
+    Searches the lines of existing results (a sequence of (filename, lineno, linetext)
+    tuples, like a ResultStore) in memory, and passes the matching ones to the resultHandler. It
+    has the same interface as the other search backends.
+    A ResultSpillFile is kept open (with acquire()) until filtering is finished.
+    """
+    def __init__ (self, query, resultHandler, results):
+        self.resultHandler = resultHandler
+        self.results = []
+        self.pos = 0
+        self.cancelled = False
+        self.stats = SearchStats("filter")
+        try:
+            self.pattern = buildQueryRE(query.text, query.caseSensitive, query.wholeWord, query.isRegExp)
+        except re.error as e:
+            print("invalid regular expression '%s': %s" % (query.text, e))
+        else:
+            self.results = results
+            if hasattr(results, "acquire"):
+                # (the panel with these results might close its spill file in the meantime)
+                results.acquire()
+        self.sourceId = GLib.idle_add(self._filterChunk)
+
+    def cancel (self):
+        self.cancelled = True
+
+    def destroy (self):
+        self.cancel()
+        if self.sourceId is not None:
+            GLib.source_remove(self.sourceId)
+            self.sourceId = None
+        self._releaseResults()
+
+    def _releaseResults (self):
+        if hasattr(self.results, "close"):
+            self.results.close()
+        self.results = []
+
+    def _filterChunk (self):
+        if not(self.cancelled) and self.results:
+            startTime = time.monotonic()
+            search = self.pattern.search
+            chunk = self.results[self.pos:self.pos + FILTER_CHUNK_SIZE]
+            self.pos += FILTER_CHUNK_SIZE
+            matches = [r for r in chunk if search(r[2])]
+            self.stats.linesParsed += len(chunk)
+            if matches:
+                self.resultHandler.handleResults(matches)
+            self.stats.addCallback(startTime)
+            if self.pos < len(self.results):
+                return True
+
+        self.sourceId = None
+        self._releaseResults()
+        self.resultHandler.handleFinished()
+        return False
@@ -0,0 +1,230 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Classes for watching directory trees for changes:
+# - TreeWatcher (uses a Gio.FileMonitor (ie. inotify) for every directory below a root directory,
+#   and reports all changed paths to a listener)
+#
+
+
+import os
+import threading
+from gi.repository import GLib, Gio
+
+
+# number of directory monitors added per main loop iteration:
+ADD_WATCHES_CHUNK = 200
+
+
+def getMaxWatches ():
+    "returns the number of inotify watches that may be used for a single directory tree"
+    try:
+        with open("/proc/sys/fs/inotify/max_user_watches") as f:
+            limit = int(f.read())
+    except (IOError, OSError, ValueError):
+        limit = 8192 # default value of older kernels
+    # leave enough watches for other applications (and for Gedit itself):
+    return limit // 2
+
+def getWatchedInodes ():
+    """
+    Returns the set of (st_dev, st_ino) tuples of all files and directories
+    watched by the inotify instances of this process, or None if this can't
+    be determined (ie. on systems without /proc/self/fdinfo).
+    """
+    watched = set()
+    try:
+        fds = os.listdir("/proc/self/fd")
+    except OSError:
+        return None
+    for fd in fds:
+        try:
+            if os.readlink("/proc/self/fd/" + fd) != "anon_inode:inotify":
+                continue
+            with open("/proc/self/fdinfo/" + fd) as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            continue # fd was closed in the meantime
+        for line in lines:
+            # eg. "inotify wd:3 ino:1a2b sdev:800001 mask:..." (sdev is the kernel's device number)
+            if not(line.startswith("inotify ")):
+                continue
+            fields = dict(f.split(":", 1) for f in line.split()[1:] if ":" in f)
+            try:
+                ino = int(fields["ino"], 16)
+                sdev = int(fields["sdev"], 16)
+            except (KeyError, ValueError):
+                continue
+            watched.add( (os.makedev(sdev >> 20, sdev & 0xfffff), ino) )
+    return watched
+
+
+class TreeWatcher:
+    """
+    Watches a directory tree, and calls listener.handlePathsChanged(paths, dirs)
+    (in the main thread) with the changed file and directory paths.
+
+    Setting up the watches happens in the background; isActive() returns true
+    once all directories are watched, ie. once every change is reported (and
+    listener.handleWatchActive() is called then). If the tree contains too many
+    directories for the inotify watch limit (or if the kernel didn't add all
+    watches), watching is given up, overflowed is set and
+    listener.handleWatchOverflow() is called (in that case, the listener has
+    to check for changes on its own).
+    """
+    def __init__ (self, root, listener):
+        self.root = root
+        self.listener = listener
+        self.monitors = {} # directory path -> Gio.FileMonitor
+        self.maxWatches = getMaxWatches()
+        self.overflowed = False
+        self.stopped = False
+        self.numPendingWalks = 0 # number of directory trees which are not completely watched yet
+
+        self._watchTree(root)
+
+    def isActive (self):
+        return self.numPendingWalks == 0 and not(self.overflowed) and not(self.stopped)
+
+    def stop (self):
+        self.stopped = True
+        self._cancelMonitors()
+
+    def _cancelMonitors (self):
+        for m in self.monitors.values():
+            m.cancel()
+        self.monitors = {}
+
+    def _watchTree (self, path):
+        "Adds watches for the given directory and all its subdirectories"
+        self.numPendingWalks += 1
+        t = threading.Thread(target=self._walkTree, args=(path,), name="tree-watcher-walk")
+        t.daemon = True
+        t.start()
+
+    def _walkTree (self, path):
+        # runs in a separate thread
+        dirs = []
+        for (dirpath, dirnames, filenames) in os.walk(path):
+            dirs.append(dirpath)
+            if len(dirs) + len(self.monitors) > self.maxWatches or self.stopped:
+                break
+        GLib.idle_add(self._addWatches, dirs, list(dirs))
+
+    def _giveUp (self):
+        self._cancelMonitors()
+        self.overflowed = True
+        self.listener.handleWatchOverflow()
+
+    def _addWatches (self, dirs, walkedDirs):
+        if self.stopped or self.overflowed:
+            return False
+        if len(dirs) + len(self.monitors) > self.maxWatches:
+            print("too many directories below %s; not watching for changes" % self.root)
+            self._giveUp()
+            return False
+
+        for d in dirs[:ADD_WATCHES_CHUNK]:
+            if d in self.monitors:
+                continue
+            try:
+                m = Gio.File.new_for_path(d).monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+            except GLib.Error:
+                continue # directory was removed or is not readable
+            m.connect("changed", self._onChanged)
+            self.monitors[d] = m
+        del dirs[:ADD_WATCHES_CHUNK]
+
+        if dirs:
+            return True
+        # Gio doesn't report failed inotify watches (eg. when the watch limit
+        # is reached), so check that the kernel really watches all directories:
+        walkedDirs = [d for d in walkedDirs if d in self.monitors]
+        t = threading.Thread(target=self._checkWatches, args=(walkedDirs,), name="tree-watcher-check")
+        t.daemon = True
+        t.start()
+        return False
+
+    def _checkWatches (self, dirs):
+        # runs in a separate thread
+        watched = getWatchedInodes()
+        missing = None
+        if watched is not None:
+            for d in dirs:
+                try:
+                    st = os.stat(d)
+                except OSError:
+                    continue # directory was removed in the meantime
+                if (st.st_dev, st.st_ino) not in watched:
+                    missing = d
+                    break
+        GLib.idle_add(self._handleWatchesChecked, missing)
+
+    def _handleWatchesChecked (self, missing):
+        if self.stopped or self.overflowed:
+            return False
+        if missing is not None:
+            print("could not watch %s (inotify watch limit reached?); not watching for changes" % missing)
+            self._giveUp()
+            return False
+        self.numPendingWalks -= 1
+        if self.isActive():
+            self.listener.handleWatchActive()
+        return False
+
+    def _removeWatches (self, path):
+        "Removes watches for the given directory and all its subdirectories"
+        prefix = path.rstrip(b"/") + b"/"
+        for d in list(self.monitors.keys()):
+            if d == path or d.startswith(prefix):
+                self.monitors.pop(d).cancel()
+
+    def _onChanged (self, monitor, gfile, otherFile, eventType):
+        paths = []
+        dirs = []
+        E = Gio.FileMonitorEvent
+
+        path = os.fsencode(gfile.get_path())
+        if eventType in (E.DELETED, E.MOVED_OUT, E.RENAMED):
+            # the path is gone now; if it was a directory, its whole subtree is gone
+            if path in self.monitors:
+                self._removeWatches(path)
+                dirs.append(path)
+            else:
+                paths.append(path)
+        elif eventType in (E.CHANGED, E.CHANGES_DONE_HINT, E.ATTRIBUTE_CHANGED):
+            paths.append(path)
+        elif eventType in (E.CREATED, E.MOVED_IN):
+            if os.path.isdir(path):
+                self._watchTree(path)
+                dirs.append(path)
+            else:
+                paths.append(path)
+
+        if eventType == E.RENAMED and otherFile is not None:
+            # the new name of the renamed file:
+            newPath = os.fsencode(otherFile.get_path())
+            if os.path.isdir(newPath):
+                self._watchTree(newPath)
+                dirs.append(newPath)
+            else:
+                paths.append(newPath)
+
+        if paths or dirs:
+            self.listener.handlePathsChanged(paths, dirs)
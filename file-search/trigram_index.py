@@ -0,0 +1,551 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Classes for the (optional) on-disk trigram index:
+# - TrigramIndex (knows which files under a search root contain which trigrams; is stored in ~/.cache)
+# - IndexFilter (uses a TrigramIndex to remove files that cannot match from the list of files to grep)
+#
+# The index only ever narrows down the list of files passed to grep; files which
+# are not in the index yet, or which were modified since they were indexed, are
+# always grepped (and are added to the index after the search).
+#
+# Modified files are detected by comparing mtime and size of each file. If the
+# root directory is watched for changes (with a TreeWatcher), the index keeps
+# a list of changed paths instead, so searches don't need to stat every file.
+#
+
+
+import os
+import array
+import pickle
+import hashlib
+import threading
+from gi.repository import GLib
+
+from .tree_watcher import TreeWatcher
+
+
+INDEX_VERSION = 2
+
+# bigger files are not indexed (and are therefore always grepped):
+MAX_INDEXED_FILE_SIZE = 8 * 1024 * 1024
+
+# delay (in seconds) before updating the index after files were changed:
+UPDATE_DELAY = 2
+
+# number of trigrams stored together in the index file:
+SAVE_CHUNK_SIZE = 4096
+
+# characters with special meaning in (basic) regular expressions, as used by grep:
+RE_SPECIAL_CHARS = b".[]*^$\\"
+# characters with special meaning in Python regular expressions (as used by the python backend):
+PYTHON_RE_SPECIAL_CHARS = b".[]*^$\\+?{}|()"
+
+
+def getIndexDirectory ():
+    return os.path.join(GLib.get_user_cache_dir(), "gedit-file-search")
+
+
+def textTrigrams (text):
+    "returns the set of (lower-cased) trigrams in the given byte string"
+    text = text.lower()
+    return set(text[i:i+3] for i in range(len(text) - 2))
+
+
+def requiredLiterals (query, pythonSyntax=False):
+    """
+    Returns a list of byte strings of which every matching line must contain
+    all, or None if the query cannot be handled by the index. Regular
+    expressions are parsed as basic regular expressions (like grep does), or
+    with Python syntax if pythonSyntax is set.
+    """
+    text = query.text.encode("utf-8")
+    if not(query.caseSensitive) and any(c >= 0x80 for c in bytearray(text)):
+        # bytes.lower() doesn't handle non-ASCII characters
+        return None
+
+    if not(query.isRegExp):
+        return [text] if len(text) >= 3 else []
+
+    if b"\\" in text:
+        # backslash sequences (like alternatives or word boundaries) are too complex
+        return None
+    if pythonSyntax and b"(?" in text:
+        # extensions (like lookarounds, or flags for verbose patterns) are too complex
+        return None
+
+    # split regular expression into its literal parts:
+    literals = []
+    current = b""
+    depth = 0 # (Python syntax) number of open groups; literals in groups may be optional
+    i = 0
+    while i < len(text):
+        c = text[i:i+1]
+        if c == b"[":
+            # skip bracket expression (a ']' directly after '[' or '[^' is part of the expression)
+            end = i + 1
+            if text[end:end+1] == b"^":
+                end += 1
+            if text[end:end+1] == b"]":
+                end += 1
+            end = text.find(b"]", end)
+            if end < 0:
+                return None
+            literals.append(current)
+            current = b""
+            i = end + 1
+        elif c == b"*" or (pythonSyntax and c in b"?{"):
+            # preceding character is optional
+            literals.append(current[:-1])
+            current = b""
+            if c == b"{":
+                i = text.find(b"}", i)
+                if i < 0:
+                    return None
+            i += 1
+        elif pythonSyntax and c == b"|":
+            # any of the alternatives might match
+            return None
+        elif pythonSyntax and c in b"()":
+            depth += 1 if c == b"(" else -1
+            literals.append(current)
+            current = b""
+            i += 1
+        elif c in (PYTHON_RE_SPECIAL_CHARS if pythonSyntax else RE_SPECIAL_CHARS):
+            literals.append(current)
+            current = b""
+            i += 1
+        else:
+            if depth == 0:
+                current += c
+            i += 1
+    literals.append(current)
+    return [l for l in literals if len(l) >= 3]
+
+
+class TrigramIndex:
+    """
+    Trigram index for all files below a single root directory. For every file,
+    the index stores mtime and size at the time the file was indexed, and for
+    every trigram the IDs of all files which contain that trigram.
+
+    All public methods can be called from any thread.
+    """
+    def __init__ (self, root):
+        self.root = root
+        self.path = os.path.join(getIndexDirectory(),
+            hashlib.sha1(root).hexdigest() + ".trigrams")
+        self.lock = threading.Lock()
+        self.ready = False # false until index was loaded from disk
+        self.updating = False
+
+        self.files = [] # file ID -> file name (None for removed files)
+        self.fileStats = [] # file ID -> (mtime, size, isIndexed) (None for removed files)
+        self.fileIds = {} # file name -> file ID
+        self.postings = {} # trigram -> array of file IDs (in ascending order)
+        self.numRemoved = 0
+        self.generation = 0 # is incremented whenever file IDs are reassigned
+
+        # Change tracking (see startWatching()):
+        self.watcher = None
+        self.trusted = False # true if all changes since indexing are in dirtyPaths
+        self.needsVerify = False # true if all files must be compared with the index
+        self.dirtyPaths = {} # changed path -> (change number, is directory)
+        self.numChanges = 0
+        self.updateSourceId = None
+
+        t = threading.Thread(target=self._load, name="trigram-index-load")
+        t.daemon = True
+        t.start()
+
+    # The index file contains a pickled header, followed by pickled lists of
+    # (trigram, file IDs) tuples and a final None. Pickling the postings in
+    # small chunks lets other threads run in between (most importantly the
+    # main loop).
+
+    def _load (self):
+        try:
+            with open(self.path, "rb") as f:
+                header = pickle.load(f)
+                if header["version"] == INDEX_VERSION and header["root"] == self.root:
+                    postings = {}
+                    while True:
+                        chunk = pickle.load(f)
+                        if chunk is None:
+                            break
+                        for (t, data) in chunk:
+                            l = array.array("I")
+                            l.frombytes(data)
+                            postings[t] = l
+                    with self.lock:
+                        self.files = header["files"]
+                        self.fileStats = header["fileStats"]
+                        self.postings = postings
+                        self.fileIds = dict((name, i) for (i, name) in enumerate(self.files) if name is not None)
+                        self.numRemoved = len(self.files) - len(self.fileIds)
+        except (IOError, OSError, EOFError, KeyError, pickle.UnpicklingError) as e:
+            if not(isinstance(e, (IOError, OSError)) and not(os.path.exists(self.path))):
+                print("could not load search index %s: %s" % (self.path, e))
+        self.ready = True
+
+    def _save (self):
+        # Note: this is only called from the update thread, which is the only
+        # thread modifying the index; so no locking is needed here.
+        header = {
+            "version": INDEX_VERSION,
+            "root": self.root,
+            "files": self.files,
+            "fileStats": self.fileStats,
+        }
+        try:
+            os.makedirs(getIndexDirectory(), exist_ok=True)
+            tmpPath = self.path + ".tmp"
+            with open(tmpPath, "wb") as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                items = list(self.postings.items())
+                for i in range(0, len(items), SAVE_CHUNK_SIZE):
+                    chunk = [(t, l.tobytes()) for (t, l) in items[i:i+SAVE_CHUNK_SIZE]]
+                    pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(None, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpPath, self.path)
+        except (IOError, OSError) as e:
+            print("could not save search index %s: %s" % (self.path, e))
+
+    def candidates (self, literals):
+        """
+        Returns a tuple (IDs, numIds, generation): the set of IDs of indexed files
+        which contain all trigrams of the given literals, and the number of file
+        IDs and the generation number at that time.
+        """
+        trigrams = set()
+        for l in literals:
+            trigrams |= textTrigrams(l)
+        with self.lock:
+            lists = sorted((self.postings.get(t, ()) for t in trigrams), key=len)
+            result = set(lists[0])
+            for l in lists[1:]:
+                if not(result):
+                    break
+                result.intersection_update(l)
+            return (result, len(self.files), self.generation)
+
+    def lookup (self, filenames):
+        """
+        Returns a tuple (entries, generation), with a (file ID, (mtime, size, isIndexed))
+        tuple for each of the given files, or (None, None) if a file is unknown.
+        """
+        entries = []
+        with self.lock:
+            for f in filenames:
+                fileId = self.fileIds.get(f)
+                if fileId is None:
+                    entries.append( (None, None) )
+                else:
+                    entries.append( (fileId, self.fileStats[fileId]) )
+            return (entries, self.generation)
+
+    def startWatching (self):
+        """
+        Starts watching the root directory for changes. Once all directories
+        are watched, all indexed files are checked once more; after that, the
+        index knows about all changes without checking each file.
+        Must be called from the main thread.
+        """
+        if self.watcher is None:
+            self.watcher = TreeWatcher(self.root, self)
+
+    def stopWatching (self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        self.trusted = False
+        if self.updateSourceId is not None:
+            GLib.source_remove(self.updateSourceId)
+            self.updateSourceId = None
+
+    def handleWatchActive (self):
+        if not(self.trusted):
+            self.needsVerify = True
+            if self.updating:
+                # verify once the running update has finished:
+                if self.updateSourceId is None:
+                    self.updateSourceId = GLib.timeout_add_seconds(UPDATE_DELAY, self._onUpdateTimeout)
+            else:
+                self.updateInBackground([])
+
+    def handleWatchOverflow (self):
+        self.trusted = False
+        self.needsVerify = False
+
+    def handlePathsChanged (self, paths, dirs):
+        with self.lock:
+            for p in paths:
+                self.numChanges += 1
+                self.dirtyPaths[p] = (self.numChanges, False)
+            for d in dirs:
+                self.numChanges += 1
+                self.dirtyPaths[d] = (self.numChanges, True)
+        # update the index soon (collecting changes that happen in the meantime):
+        if self.updateSourceId is None:
+            self.updateSourceId = GLib.timeout_add_seconds(UPDATE_DELAY, self._onUpdateTimeout)
+
+    def _onUpdateTimeout (self):
+        if self.updating:
+            return True # try again later
+        self.updateSourceId = None
+        self.updateInBackground([])
+        return False
+
+    def getDirtyPaths (self):
+        "returns a tuple (set of changed files, list of changed directories)"
+        with self.lock:
+            files = set()
+            dirs = []
+            for (p, (n, isDir)) in self.dirtyPaths.items():
+                if isDir:
+                    dirs.append(p.rstrip(b"/") + b"/")
+                else:
+                    files.add(p)
+            return (files, dirs)
+
+    def updateInBackground (self, filenames):
+        """
+        (Re-)indexes the given files and all changed files in a background
+        thread, and then saves the index. Must be called from the main thread.
+        """
+        if self.updating:
+            return
+        with self.lock:
+            dirtyPaths = dict(self.dirtyPaths)
+        if not(filenames) and not(dirtyPaths) and not(self.needsVerify):
+            return
+        self.updating = True
+        verify = self.needsVerify
+        self.needsVerify = False # (is set again if another verify is requested in the meantime)
+        t = threading.Thread(target=self._update, args=(filenames, dirtyPaths, verify),
+            name="trigram-index-update")
+        t.daemon = True
+        t.start()
+
+    def _update (self, filenames, dirtyPaths, verify):
+        try:
+            filenames = set(filenames)
+            if verify:
+                # compare all files with the index:
+                for (fileId, name) in enumerate(list(self.files)):
+                    if name is None:
+                        continue
+                    try:
+                        st = os.stat(name)
+                        if (st.st_mtime_ns, st.st_size) == self.fileStats[fileId][:2]:
+                            continue
+                    except OSError:
+                        pass
+                    filenames.add(name)
+
+            if dirtyPaths:
+                # re-index all known files which were changed (or which are in changed directories):
+                dirs = [p.rstrip(b"/") + b"/" for (p, (n, isDir)) in dirtyPaths.items() if isDir]
+                for (p, (n, isDir)) in dirtyPaths.items():
+                    if not(isDir) and p in self.fileIds:
+                        filenames.add(p)
+                if dirs:
+                    for name in list(self.fileIds.keys()):
+                        if any(name.startswith(d) for d in dirs):
+                            filenames.add(name)
+
+            for f in sorted(filenames):
+                self._indexFile(f)
+            self._compact()
+            self._save()
+
+            with self.lock:
+                # forget changes which were handled now (unless they changed again in the meantime):
+                for (p, entry) in dirtyPaths.items():
+                    if self.dirtyPaths.get(p) == entry:
+                        del self.dirtyPaths[p]
+            if verify and not(self.needsVerify):
+                self.trusted = self.watcher is not None and self.watcher.isActive()
+        finally:
+            self.updating = False
+
+    def _indexFile (self, filename):
+        trigrams = ()
+        stat = None
+        try:
+            st = os.stat(filename)
+        except OSError:
+            pass # file was deleted; remove it from index
+        else:
+            # files which are too big or can't be read are kept in the index,
+            # but are marked as not indexed (so they are always grepped)
+            stat = (st.st_mtime_ns, st.st_size, False)
+            if st.st_size <= MAX_INDEXED_FILE_SIZE:
+                try:
+                    with open(filename, "rb") as f:
+                        trigrams = textTrigrams(f.read())
+                    stat = (st.st_mtime_ns, st.st_size, True)
+                except (IOError, OSError):
+                    pass
+
+        with self.lock:
+            oldId = self.fileIds.pop(filename, None)
+            if oldId is not None:
+                # postings still refer to the old ID; they are cleaned up by _compact()
+                self.files[oldId] = None
+                self.fileStats[oldId] = None
+                self.numRemoved += 1
+            if stat is None:
+                return
+
+            fileId = len(self.files)
+            self.files.append(filename)
+            self.fileStats.append(stat)
+            self.fileIds[filename] = fileId
+            for t in trigrams:
+                l = self.postings.get(t)
+                if l is None:
+                    l = self.postings[t] = array.array("I")
+                l.append(fileId)
+
+    def _compact (self):
+        "removes IDs of removed files from postings, if there are many of them"
+        with self.lock:
+            if self.numRemoved < 1000 or self.numRemoved * 4 < len(self.files):
+                return
+            newIds = {}
+            files = []
+            fileStats = []
+            for (oldId, name) in enumerate(self.files):
+                if name is not None:
+                    newIds[oldId] = len(files)
+                    files.append(name)
+                    fileStats.append(self.fileStats[oldId])
+            postings = {}
+            for (t, l) in self.postings.items():
+                newList = array.array("I", (newIds[i] for i in l if i in newIds))
+                if newList:
+                    postings[t] = newList
+            self.files = files
+            self.fileStats = fileStats
+            self.fileIds = dict((name, i) for (i, name) in enumerate(files))
+            self.postings = postings
+            self.numRemoved = 0
+            self.generation += 1
+
+
+class IndexFilter:
+    """
+    Filters the list of files for a single search, using a TrigramIndex.
+    Files that are not indexed or were modified since indexing are always
+    kept, and are remembered so they can be (re-)indexed after the search.
+    filter() is called in the directory walker thread (as it may have to stat
+    every file), finish() in the main thread once the walk is done.
+    """
+    def __init__ (self, index, literals):
+        self.index = index
+        self.literals = literals
+        (self.candidates, self.numIds, self.generation) = index.candidates(literals)
+        self.staleFiles = []
+
+    def filter (self, filenames):
+        result = []
+        (entries, generation) = self.index.lookup(filenames)
+        if generation != self.generation:
+            # file IDs were reassigned in the meantime
+            (self.candidates, self.numIds, self.generation) = self.index.candidates(self.literals)
+            (entries, generation) = self.index.lookup(filenames)
+        candidates = self.candidates
+
+        # if the index knows about all changes, files don't need to be checked one by one:
+        trusted = self.index.trusted
+        if trusted:
+            (dirtyFiles, dirtyDirs) = self.index.getDirtyPaths()
+
+        for (f, (fileId, stat)) in zip(filenames, entries):
+            if fileId is not None:
+                if trusted:
+                    isUnchanged = not(f in dirtyFiles or (dirtyDirs and any(f.startswith(d) for d in dirtyDirs)))
+                else:
+                    try:
+                        st = os.stat(f)
+                    except OSError:
+                        continue # file was removed in the meantime
+                    isUnchanged = ((st.st_mtime_ns, st.st_size) == stat[:2])
+
+                if fileId >= self.numIds:
+                    # file was indexed after the candidates were determined
+                    result.append(f)
+                    continue
+                if isUnchanged:
+                    if fileId in candidates or not(stat[2]):
+                        result.append(f)
+                    continue
+            # not indexed (yet), or modified since indexing:
+            self.staleFiles.append(f)
+            result.append(f)
+        return result
+
+    def finish (self):
+        "Called after the search has completed; updates the index"
+        self.index.updateInBackground(self.staleFiles)
+        self.staleFiles = []
+
+
+_indexes = {} # root directory -> TrigramIndex
+
+def findIndexRoot (query):
+    "returns the root of the configured index directory which contains the search directory, or None"
+    directory = os.path.normpath(query.directory).encode("utf-8")
+    for root in query.indexDirs:
+        root = os.path.normpath(os.path.expanduser(root)).encode("utf-8")
+        if directory == root or directory.startswith(root.rstrip(b"/") + b"/"):
+            return root
+    return None
+
+def getIndexFilter (query, pythonSyntax=False):
+    """
+    Returns an IndexFilter for the given search query, or None if the query
+    cannot use an index (because no index is configured for the search
+    directory, the index is not loaded yet, or the query is unsuitable).
+    pythonSyntax is set if regular expressions are searched with Python syntax.
+    """
+    index = None
+    root = findIndexRoot(query)
+    if root is not None:
+        if root not in _indexes:
+            _indexes[root] = TrigramIndex(root)
+        index = _indexes[root]
+    if index is None or not(index.ready):
+        return None
+    if query.watchIndexDirs:
+        index.startWatching()
+    else:
+        index.stopWatching()
+
+    literals = requiredLiterals(query, pythonSyntax)
+    if not(literals):
+        return None
+    return IndexFilter(index, literals)
+
+
+def closeIndexes ():
+    "Stops watching all indexed directories"
+    for index in _indexes.values():
+        index.stopWatching()
@@ -0,0 +1,105 @@
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Regression tests for the python search backend (run from the top directory
+# with `python3 -m unittest discover tests`; they need PyGObject, but not gedit).
+#
+
+
+import os
+import sys
+import types
+import tempfile
+import unittest
+import importlib
+
+try:
+    import gi
+except ImportError:
+    gi = None
+
+PACKAGE_NAME = "file_search"
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "file-search")
+
+
+def loadModule (name):
+    "imports a module of the plugin (without running its __init__.py, which needs gedit)"
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [os.path.abspath(PLUGIN_DIR)]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(PACKAGE_NAME + "." + name)
+
+
+class Query:
+    def __init__ (self, text, isRegExp=False, caseSensitive=True, wholeWord=False):
+        self.text = text
+        self.isRegExp = isRegExp
+        self.caseSensitive = caseSensitive
+        self.wholeWord = wholeWord
+
+
+@unittest.skipIf(gi is None, "PyGObject is not installed")
+class RequiredLiteralsTest(unittest.TestCase):
+    "The trigram index must never filter out files that the backend would find"
+
+    def literals (self, text, pythonSyntax):
+        trigramIndex = loadModule("trigram_index")
+        return trigramIndex.requiredLiterals(Query(text, isRegExp=True), pythonSyntax)
+
+    def testPythonAlternatives (self):
+        self.assertIsNone(self.literals("needle|zzzz", True))
+        self.assertIsNone(self.literals("(foo|bar)baz", True))
+
+    def testPythonQuantifiers (self):
+        self.assertEqual(self.literals("needlex?", True), [b"needle"])
+        self.assertEqual(self.literals("fooo?bar", True), [b"foo", b"bar"])
+        self.assertEqual(self.literals("(abc)+def", True), [b"def"])
+        self.assertEqual(self.literals("ab{0,2}cdef", True), [b"cdef"])
+
+    def testBasicRegExp (self):
+        # in grep's basic regular expressions, these characters are literal:
+        self.assertEqual(self.literals("needle|zzzz", False), [b"needle|zzzz"])
+        self.assertEqual(self.literals("(abc)+def", False), [b"(abc)+def"])
+        self.assertEqual(self.literals("needlex*", False), [b"needle"])
+
+
+@unittest.skipIf(gi is None, "PyGObject is not installed")
+class SearchFileTest(unittest.TestCase):
+    def search (self, text, data, caseSensitive=False):
+        searcher = loadModule("searcher")
+        with tempfile.NamedTemporaryFile(suffix=".txt") as f:
+            f.write(data)
+            f.flush()
+            pattern = searcher.buildSearchFilePattern(Query(text, caseSensitive=caseSensitive))
+            return searcher.searchFile(os.fsencode(f.name), pattern)
+
+    def testNonAsciiIgnoreCase (self):
+        data = "Birnen\nÄpfel und Birnen\näpfel\n".encode("utf-8")
+        self.assertEqual(self.search("äpfel", data),
+            [(2, "Äpfel und Birnen".encode("utf-8")), (3, "äpfel".encode("utf-8"))])
+        self.assertEqual(self.search("äpfel", data, caseSensitive=True),
+            [(3, "äpfel".encode("utf-8"))])
+
+    def testAsciiIgnoreCase (self):
+        self.assertEqual(self.search("needle", b"a\nNEEDLE\n"), [(2, b"NEEDLE")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+#
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Benchmarks the search backends outside of gedit, on a plain GLib main loop:
+# - makeBenchmarkQuery() (returns a SearchQuery with the default settings, without GSettings)
+# - CallbackCounter (counts the main loop callbacks of a search, and their duration)
+# - BenchmarkHandler (result handler which only records when results arrive)
+# - runSearch() (runs one search, and returns its measurements)
+#
+# Every search runs in a separate Python process, so peak memory usage and the
+# in-memory caches are measured for each search on its own. The measurements
+# (and the median of repeated runs) are written as JSON, so the results of
+# different plugin versions can be compared:
+#
+#   synthetic_tree.py /tmp/tree
+#   benchmark.py run --backend grep,python --repeat 5 -o old.json /tmp/tree needle
+#   benchmark.py run --plugin-dir ../other-checkout/file-search -o new.json /tmp/tree needle
+#   benchmark.py compare old.json new.json
+#
+
+
+import os
+import sys
+import json
+import time
+import types
+import platform
+import resource
+import argparse
+import importlib
+import threading
+import subprocess
+
+
+PACKAGE_NAME = "file_search"
+DEFAULT_PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "file-search")
+
+FORMAT_NAME = "gedit-file-search-benchmark"
+FORMAT_VERSION = 1
+
+# GLib functions which add main loop sources, and the kind of source they add:
+SOURCE_FUNCTIONS = {
+    "idle_add": "idle",
+    "timeout_add": "timeout",
+    "timeout_add_seconds": "timeout",
+    "io_add_watch": "io",
+    "child_watch_add": "child",
+}
+
+# measurements shown by the "compare" command:
+COMPARED_VALUES = ["timeToFirstResult", "wallTime", "resultsPerSecond", "peakRssKiB",
+    "cpuTime", "childCpuTime", "callbacks.total", "maxCallbackTime"]
+
+
+def loadPluginPackage (pluginDir):
+    """
+    Imports the modules of the plugin as package PACKAGE_NAME (without running
+    its __init__.py, which needs gedit), and returns the backends module.
+    """
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [os.path.abspath(pluginDir)]
+    sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(PACKAGE_NAME + ".backends")
+
+
+def makeBenchmarkQuery (text, directory, options=None):
+    """
+    Returns a SearchQuery with the default values of the GSettings schema (of
+    the loaded plugin); options is a dict with the attributes to change.
+    """
+    searchQuery = importlib.import_module(PACKAGE_NAME + ".search_query")
+    query = searchQuery.SearchQuery(searchQuery.SchemaDefaults())
+    query.text = text
+    query.directory = directory
+    query.watchIndexDirs = False # (an index is only used if index-dirs is given in options)
+    for (name, value) in (options or {}).items():
+        if not(hasattr(query, name)):
+            raise ValueError("unknown query option '%s'" % name)
+        setattr(query, name, value)
+    return query
+
+
+class CallbackCounter:
+    """
+    Replaces the GLib functions which add main loop sources (see
+    SOURCE_FUNCTIONS), to count the added sources and the calls of their
+    callbacks, and to measure how long the callbacks block the main loop.
+    """
+    def __init__ (self, GLib):
+        self.GLib = GLib
+        self.originals = {} # function name -> original GLib function
+        self.lock = threading.Lock() # (sources are also added from other threads)
+        self.reset()
+
+    def reset (self):
+        kinds = set(SOURCE_FUNCTIONS.values())
+        self.added = dict.fromkeys(kinds, 0)
+        self.calls = dict.fromkeys(kinds, 0)
+        self.callbackTime = 0.0
+        self.maxCallbackTime = 0.0
+
+    def install (self):
+        for (name, kind) in SOURCE_FUNCTIONS.items():
+            func = getattr(self.GLib, name, None)
+            if func is not None:
+                self.originals[name] = func
+                setattr(self.GLib, name, self._wrapAddFunction(kind, func))
+
+    def uninstall (self):
+        for (name, func) in self.originals.items():
+            setattr(self.GLib, name, func)
+        self.originals = {}
+
+    def getStats (self):
+        callbacks = {"total": sum(self.calls.values())}
+        for kind in self.calls:
+            callbacks[kind] = self.calls[kind]
+        return {
+            "sourcesAdded": dict(self.added),
+            "callbacks": callbacks,
+            "callbackTime": self.callbackTime,
+            "maxCallbackTime": self.maxCallbackTime,
+        }
+
+    def _wrapAddFunction (self, kind, addFunction):
+        def add (*args, **kwargs):
+            args = list(args)
+            for (i, arg) in enumerate(args):
+                if callable(arg):
+                    args[i] = self._wrapCallback(kind, arg)
+                    break
+            with self.lock:
+                self.added[kind] += 1
+            return addFunction(*args, **kwargs)
+        return add
+
+    def _wrapCallback (self, kind, callback):
+        def run (*args):
+            startTime = time.perf_counter()
+            try:
+                return callback(*args)
+            finally:
+                duration = time.perf_counter() - startTime
+                self.calls[kind] += 1
+                self.callbackTime += duration
+                self.maxCallbackTime = max(self.maxCallbackTime, duration)
+        return run
+
+
+class BenchmarkHandler:
+    "Result handler which counts the results, and stops the main loop when the search is finished"
+    def __init__ (self, loop, startTime):
+        self.loop = loop
+        self.startTime = startTime
+        self.firstResultTime = None
+        self.finishTime = None
+        self.numResults = 0
+        self.numBatches = 0
+        self.files = set()
+        self.timedOut = False
+        self.stats = None # SearchStats of the search process
+
+    def handleResults (self, results):
+        if self.firstResultTime is None:
+            self.firstResultTime = time.monotonic()
+        self.numResults += len(results)
+        self.numBatches += 1
+        self.stats.addResults(len(results))
+        for r in results:
+            self.files.add(r[0])
+
+    def handleFinished (self):
+        self.finishTime = time.monotonic()
+        self.stats.finish(self.timedOut)
+        self.loop.quit()
+
+    def handleTimeout (self):
+        self.timedOut = True
+        self.stats.finish(True)
+        self.loop.quit()
+        return False
+
+
+def _cpuTimes ():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime)
+
+def _searchOnce (GLib, backends, query, resultCache, timeout, addTimeout):
+    loop = GLib.MainLoop()
+    startTime = time.monotonic()
+    handler = BenchmarkHandler(loop, startTime)
+    timeoutId = addTimeout(int(timeout * 1000), handler.handleTimeout)
+    process = backends.createSearchProcess(query, handler, resultCache)
+    handler.stats = process.stats
+    loop.run()
+    if handler.timedOut:
+        process.cancel()
+    else:
+        GLib.source_remove(timeoutId)
+    process.destroy()
+    return (handler, process.stats)
+
+def runSearch (config):
+    """
+    Runs the search described by config (see makeConfig()) on a GLib main
+    loop, and returns a dict with its measurements.
+    """
+    backends = loadPluginPackage(config["pluginDir"])
+    from gi.repository import GLib
+    LRUCache = importlib.import_module(PACKAGE_NAME + ".plugin_common").LRUCache
+
+    query = makeBenchmarkQuery(config["text"], config["directory"], config["query"])
+    resultCache = LRUCache()
+    counter = CallbackCounter(GLib)
+    counter.install()
+    addTimeout = counter.originals.get("timeout_add", GLib.timeout_add) # (the timeout isn't counted)
+
+    if config["warm"]:
+        # fill the file list cache, the result cache and the page cache:
+        _searchOnce(GLib, backends, query, resultCache, config["timeout"], addTimeout)
+        counter.reset()
+
+    (cpuTime, childCpuTime) = _cpuTimes()
+    (handler, stats) = _searchOnce(GLib, backends, query, resultCache, config["timeout"], addTimeout)
+    endTime = handler.finishTime or time.monotonic()
+    (endCpuTime, endChildCpuTime) = _cpuTimes()
+    counter.uninstall()
+
+    wallTime = endTime - handler.startTime
+    timeToFirstResult = None
+    if handler.firstResultTime is not None:
+        timeToFirstResult = handler.firstResultTime - handler.startTime
+    measurements = {
+        "backend": backends.selectBackend(query),
+        "results": handler.numResults,
+        "resultFiles": len(handler.files),
+        "resultBatches": handler.numBatches,
+        "timedOut": handler.timedOut,
+        "timeToFirstResult": timeToFirstResult,
+        "wallTime": wallTime,
+        "resultsPerSecond": handler.numResults / wallTime if wallTime > 0 else None,
+        "cpuTime": endCpuTime - cpuTime,
+        "childCpuTime": endChildCpuTime - childCpuTime,
+        # (ru_maxrss is in KiB on Linux; it includes the interpreter, and the warm-up search)
+        "peakRssKiB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "childPeakRssKiB": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+    measurements.update(counter.getStats())
+    measurements["searchStats"] = stats.toDict() # (the backend's own counters)
+    return measurements
+
+
+def makeConfig (args, backend):
+    "returns the description of a single search, which is passed to runSearch() in a new process"
+    query = {
+        "caseSensitive": not(args.ignoreCase),
+        "wholeWord": args.wholeWord,
+        "isRegExp": args.regExp,
+        "includeSubfolders": not(args.noSubfolders),
+        "excludeHidden": not(args.includeHidden),
+        "excludeBackup": not(args.includeBackup),
+        "excludeVCS": not(args.includeVCS),
+        "excludeIgnored": args.excludeIgnored,
+        "selectFileTypes": bool(args.fileTypes),
+        "fileTypeString": args.fileTypes or '',
+        "streamFileList": not(args.noStream),
+        "searchBackend": backend,
+        "grepProcesses": args.grepProcesses,
+        "walkThreads": args.walkThreads,
+    }
+    return {
+        "pluginDir": os.path.abspath(args.pluginDir),
+        "directory": os.path.abspath(args.directory),
+        "text": args.text,
+        "query": query,
+        "warm": args.warm,
+        "timeout": args.timeout,
+    }
+
+def _runInNewProcess (config):
+    cmd = [sys.executable, os.path.abspath(__file__), "run-once", json.dumps(config)]
+    output = subprocess.check_output(cmd)
+    return json.loads(output.decode("utf-8"))
+
+def _getValue (measurements, name):
+    "returns a measurement by its name (with '.' separating the names of nested values)"
+    value = measurements
+    for part in name.split("."):
+        if not(isinstance(value, dict)):
+            return None
+        value = value.get(part)
+    return value
+
+def _median (values):
+    values = sorted(values)
+    n = len(values)
+    if n == 0:
+        return None
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+def summarizeRuns (runs):
+    "returns the median of each numeric measurement of the given runs"
+    summary = {}
+    for (name, value) in runs[0].items():
+        if isinstance(value, dict):
+            summary[name] = summarizeRuns([r[name] for r in runs])
+        elif isinstance(value, (int, float)) and not(isinstance(value, bool)):
+            summary[name] = _median([r[name] for r in runs if r.get(name) is not None])
+        elif all(r.get(name) == value for r in runs):
+            summary[name] = value # (same in all runs)
+    return summary
+
+def _getRevision (pluginDir):
+    try:
+        output = subprocess.check_output(["git", "describe", "--always", "--dirty"],
+            cwd=pluginDir, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode("utf-8").strip()
+
+def _getTreeSize (directory):
+    numFiles = 0
+    numBytes = 0
+    for (dirpath, dirnames, filenames) in os.walk(os.fsencode(directory)):
+        for f in filenames:
+            try:
+                numBytes += os.lstat(os.path.join(dirpath, f)).st_size
+            except OSError:
+                continue
+            numFiles += 1
+    return {"files": numFiles, "bytes": numBytes}
+
+def runBenchmark (args):
+    report = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": _getRevision(args.pluginDir),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "tree": _getTreeSize(args.directory),
+        "repeat": args.repeat,
+        "backends": {},
+    }
+    for backend in args.backend.split(","):
+        config = makeConfig(args, backend)
+        report["directory"] = config["directory"]
+        report["text"] = config["text"]
+        report["warm"] = config["warm"]
+        report["query"] = dict(config["query"], searchBackend=None)
+
+        runs = []
+        for i in range(args.repeat):
+            m = _runInNewProcess(config)
+            sys.stderr.write("%-8s run %d: %d results in %.3f s (first after %s s), %d callbacks\n" % (
+                backend, i + 1, m["results"], m["wallTime"],
+                "%.3f" % m["timeToFirstResult"] if m["timeToFirstResult"] is not None else "-",
+                m["callbacks"]["total"]))
+            runs.append(m)
+        report["backends"][backend] = {"runs": runs, "median": summarizeRuns(runs)}
+    return report
+
+
+def _formatValue (value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return "%.4g" % value
+    return str(value)
+
+def compareReports (old, new, out):
+    "writes a table with the median measurements of two reports to out"
+    for key in ["directory", "text", "query", "tree", "warm"]:
+        if old.get(key) != new.get(key):
+            out.write("warning: the reports have different '%s' settings\n" % key)
+    out.write("old: %s (%s)\nnew: %s (%s)\n" % (old.get("revision"), old.get("date"),
+        new.get("revision"), new.get("date")))
+
+    for backend in sorted(set(old["backends"]) & set(new["backends"])):
+        oldMedian = old["backends"][backend]["median"]
+        newMedian = new["backends"][backend]["median"]
+        out.write("\n%s:\n" % backend)
+        if oldMedian.get("results") != newMedian.get("results"):
+            out.write("  warning: different number of results (%s / %s)\n" % (
+                _formatValue(oldMedian.get("results")), _formatValue(newMedian.get("results"))))
+        for name in COMPARED_VALUES:
+            oldValue = _getValue(oldMedian, name)
+            newValue = _getValue(newMedian, name)
+            change = ""
+            if oldValue and newValue is not None:
+                change = "%+.1f%%" % ((newValue - oldValue) * 100.0 / oldValue)
+            out.write("  %-20s %12s %12s %10s\n" % (name, _formatValue(oldValue), _formatValue(newValue), change))
+
+
+def main ():
+    if len(sys.argv) == 3 and sys.argv[1] == "run-once":
+        # (internal command, for running a single search in a new process)
+        config = json.loads(sys.argv[2])
+        stdout = sys.stdout
+        sys.stdout = sys.stderr # (the plugin's messages must not end up in the JSON output)
+        measurements = runSearch(config)
+        json.dump(measurements, stdout)
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmarks the search backends of the file search plugin.")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    run = commands.add_parser("run", help="run searches, and write their measurements as JSON")
+    run.add_argument("directory", help="directory to search in (eg. a tree created by synthetic_tree.py)")
+    run.add_argument("text", help="text to search for")
+    run.add_argument("--backend", default="auto",
+        help="comma-separated list of backends to run: auto, grep, python, git-grep, ripgrep (default: %(default)s)")
+    run.add_argument("--repeat", type=int, default=3, help="number of runs per backend (default: %(default)s)")
+    run.add_argument("--warm", action="store_true",
+        help="measure a second search in the same process, with filled caches")
+    run.add_argument("--timeout", type=float, default=300, help="cancel searches after this many seconds")
+    run.add_argument("--plugin-dir", dest="pluginDir", default=DEFAULT_PLUGIN_DIR,
+        help="plugin directory with the search modules (default: the one next to this script)")
+    run.add_argument("-o", "--output", help="write the JSON report to this file (default: stdout)")
+    run.add_argument("-i", "--ignore-case", dest="ignoreCase", action="store_true")
+    run.add_argument("-w", "--whole-word", dest="wholeWord", action="store_true")
+    run.add_argument("-r", "--regexp", dest="regExp", action="store_true")
+    run.add_argument("--no-subfolders", dest="noSubfolders", action="store_true")
+    run.add_argument("--include-hidden", dest="includeHidden", action="store_true")
+    run.add_argument("--include-backup", dest="includeBackup", action="store_true")
+    run.add_argument("--include-vcs", dest="includeVCS", action="store_true")
+    run.add_argument("--exclude-ignored", dest="excludeIgnored", action="store_true")
+    run.add_argument("--file-types", dest="fileTypes", help="space-separated file name patterns")
+    run.add_argument("--no-stream", dest="noStream", action="store_true",
+        help="only start grep after the whole directory tree was read")
+    run.add_argument("--grep-processes", dest="grepProcesses", type=int, default=0)
+    run.add_argument("--walk-threads", dest="walkThreads", type=int, default=1)
+
+    compare = commands.add_parser("compare", help="compare the medians of two JSON reports")
+    compare.add_argument("old")
+    compare.add_argument("new")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        report = runBenchmark(args)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        else:
+            json.dump(report, sys.stdout, indent=2, sort_keys=True)
+            sys.stdout.write("\n")
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        compareReports(old, new, sys.stdout)
+
+if __name__ == "__main__":
+    main()
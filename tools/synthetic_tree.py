@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+#
+#    Gedit file search plugin
+#    Copyright (C) 2008-2011  Oliver Gerlich <oliver.gerlich@gmx.de>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# Generates a directory tree with random text files, for benchmarking searches:
+# - TreeOptions (the shape of the tree, and what the files contain)
+# - generateTree() (writes the tree, and returns statistics about it)
+#
+# The same options and seed always generate the same tree. Besides plain text
+# files, the tree contains binary files, and files with unusual names like
+# those in testfiles/ (also hidden files and backup files, which are excluded
+# by the default search options).
+#
+# Usage: synthetic_tree.py [options] DIRECTORY
+#
+
+
+import os
+import sys
+import json
+import random
+import argparse
+
+
+# name patterns for files with unusual names (see testfiles/):
+ODD_NAMES = [
+    b"file with spaces %d.txt",
+    b"another'test\"file%d",
+    b"testfile:with_evil_name_%d",
+    u"İ_capital_i_with_dot_%d.txt".encode("utf-8"),
+    b"latin1_\xe9_not_utf8_%d.txt",
+    b"-leading-dash-%d.txt",
+    b".hidden_%d.txt",
+    b"backup_%d.txt~",
+]
+
+TEXT_EXTENSIONS = [b".txt", b".py", b".c", b".h", b".md"]
+
+VOCABULARY_SIZE = 2000
+
+
+class TreeOptions:
+    "Shape and contents of a generated tree"
+    def __init__ (self):
+        self.numFiles = 2000
+        self.depth = 3 # number of directory levels below the root
+        self.dirsPerDir = 4
+        self.fileSize = 8192 # average file size (in bytes)
+        self.lineLength = 60 # average line length (in characters)
+        self.matchText = "needle"
+        self.matchDensity = 0.01 # fraction of lines which contain matchText
+        self.binaryFiles = 0.02 # fraction of files with null bytes
+        self.oddNames = 0.05 # fraction of files with unusual names
+        self.seed = 1
+
+    def toDict (self):
+        return dict(self.__dict__)
+
+
+def _makeVocabulary (rnd, matchText):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        word = "".join(rnd.choice(letters) for i in range(rnd.randint(2, 10)))
+        if matchText.lower() not in word:
+            words.add(word)
+    return sorted(words)
+
+def _makeDirs (options):
+    "returns the list of directories (relative paths as bytes, the root being b'')"
+    dirs = [b""]
+    level = [b""]
+    for depth in range(options.depth):
+        nextLevel = []
+        for parent in level:
+            for i in range(options.dirsPerDir):
+                nextLevel.append(os.path.join(parent, b"dir%d_%d" % (depth, i)))
+        dirs += nextLevel
+        level = nextLevel
+    return dirs
+
+def _makeLine (rnd, words, options, stats):
+    "returns a line (without newline), and whether it contains the match text"
+    targetLen = max(1, int(rnd.expovariate(1.0 / options.lineLength)))
+    parts = []
+    length = 0
+    while length < targetLen:
+        w = rnd.choice(words)
+        parts.append(w)
+        length += len(w) + 1
+    isMatch = rnd.random() < options.matchDensity
+    if isMatch:
+        matchText = options.matchText
+        if rnd.random() < 0.2:
+            matchText = matchText.upper() # only matches when searching case-insensitively
+        else:
+            stats["exactCaseMatchLines"] += 1
+        parts.insert(rnd.randint(0, len(parts)), matchText)
+    return (" ".join(parts), isMatch)
+
+def _makeContents (rnd, words, options, isBinary, stats):
+    "returns (file contents, number of lines with the match text)"
+    targetSize = max(0, int(rnd.uniform(0, 2 * options.fileSize)))
+    lines = []
+    if isBinary:
+        lines.append(b"\x7fELF\0\0\0")
+    size = 0
+    numMatches = 0
+    while size < targetSize:
+        (line, isMatch) = _makeLine(rnd, words, options, stats)
+        line = line.encode("utf-8")
+        if isBinary and rnd.random() < 0.1:
+            line += b"\0\x01\x02\xff"
+        lines.append(line + b"\n")
+        size += len(line) + 1
+        numMatches += isMatch
+    return (b"".join(lines), numMatches)
+
+def _makeFileName (rnd, n, options, stats):
+    if rnd.random() < options.oddNames:
+        pattern = rnd.choice(ODD_NAMES)
+        stats["oddNames"] += 1
+        return pattern % n
+    return b"file%d%s" % (n, rnd.choice(TEXT_EXTENSIONS))
+
+def generateTree (directory, options):
+    """
+    Writes a tree according to options into directory (which must not exist
+    yet, or be empty). Returns a dict with statistics about the tree.
+    """
+    if os.path.isdir(directory) and os.listdir(directory):
+        raise ValueError("directory '%s' is not empty" % directory)
+    root = os.fsencode(directory)
+    rnd = random.Random(options.seed)
+    words = _makeVocabulary(rnd, options.matchText)
+    dirs = _makeDirs(options)
+    for d in dirs:
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+
+    stats = {"files": 0, "dirs": len(dirs), "bytes": 0, "binaryFiles": 0, "oddNames": 0,
+        "matchLines": 0, "exactCaseMatchLines": 0,
+        "hiddenOrBackupMatchLines": 0, "binaryMatchLines": 0}
+    for n in range(options.numFiles):
+        name = _makeFileName(rnd, n, options, stats)
+        isBinary = rnd.random() < options.binaryFiles
+        (data, numMatches) = _makeContents(rnd, words, options, isBinary, stats)
+        path = os.path.join(root, rnd.choice(dirs), name)
+        with open(path, "wb") as f:
+            f.write(data)
+
+        stats["files"] += 1
+        stats["bytes"] += len(data)
+        stats["matchLines"] += numMatches
+        if isBinary:
+            stats["binaryFiles"] += 1
+            stats["binaryMatchLines"] += numMatches
+        elif name.startswith(b".") or name.endswith(b"~"):
+            stats["hiddenOrBackupMatchLines"] += numMatches
+    return stats
+
+
+def addTreeArguments (parser):
+    "adds command line options for TreeOptions to an ArgumentParser"
+    defaults = TreeOptions()
+    parser.add_argument("--files", dest="numFiles", type=int, default=defaults.numFiles,
+        help="number of files (default: %(default)s)")
+    parser.add_argument("--depth", type=int, default=defaults.depth,
+        help="number of directory levels (default: %(default)s)")
+    parser.add_argument("--dirs-per-dir", dest="dirsPerDir", type=int, default=defaults.dirsPerDir,
+        help="number of subdirectories in each directory (default: %(default)s)")
+    parser.add_argument("--file-size", dest="fileSize", type=int, default=defaults.fileSize,
+        help="average file size in bytes (default: %(default)s)")
+    parser.add_argument("--line-length", dest="lineLength", type=int, default=defaults.lineLength,
+        help="average line length (default: %(default)s)")
+    parser.add_argument("--match-text", dest="matchText", default=defaults.matchText,
+        help="text inserted into matching lines (default: %(default)s)")
+    parser.add_argument("--match-density", dest="matchDensity", type=float, default=defaults.matchDensity,
+        help="fraction of lines containing the match text (default: %(default)s)")
+    parser.add_argument("--binary-files", dest="binaryFiles", type=float, default=defaults.binaryFiles,
+        help="fraction of binary files (default: %(default)s)")
+    parser.add_argument("--odd-names", dest="oddNames", type=float, default=defaults.oddNames,
+        help="fraction of files with unusual names (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=defaults.seed,
+        help="random seed (default: %(default)s)")
+
+def treeOptionsFromArguments (args):
+    options = TreeOptions()
+    for name in options.toDict():
+        setattr(options, name, getattr(args, name))
+    return options
+
+
+def main ():
+    parser = argparse.ArgumentParser(description="Generates a directory tree for search benchmarks.")
+    parser.add_argument("directory", help="where to create the tree (must not exist, or be empty)")
+    addTreeArguments(parser)
+    args = parser.parse_args()
+
+    options = treeOptionsFromArguments(args)
+    try:
+        stats = generateTree(args.directory, options)
+    except ValueError as e:
+        parser.error(str(e))
+    json.dump({"options": options.toDict(), "tree": stats}, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()